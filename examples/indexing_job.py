@@ -5,20 +5,22 @@ import faiss
 import numpy as np
 from google.protobuf import text_format
 
-from needlestack.apis import data_sources_pb2, indices_pb2, collections_pb2, serializers, indexing
+from needlestack.apis import (
+    data_sources_pb2,
+    indices_pb2,
+    collections_pb2,
+    serializers,
+    indexing,
+)
 from needlestack.indices.faiss_indices import FaissIndex
 
-
 script_dir = os.path.dirname(os.path.realpath(__file__))
 app_dir = os.path.dirname(script_dir)
 data_dir = os.path.join(app_dir, "data")
 
 
 def generate_shard_data(
-    id_prefix: str,
-    dimension: int = 64,
-    count: int = 1000,
-    seed: int = 42
+    id_prefix: str, dimension: int = 64, count: int = 1000, seed: int = 42
 ) -> Tuple[np.ndarray, List[indices_pb2.Metadata]]:
     """Create random vector and metadatas for a shard"""
     np.random.seed(seed)
@@ -42,10 +44,19 @@ def create_index(X: np.ndarray) -> faiss.Index:
     return index
 
 
-def create_shard_proto(collection_name: str, name: str) -> collections_pb2.Shard:
-    """Creates a shard protobuf that points to a local data source file"""
+def create_shard_proto(
+    collection_name: str,
+    name: str,
+    X: np.ndarray,
+    metadatas: List[indices_pb2.Metadata],
+) -> collections_pb2.Shard:
+    """Creates a shard protobuf that points to a local data source file, with
+    a filter over its ids so Retrieve requests skip shards without the id and
+    a summary of its vectors so Search requests can skip distant shards"""
     return collections_pb2.Shard(
         name=name,
+        id_filter=indexing.create_id_filter(metadatas),
+        summary=indexing.create_shard_summary(X),
         index=indices_pb2.BaseIndex(
             faiss_index=indices_pb2.FaissIndex(
                 data_source=data_sources_pb2.DataSource(
@@ -54,17 +65,19 @@ def create_shard_proto(collection_name: str, name: str) -> collections_pb2.Shard
                     )
                 )
             )
-        )
+        ),
     )
 
 
-def create_collection_proto(name: str, shards: List[collections_pb2.Shard], replication_factor: int) -> collections_pb2.Collection:
+def create_collection_proto(
+    name: str, shards: List[collections_pb2.Shard], replication_factor: int
+) -> collections_pb2.Collection:
     """Creates a collection protobuf which a list of shards protobufs"""
     return collections_pb2.Collection(
         name=name,
         replication_factor=replication_factor,
         enable_id_to_vector=True,
-        shards=shards
+        shards=shards,
     )
 
 
@@ -90,6 +103,7 @@ def main():
 
     seed = 1
     for collection, shards in collections:
+        shard_protos = []
         for shard in shards:
             X, metadatas = generate_shard_data(shard, seed=seed)
             index = create_index(X)
@@ -100,15 +114,12 @@ def main():
             with open(get_shard_filename(collection, shard), "wb") as f:
                 f.write(faiss_index_proto.SerializeToString())
 
+            shard_protos.append(create_shard_proto(collection, shard, X, metadatas))
             seed += 1
 
         # Create a collection proto with the shard protos that point to the
         # local data sources that were just generated
-        collection_proto = create_collection_proto(
-            collection,
-            [create_shard_proto(collection, shard) for shard in shards],
-            2
-        )
+        collection_proto = create_collection_proto(collection, shard_protos, 2)
 
         # Write those collection proto to disk to use later
         with open(get_collection_filename(collection), "w") as f:
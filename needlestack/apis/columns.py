@@ -0,0 +1,195 @@
+from typing import Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+
+from needlestack.apis import indices_pb2
+from needlestack.apis import serializers
+
+VALUE_TYPE_TO_DTYPE = {
+    "double_val": "float64",
+    "float_val": "float32",
+    "long_val": "int64",
+    "int_val": "int32",
+    "bool_val": "int8",
+}
+
+ColumnValues = Union[np.ndarray, List[str]]
+
+
+def items_to_columns(
+    items: Sequence[indices_pb2.SearchResultItem],
+) -> indices_pb2.SearchResultColumns:
+    """Pack search results into columns, one per metadata field name and value
+    type. Distances are float64 if any item has a double distance.
+
+    Args:
+        items: Search results sorted by distance
+    """
+    double = any(item.WhichOneof("distance") == "double_distance" for item in items)
+    distances = np.array(
+        [item.double_distance or item.float_distance for item in items],
+        dtype="float64" if double else "float32",
+    )
+    return metadatas_to_columns(distances, [item.metadata for item in items])
+
+
+def metadatas_to_columns(
+    distances: np.ndarray, metadatas: Sequence[indices_pb2.Metadata]
+) -> indices_pb2.SearchResultColumns:
+    """Pack distances and the metadata of each result into columns, without
+    building a search result item per result
+
+    Args:
+        distances: Distances sorted ascending, or descending by inner product
+        metadatas: Metadata of the result at each distance
+    """
+    fields: Dict[Tuple[str, str], Tuple[List[int], list]] = {}
+    for row, metadata in enumerate(metadatas):
+        for field in metadata.fields:
+            value_type = field.WhichOneof("value") or ""
+            rows, values = fields.setdefault((field.name, value_type), ([], []))
+            rows.append(row)
+            if value_type:
+                values.append(getattr(field, value_type))
+
+    columns = indices_pb2.SearchResultColumns(
+        distances=serializers.ndarray_to_proto(distances),
+        ids=[metadata.id for metadata in metadatas],
+    )
+    for (name, value_type), (rows, values) in fields.items():
+        if value_type in VALUE_TYPE_TO_DTYPE:
+            values = np.array(values, dtype=VALUE_TYPE_TO_DTYPE[value_type])
+        columns.fields.append(
+            _column(
+                name, value_type, np.array(rows, dtype="int32"), values, len(metadatas)
+            )
+        )
+    return columns
+
+
+def columns_to_items(
+    columns: indices_pb2.SearchResultColumns,
+) -> List[indices_pb2.SearchResultItem]:
+    """Unpack columns into search result items, for clients that want them.
+    Each item's fields come back in column order.
+
+    Args:
+        columns: Search results packed by column
+    """
+    distances = serializers.proto_to_ndarray(columns.distances)
+    distance_type = (
+        "double_distance" if distances.dtype == "float64" else "float_distance"
+    )
+    items = [
+        indices_pb2.SearchResultItem(
+            metadata=indices_pb2.Metadata(id=id), **{distance_type: distance}
+        )
+        for distance, id in zip(distances.tolist(), columns.ids)
+    ]
+
+    for column in columns.fields:
+        rows = _column_rows(column, len(items)).tolist()
+        values = _column_values(column)
+        if isinstance(values, np.ndarray):
+            values = values.tolist()
+        for i, row in enumerate(rows):
+            field = items[row].metadata.fields.add(name=column.name)
+            if column.value_type:
+                setattr(field, column.value_type, values[i])
+    return items
+
+
+def merge_columns(
+    columns_list: Sequence[indices_pb2.SearchResultColumns],
+    count: int,
+    descending: bool = False,
+) -> indices_pb2.SearchResultColumns:
+    """Merge sorted column batches of search results into the closest count
+    results, by sorting the distance vectors and gathering ids and metadata
+    columns by position rather than building a message per item. Ties keep the
+    order of the batches, like a heap merge of items.
+
+    Args:
+        columns_list: Batches of results sorted by distance
+        count: Number of results to return
+        descending: Batches are sorted by descending inner product
+    """
+    distances = [serializers.proto_to_ndarray(c.distances) for c in columns_list]
+    offsets = np.cumsum([0] + [len(d) for d in distances])
+    all_distances = np.concatenate(distances) if distances else np.zeros(0)
+
+    keys = -all_distances if descending else all_distances
+    order = np.argsort(keys, kind="stable")[:count]
+    positions = np.full(len(all_distances), -1, dtype="int64")
+    positions[order] = np.arange(len(order))
+
+    ids = [id for columns in columns_list for id in columns.ids]
+    merged = indices_pb2.SearchResultColumns(
+        distances=serializers.ndarray_to_proto(all_distances[order]),
+        ids=[ids[i] for i in order],
+    )
+
+    fields: Dict[Tuple[str, str], Tuple[List[np.ndarray], List[ColumnValues]]] = {}
+    for offset, columns in zip(offsets, columns_list):
+        for column in columns.fields:
+            rows = positions[offset + _column_rows(column, len(columns.ids))]
+            kept = np.flatnonzero(rows >= 0)
+            if not len(kept):
+                continue
+            values = _column_values(column)
+            batches = fields.setdefault((column.name, column.value_type), ([], []))
+            batches[0].append(rows[kept])
+            if isinstance(values, np.ndarray):
+                batches[1].append(values[kept])
+            elif values:
+                batches[1].append([values[i] for i in kept])
+
+    for (name, value_type), (row_batches, value_batches) in fields.items():
+        rows = np.concatenate(row_batches)
+        by_row = np.argsort(rows, kind="stable")
+        if value_type in VALUE_TYPE_TO_DTYPE:
+            values = np.concatenate(value_batches)[by_row]
+        else:
+            flat = [value for batch in value_batches for value in batch]
+            values = [flat[i] for i in by_row] if flat else []
+        merged.fields.append(
+            _column(name, value_type, rows[by_row], values, len(order))
+        )
+    return merged
+
+
+def _column(
+    name: str,
+    value_type: str,
+    rows: np.ndarray,
+    values: ColumnValues,
+    num_rows: int,
+) -> indices_pb2.MetadataColumn:
+    column = indices_pb2.MetadataColumn(name=name, value_type=value_type)
+    if len(rows) != num_rows or not np.array_equal(rows, np.arange(num_rows)):
+        column.rows.CopyFrom(serializers.ndarray_to_proto(rows.astype("int32")))
+    if value_type == "string_val":
+        column.string_values.extend(values)
+    elif value_type:
+        column.values.CopyFrom(
+            serializers.ndarray_to_proto(
+                np.asarray(values), VALUE_TYPE_TO_DTYPE[value_type]
+            )
+        )
+    return column
+
+
+def _column_rows(column: indices_pb2.MetadataColumn, num_rows: int) -> np.ndarray:
+    if column.HasField("rows"):
+        return serializers.proto_to_ndarray(column.rows).astype("int64")
+    return np.arange(num_rows)
+
+
+def _column_values(column: indices_pb2.MetadataColumn) -> ColumnValues:
+    if column.value_type == "string_val":
+        return list(column.string_values)
+    elif column.value_type == "bool_val":
+        return serializers.proto_to_ndarray(column.values).astype(bool)
+    elif column.value_type:
+        return serializers.proto_to_ndarray(column.values)
+    return []
@@ -1,14 +1,15 @@
 from typing import List, TYPE_CHECKING
 
+from needlestack.apis import collections_pb2
 from needlestack.apis import indices_pb2
 from needlestack.indices import BaseIndex
 
-
 """Developers could choose to use a different index implementation,
 so only import packages when needed so developers don't need to
 install packages they won't use"""
 if TYPE_CHECKING:
     import faiss
+    import numpy as np
 
 
 def create_faiss_index_shard(
@@ -24,3 +25,72 @@ def create_faiss_index_shard(
     index.populate({"index": faiss_index, "metadatas": metadatas})
 
     return index
+
+
+def create_scalar_quantized_index_shard(
+    X: "np.ndarray",
+    metadatas: List[indices_pb2.Metadata],
+    code_type: str = "int8",
+    inner_product: bool = False,
+) -> BaseIndex:
+    """Create a serializable ScalarQuantizedIndex from vectors and their metadata.
+    Int8 codes take a quarter of the memory of float32 vectors and float16 codes
+    half, while search results are re-ranked against the original vectors.
+
+    Args:
+        X: Matrix of vectors
+        metadatas: Metadata for each vector
+        code_type: Either int8 or float16
+        inner_product: Rank by inner product instead of squared L2 distance
+    """
+    from needlestack.indices.quantized_indices import (
+        ScalarQuantizer,
+        ScalarQuantizedIndex,
+    )
+
+    quantizer = ScalarQuantizer.train(X, code_type, inner_product)
+    index = ScalarQuantizedIndex()
+    index.populate(
+        {
+            "quantizer": quantizer,
+            "codes": quantizer.encode(X),
+            "vectors": X,
+            "metadatas": metadatas,
+        }
+    )
+
+    return index
+
+
+def create_shard_summary(
+    X: "np.ndarray", num_centroids: int = 16, inner_product: bool = False
+) -> collections_pb2.ShardSummary:
+    """Create a summary of a shard's vectors, to set as the shard's summary so
+    Mergers can skip shards that cannot hold a query's nearest neighbors. A few
+    centroids per shard are enough when shards are partitioned by similarity,
+    like by clustering the whole collection first.
+
+    Args:
+        X: Matrix of every vector in the shard
+        num_centroids: Max number of centroids
+        inner_product: Whether the shard's index ranks by inner product
+    """
+    from needlestack.utilities.shard_summary import ShardSummary
+
+    return ShardSummary.from_vectors(X, num_centroids, inner_product).to_proto()
+
+
+def create_id_filter(
+    metadatas: List[indices_pb2.Metadata], false_positive_rate: float = 0.01
+) -> collections_pb2.IdFilter:
+    """Create a Bloom filter over the ids in a shard, to set as the shard's
+    id_filter so Mergers only send Retrieve requests to shards that may have an id.
+    The filter takes about 1.2 bytes per id at a 1% false positive rate, so filters
+    for large shards should be written to a data source rather than kept inline.
+    """
+    from needlestack.utilities.bloom import BloomFilter
+
+    bloom = BloomFilter.from_ids(
+        [metadata.id for metadata in metadatas], false_positive_rate
+    )
+    return bloom.to_proto()
@@ -1,5 +1,7 @@
+import shutil
+import tempfile
 from itertools import repeat
-from typing import Any, Tuple, Optional, List, Union
+from typing import Any, Tuple, Optional, List, Union, BinaryIO, Iterator
 
 import numpy as np
 
@@ -72,6 +74,8 @@ def proto_to_ndarray(proto: tensors_pb2.NDArray) -> np.ndarray:
 
     if proto.numpy_content and dtype:
         return np.frombuffer(proto.numpy_content, dtype=dtype).reshape(*proto.shape)
+    elif 0 in proto.shape and dtype:
+        return np.empty(tuple(proto.shape), dtype=dtype)
     elif proto.float_val:
         dtype = dtype or "float32"
         return np.array(proto.float_val, dtype=dtype).reshape(*proto.shape)
@@ -172,3 +176,138 @@ def metadata_field_to_proto(
         )
 
     return proto
+
+
+class FieldReader(object):
+    """A file-like view over the value of one length-delimited protobuf field
+
+    Attributes:
+        number: Field number
+        length: Number of bytes in the field value
+        remaining: Number of bytes not yet read
+        offset: Position of the field value in the stream, or None if the
+            stream is not seekable
+    """
+
+    number: int
+    length: int
+    remaining: int
+    offset: Optional[int]
+
+    def __init__(
+        self, stream: BinaryIO, number: int, length: int, offset: Optional[int] = None
+    ):
+        self._stream = stream
+        self.number = number
+        self.length = length
+        self.remaining = length
+        self.offset = offset
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        if size == 0:
+            return b""
+        if size == self.remaining:
+            data = _read_exactly(self._stream, size)
+        else:
+            data = self._stream.read(size)
+            if not data:
+                raise DeserializationError("Unexpected end of stream in field")
+        self.remaining -= len(data)
+        return data
+
+    def skip(self):
+        while self.remaining:
+            self.read(min(self.remaining, 1024 ** 2))
+
+
+def iter_proto_fields(stream: BinaryIO) -> Iterator[FieldReader]:
+    """Incrementally walk the top-level fields of a serialized protobuf message
+    from a binary stream, so large messages can be parsed without first reading
+    them into memory. Only length-delimited fields (bytes, strings, messages,
+    packed repeated) are yielded, other wire types are skipped. Any part of a
+    field value not read by the caller is skipped before the next field.
+
+    Args:
+        stream: Binary file-like object positioned at the start of a message
+    """
+    while True:
+        tag = _read_varint(stream, allow_eof=True)
+        if tag is None:
+            return
+
+        number, wire_type = tag >> 3, tag & 0x7
+        if wire_type == _WIRETYPE_VARINT:
+            _read_varint(stream)
+        elif wire_type == _WIRETYPE_FIXED64:
+            _read_exactly(stream, 8)
+        elif wire_type == _WIRETYPE_FIXED32:
+            _read_exactly(stream, 4)
+        elif wire_type == _WIRETYPE_LENGTH_DELIMITED:
+            length = _read_varint(stream)
+            offset = stream.tell() if stream.seekable() else None
+            field = FieldReader(stream, number, length, offset)
+            yield field
+            field.skip()
+        else:
+            raise DeserializationError(f"Unsupported wire type {wire_type}")
+
+
+def read_array(
+    field: FieldReader, filename: Optional[str] = None, spill: bool = False
+) -> Union[bytes, np.ndarray]:
+    """Memory-map a bytes field when it is in a local file, otherwise read it.
+    The mapping stays valid after the file is removed.
+
+    Args:
+        field: Field being read from a serialized protobuf
+        filename: Optional name of the file being read
+        spill: Copy fields that cannot be mapped to a temporary file and map
+            that, rather than reading them into memory
+    """
+    if field.length == 0:
+        return field.read()
+    elif filename is not None and field.offset is not None:
+        return np.memmap(
+            filename, dtype="uint8", mode="r", offset=field.offset, shape=(field.length,)
+        )
+    elif spill:
+        with tempfile.NamedTemporaryFile() as f:
+            shutil.copyfileobj(field, f)
+            f.flush()
+            return np.memmap(f.name, dtype="uint8", mode="r", shape=(field.length,))
+    else:
+        return field.read()
+
+
+_WIRETYPE_VARINT = 0
+_WIRETYPE_FIXED64 = 1
+_WIRETYPE_LENGTH_DELIMITED = 2
+_WIRETYPE_FIXED32 = 5
+
+
+def _read_varint(stream: BinaryIO, allow_eof: bool = False) -> Optional[int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            if allow_eof and shift == 0:
+                return None
+            raise DeserializationError("Unexpected end of stream in varint")
+        result |= (byte[0] & 0x7F) << shift
+        if not byte[0] & 0x80:
+            return result
+        shift += 7
+
+
+def _read_exactly(stream: BinaryIO, size: int) -> bytes:
+    chunks = []
+    while size > 0:
+        data = stream.read(size)
+        if not data:
+            raise DeserializationError("Unexpected end of stream")
+        chunks.append(data)
+        size -= len(data)
+    return b"".join(chunks)
@@ -0,0 +1,144 @@
+import struct
+from typing import BinaryIO, Iterable, List
+
+import numpy as np
+
+from needlestack.apis import indices_pb2
+from needlestack.apis import servicers_pb2
+
+# Wire types from the protobuf encoding spec
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+_FLOAT_DISTANCE_TAG = bytes(
+    [indices_pb2.SearchResultItem.FLOAT_DISTANCE_FIELD_NUMBER << 3 | FIXED32]
+)
+_DOUBLE_DISTANCE_TAG = bytes(
+    [indices_pb2.SearchResultItem.DOUBLE_DISTANCE_FIELD_NUMBER << 3 | FIXED64]
+)
+_METADATA_TAG = bytes(
+    [indices_pb2.SearchResultItem.METADATA_FIELD_NUMBER << 3 | LENGTH_DELIMITED]
+)
+_METADATA_ID_TAG = bytes([indices_pb2.Metadata.ID_FIELD_NUMBER << 3 | LENGTH_DELIMITED])
+_ITEMS_TAG = bytes(
+    [servicers_pb2.SearchResponse.ITEMS_FIELD_NUMBER << 3 | LENGTH_DELIMITED]
+)
+_DESCENDING_TRUE = bytes(
+    [servicers_pb2.SearchResponse.DESCENDING_FIELD_NUMBER << 3 | VARINT, 1]
+)
+
+
+def encode_varint(value: int) -> bytes:
+    """Encode a non-negative integer as a protobuf varint"""
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append(value & 0x7F | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def encode_field_header(number: int, length: int) -> bytes:
+    """Encode the tag and length that precede a length-delimited field
+
+    Args:
+        number: Field number
+        length: Number of bytes in the field value
+    """
+    return encode_varint(number << 3 | LENGTH_DELIMITED) + encode_varint(length)
+
+
+def write_field(f: BinaryIO, number: int, value) -> None:
+    """Write a length-delimited field to a file
+
+    Args:
+        f: Binary file to write to
+        number: Field number
+        value: Bytes, or a contiguous array written without copying
+    """
+    value = memoryview(value).cast("B")
+    f.write(encode_field_header(number, len(value)))
+    f.write(value)
+
+
+def encode_metadata_id(id: str) -> bytes:
+    """Encode a Metadata with only an id"""
+    content = id.encode("utf-8")
+    return _METADATA_ID_TAG + encode_varint(len(content)) + content
+
+
+def encode_search_result_item(
+    distance: float, metadata: bytes, double: bool = False
+) -> bytes:
+    """Encode a SearchResultItem around already encoded metadata, byte for
+    byte what SearchResultItem.SerializeToString would produce
+
+    Args:
+        distance: Distance of the item
+        metadata: Encoded Metadata of the item
+        double: Encode distance as double_distance rather than float_distance
+    """
+    if double:
+        encoded_distance = _DOUBLE_DISTANCE_TAG + struct.pack("<d", distance)
+    else:
+        encoded_distance = _FLOAT_DISTANCE_TAG + struct.pack("<f", distance)
+    return encoded_distance + _METADATA_TAG + encode_varint(len(metadata)) + metadata
+
+
+def encode_search_response(items: Iterable[bytes], descending: bool = False) -> bytes:
+    """Encode a SearchResponse from encoded SearchResultItems
+
+    Args:
+        items: Encoded items sorted by distance
+        descending: Items are ranked by descending inner product
+    """
+    parts = []
+    for item in items:
+        parts.append(_ITEMS_TAG)
+        parts.append(encode_varint(len(item)))
+        parts.append(item)
+    if descending:
+        parts.append(_DESCENDING_TRUE)
+    return b"".join(parts)
+
+
+class MetadataBlob(object):
+    """Encoded metadata of every item in an index, concatenated into one
+    buffer and sliced by offset, so search results can splice in metadata
+    bytes instead of copying and serializing Metadata messages
+
+    Attributes:
+        data: Concatenated encoded Metadata messages
+        offsets: Start of each item's metadata in data, with the end of the last
+    """
+
+    data: bytes
+    offsets: np.ndarray
+
+    def __init__(self, data: bytes, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_encoded(cls, encoded: List[bytes]) -> "MetadataBlob":
+        offsets = np.zeros(len(encoded) + 1, dtype="int64")
+        np.cumsum([len(content) for content in encoded], out=offsets[1:])
+        return cls(b"".join(encoded), offsets)
+
+    @classmethod
+    def from_metadatas(cls, metadatas: List[indices_pb2.Metadata]) -> "MetadataBlob":
+        return cls.from_encoded(
+            [metadata.SerializeToString() for metadata in metadatas]
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> bytes:
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.data[start:end]
+
+    def decode(self, i: int) -> indices_pb2.Metadata:
+        return indices_pb2.Metadata.FromString(self[i])
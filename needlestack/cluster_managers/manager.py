@@ -70,3 +70,17 @@ class ClusterManager(object):
         then return all shards.
         """
         raise NotImplementedError()
+
+    def get_shards(
+        self, collection_name: str, shard_names: Optional[List[str]] = None
+    ) -> List[collections_pb2.Shard]:
+        """Get shard definitions, without replicas, for specified shards in a collection.
+        If no shards are provided then return all shards.
+        """
+        raise NotImplementedError()
+
+    def get_collection(
+        self, collection_name: str
+    ) -> Optional[collections_pb2.Collection]:
+        """Get a collection definition without its shards"""
+        raise NotImplementedError()
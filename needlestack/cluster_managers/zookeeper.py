@@ -1,7 +1,7 @@
 import logging
 import signal
 from copy import deepcopy
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import kazoo
 from kazoo.client import KazooClient, KazooState
@@ -49,6 +49,7 @@ class ZookeeperClusterManager(ClusterManager):
     hostport: str
     zk: KazooClient
     cache: TreeCache
+    shards_cache: Dict[str, Tuple[int, collections_pb2.Shard]]
 
     def __init__(
         self, cluster_name: str, hostport: str, hosts: List[str], zookeeper_root: str
@@ -59,6 +60,7 @@ class ZookeeperClusterManager(ClusterManager):
         self.zk = KazooClient(hosts=hosts)
         self.zk.add_listener(self.zk_listener)
         self.cache = TreeCache(self.zk, self.base_znode)
+        self.shards_cache = {}
 
     @property
     def base_znode(self):
@@ -307,6 +309,41 @@ class ZookeeperClusterManager(ClusterManager):
 
         return shard_hostports
 
+    def get_collection(self, collection_name):
+        node = self.cache.get_data(self.collection_znode(collection_name))
+        if node is None:
+            return None
+        return collections_pb2.Collection.FromString(node.data)
+
+    def get_shards(self, collection_name, shard_names=None):
+        if not shard_names:
+            shards_znode = self.shard_znode(collection_name)
+            shard_names = self.cache.get_children(shards_znode, [])
+
+        shards = []
+        for shard_name in shard_names:
+            shard = self._get_shard(collection_name, shard_name)
+            if shard is not None:
+                shards.append(shard)
+        return shards
+
+    def _get_shard(
+        self, collection_name: str, shard_name: str
+    ) -> Optional[collections_pb2.Shard]:
+        """Get a shard from the tree cache. Parsed shards are kept until their
+        ZNode is modified, so callers get the same object between changes."""
+        shard_znode = self.shard_znode(collection_name, shard_name)
+        node = self.cache.get_data(shard_znode)
+        if node is None:
+            self.shards_cache.pop(shard_znode, None)
+            return None
+
+        cached = self.shards_cache.get(shard_znode)
+        if cached is None or cached[0] != node.stat.mzxid:
+            cached = (node.stat.mzxid, collections_pb2.Shard.FromString(node.data))
+            self.shards_cache[shard_znode] = cached
+        return cached[1]
+
     def _get_searchers_for_shard(
         self, collection_name: str, shard_name: str, active: bool = True
     ) -> List[str]:
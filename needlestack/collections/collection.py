@@ -1,12 +1,15 @@
+import os
 import heapq
-from typing import List, Dict, Iterable, Optional
+from typing import Callable, List, Dict, Iterable, Optional, Tuple
 
 import numpy as np
 
 from needlestack.apis import indices_pb2
 from needlestack.apis import collections_pb2
 from needlestack.collections.shard import Shard
+from needlestack.collections.loader import ShardLoader
 from needlestack.exceptions import DimensionMismatchException
+from needlestack.indices.index import SearchResult, result_distance
 
 
 class Collection(object):
@@ -18,6 +21,10 @@ class Collection(object):
         shards: Dictionary of shard names to shards
         replication_factor: Number of replicas per shard in the cluster
         enable_id_to_vector: Enable retrieving vector from id
+        enable_metadata_index: Enable filtering queries by metadata
+        enable_updates: Enable upserts and deletes on shards
+        wal_directory: Directory for shard write-ahead logs, needed for updates
+        wal_fsync: Sync write-ahead logs to disk on every change
         dimension: Dimensionality of the vectors
     """
 
@@ -25,6 +32,10 @@ class Collection(object):
     shards: Dict[str, Shard]
     replication_factor: int
     enable_id_to_vector: bool
+    enable_metadata_index: bool
+    enable_updates: bool
+    wal_directory: Optional[str] = None
+    wal_fsync: bool = True
     dimension: int
 
     @classmethod
@@ -37,21 +48,43 @@ class Collection(object):
         self.name = proto.name
         self.replication_factor = proto.replication_factor
         self.enable_id_to_vector = proto.enable_id_to_vector
+        self.enable_metadata_index = proto.enable_metadata_index
+        self.enable_updates = proto.enable_updates
         self.shards = {}
 
         shards = [Shard.from_proto(shard_proto) for shard_proto in proto.shards]
         for shard in shards:
             shard.enable_id_to_vector = self.enable_id_to_vector
+            shard.enable_metadata_index = self.enable_metadata_index
             self.add_shard(shard)
 
     def merge_proto(self, proto):
         self.replication_factor = proto.replication_factor
         self.enable_id_to_vector = proto.enable_id_to_vector
-
-    def load(self):
+        self.enable_metadata_index = proto.enable_metadata_index
+        self.enable_updates = proto.enable_updates
+
+    def load(
+        self,
+        loader: Optional[ShardLoader] = None,
+        on_load: Optional[Callable[[Shard], None]] = None,
+    ):
+        """Load shards with updates available
+
+        Args:
+            loader: Loader that pipelines shard loads, defaults to a ShardLoader
+            on_load: Optional function called with each shard once it loads
+        """
         for shard in self.shards.values():
             shard.enable_id_to_vector = self.enable_id_to_vector
-            shard.load()
+            shard.enable_metadata_index = self.enable_metadata_index
+            shard.wal_fsync = self.wal_fsync
+            if self.enable_updates and self.wal_directory:
+                shard.wal_directory = os.path.join(
+                    self.wal_directory, self.name, shard.name
+                )
+        loader = loader or ShardLoader()
+        loader.load(list(self.shards.values()), on_load)
         self.validate()
 
     def update_available(self) -> bool:
@@ -60,6 +93,12 @@ class Collection(object):
                 return True
         return False
 
+    def revalidate(self):
+        """Refresh what every shard knows about its data source, once per
+        check for updates"""
+        for shard in self.shards.values():
+            shard.revalidate()
+
     def validate(self):
         shard_dimensions = {shard.index.dimension for shard in self.shards.values()}
         if len(shard_dimensions) > 1:
@@ -75,14 +114,63 @@ class Collection(object):
         del self.shards[name]
 
     def query(
-        self, X: np.ndarray, k: int, shard_names: List[str]
-    ) -> Iterable[indices_pb2.SearchResultItem]:
-        shard_results = [
-            self.shards[shard_name].query(X, k) for shard_name in shard_names
+        self,
+        X: np.ndarray,
+        k: int,
+        shard_names: List[str],
+        metadata_filter: Optional[indices_pb2.MetadataFilter] = None,
+        params: Optional[indices_pb2.SearchParams] = None,
+        bound: Optional[float] = None,
+        projection: Optional[indices_pb2.MetadataProjection] = None,
+        encoded: bool = False,
+        columnar: bool = False,
+    ) -> Iterable[SearchResult]:
+        return self.query_batch(
+            X,
+            k,
+            shard_names,
+            metadata_filter,
+            params,
+            bound,
+            projection,
+            encoded,
+            columnar,
+        )[0]
+
+    def query_batch(
+        self,
+        X: np.ndarray,
+        k: int,
+        shard_names: List[str],
+        metadata_filter: Optional[indices_pb2.MetadataFilter] = None,
+        params: Optional[indices_pb2.SearchParams] = None,
+        bound: Optional[float] = None,
+        projection: Optional[indices_pb2.MetadataProjection] = None,
+        encoded: bool = False,
+        columnar: bool = False,
+    ) -> List[Iterable[SearchResult]]:
+        """Merged results of the shards for each row of X"""
+        shard_batches = [
+            self.shards[shard_name].query_batch(
+                X, k, metadata_filter, params, bound, projection, encoded, columnar
+            )
+            for shard_name in shard_names
+        ]
+        if not shard_batches:
+            return [[] for _ in range(len(X))]
+
+        sign = -1 if self.inner_product else 1
+        return [
+            heapq.merge(*shard_results, key=lambda x: sign * result_distance(x))
+            for shard_results in zip(*shard_batches)
         ]
-        return heapq.merge(
-            *shard_results, key=lambda x: x.float_distance or x.double_distance
-        )
+
+    @property
+    def inner_product(self) -> bool:
+        """Whether shards rank by descending inner product"""
+        for shard in self.shards.values():
+            return shard.index.inner_product
+        return False
 
     def retrieve(
         self, id: str, shard_names: List[str]
@@ -92,3 +180,49 @@ class Collection(object):
             if retrieval_item is not None:
                 return retrieval_item
         return None
+
+    def retrieve_batch(
+        self, ids: List[str], shard_names: List[str]
+    ) -> Tuple[np.ndarray, List[indices_pb2.Metadata]]:
+        """Returns a matrix of vectors and their metadata for the ids found
+        in any of the shards, in the order of the given ids
+
+        Args:
+            ids: IDs to find
+            shard_names: Shards to look in
+        """
+        remaining = list(ids)
+        matrices, metadatas = [], []
+        for shard_name in shard_names:
+            if not remaining:
+                break
+            X, shard_metadatas = self.shards[shard_name].retrieve_batch(remaining)
+            if shard_metadatas:
+                found = {metadata.id for metadata in shard_metadatas}
+                remaining = [id for id in remaining if id not in found]
+                matrices.append(X)
+                metadatas.extend(shard_metadatas)
+
+        if not metadatas:
+            return np.empty((0, self.dimension), dtype="float32"), []
+
+        X = np.vstack(matrices)
+        rows = {metadata.id: i for i, metadata in enumerate(metadatas)}
+        order = [rows[id] for id in dict.fromkeys(ids) if id in rows]
+        return X[order], [metadatas[i] for i in order]
+
+    def upsert(
+        self, shard_name: str, X: np.ndarray, metadatas: List[indices_pb2.Metadata]
+    ) -> int:
+        """Insert or replace vectors by metadata id in one shard"""
+        return self.shards[shard_name].upsert(X, metadatas)
+
+    def delete(self, ids: List[str], shard_names: List[str]) -> int:
+        """Delete vectors by metadata id and return the number deleted"""
+        return sum(self.shards[shard_name].delete(ids) for shard_name in shard_names)
+
+    def compact(self, min_changes: int = 1):
+        """Compact shards with at least some number of pending changes"""
+        for shard in self.shards.values():
+            if shard.wal is not None and shard.pending_changes >= min_changes:
+                shard.compact()
@@ -0,0 +1,166 @@
+import logging
+import threading
+from concurrent import futures
+from contextlib import ExitStack
+from typing import Any, Callable, List, Optional, Tuple
+
+from needlestack.collections.shard import Shard
+
+logger = logging.getLogger("needlestack")
+
+
+class MemoryBudget(object):
+    """Limits the number of bytes held by shards that are being loaded.
+    A shard larger than the whole budget is let through once nothing else
+    is in flight, so it cannot block forever. Shards of unknown size are
+    not counted.
+
+    Attributes:
+        limit: Max number of bytes in flight, or None for no limit
+        in_use: Number of bytes in flight
+    """
+
+    limit: Optional[int]
+    in_use: int
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = limit
+        self.in_use = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size: Optional[int]):
+        if size is None:
+            return
+        with self._condition:
+            while (
+                self.limit is not None
+                and self.in_use > 0
+                and self.in_use + size > self.limit
+            ):
+                self._condition.wait()
+            self.in_use += size
+
+    def release(self, size: Optional[int]):
+        if size is None:
+            return
+        with self._condition:
+            self.in_use -= size
+            self._condition.notify_all()
+
+
+class ShardLoader(object):
+    """Loads shards concurrently as a two stage pipeline. The I/O stage
+    stages each shard's data with ``Shard.fetch`` and the CPU stage parses
+    and deserializes it with ``Shard.load``. Each stage has its own worker
+    limit, and a memory budget bounds how many bytes of shards can sit
+    between the start of a fetch and the end of a load. Data sources that
+    stage a stream, like GCS and HTTP, keep downloading while the CPU stage
+    parses, and count against the I/O worker limit until the load ends.
+
+    Attributes:
+        io_workers: Number of shards fetched at once
+        cpu_workers: Number of shards deserialized at once
+        memory_budget: Max bytes of shards in flight, or None for no limit
+    """
+
+    io_workers: int
+    cpu_workers: int
+    memory_budget: Optional[int]
+
+    def __init__(
+        self,
+        io_workers: int = 4,
+        cpu_workers: int = 2,
+        memory_budget: Optional[int] = None,
+    ):
+        self.io_workers = io_workers
+        self.cpu_workers = cpu_workers
+        self.memory_budget = memory_budget
+
+    def load(
+        self, shards: List[Shard], on_load: Optional[Callable[[Shard], None]] = None
+    ):
+        """Load all shards that have updates available. Raises the first
+        exception from any shard after every other shard has finished.
+
+        Args:
+            shards: Shards to load
+            on_load: Optional function called with each shard once it loads
+        """
+        budget = MemoryBudget(self.memory_budget)
+        downloads = threading.Semaphore(self.io_workers)
+        errors = []
+
+        with futures.ThreadPoolExecutor(
+            self.io_workers, thread_name_prefix="shard-io"
+        ) as io_executor, futures.ThreadPoolExecutor(
+            self.cpu_workers, thread_name_prefix="shard-cpu"
+        ) as cpu_executor:
+            fetch_futures = {
+                io_executor.submit(self._fetch, shard, budget, downloads): shard
+                for shard in shards
+            }
+
+            load_futures = []
+            for future in futures.as_completed(fetch_futures):
+                try:
+                    staged = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to fetch shard {fetch_futures[future].name}")
+                    errors.append(e)
+                    continue
+                if staged is not None:
+                    shard = fetch_futures[future]
+                    load_futures.append(
+                        cpu_executor.submit(self._load, shard, staged, on_load)
+                    )
+
+            for future in load_futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(e)
+
+        if errors:
+            raise errors[0]
+
+    def _fetch(
+        self, shard: Shard, budget: MemoryBudget, downloads: threading.Semaphore
+    ) -> Optional[Tuple[ExitStack, Any]]:
+        if not shard.update_available():
+            return None
+
+        size = shard.source_size
+        budget.acquire(size)
+        downloads.acquire()
+        stack = ExitStack()
+        stack.callback(budget.release, size)
+        try:
+            staged = stack.enter_context(shard.fetch())
+        except Exception:
+            downloads.release()
+            stack.close()
+            raise
+
+        if isinstance(staged, str) or staged is None:
+            downloads.release()
+        else:
+            stack.callback(downloads.release)
+        return stack, staged
+
+    def _load(
+        self,
+        shard: Shard,
+        staged: Tuple[ExitStack, Any],
+        on_load: Optional[Callable[[Shard], None]],
+    ):
+        stack, handle = staged
+        try:
+            shard.load(handle)
+        except Exception:
+            logger.error(f"Failed to load shard {shard.name}")
+            raise
+        finally:
+            stack.close()
+        if on_load is not None:
+            on_load(shard)
@@ -1,27 +1,62 @@
-from typing import List
+import heapq
+import itertools
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, List, Optional, Set, Tuple
 
 import numpy as np
 
 from needlestack.apis import indices_pb2
 from needlestack.apis import collections_pb2
+from needlestack.apis import serializers
+from needlestack.collections.wal import WriteAheadLog
+from needlestack.exceptions import UnsupportedIndexOperationException
 from needlestack.indices import BaseIndex
+from needlestack.indices.delta import DeltaIndex
+from needlestack.indices.index import SearchResult, result_distance
+
+logger = logging.getLogger("needlestack")
 
 
 class Shard(object):
 
     """A logical shard containing a index to perform kNN search.
 
+    Shards with a write-ahead log accept upserts and deletes. Changes go to
+    the log, then to a delta index that is searched next to the base index,
+    with tombstones hiding base rows that were deleted or replaced. Compaction
+    folds the changes into a new base index and snapshots it next to the log.
+
     Attributes:
         name: Name of shard
         weight: Weight of shard
         index: BaseIndex for kNN queries
         enable_id_to_vector: Enable retrieving vector from id
+        enable_metadata_index: Enable filtering queries by metadata
+        wal_directory: Directory for the write-ahead log, None to disable updates
+        wal_fsync: Sync the write-ahead log to disk on every change
+        wal: Write-ahead log, opened when the shard loads
+        delta: Index of vectors upserted since the base index was built
+        tombstones: Boolean array of base index rows hidden by changes
+        deleted_ids: IDs of the tombstoned base index rows
     """
 
     name: str
     weight: float
     index: BaseIndex
     enable_id_to_vector: bool = False
+    enable_metadata_index: bool = False
+    wal_directory: Optional[str] = None
+    wal_fsync: bool = True
+    wal: Optional[WriteAheadLog] = None
+    delta: Optional[DeltaIndex] = None
+    tombstones: Optional[np.ndarray] = None
+    deleted_ids: Set[str]
+
+    def __init__(self):
+        self.deleted_ids = set()
+        self._lock = threading.RLock()
 
     @classmethod
     def from_proto(cls, proto: collections_pb2.Shard) -> "Shard":
@@ -34,21 +69,257 @@ class Shard(object):
         self.weight = proto.weight
         self.index = BaseIndex.from_proto(proto.index)
 
-    def load(self):
+    @property
+    def source_size(self) -> int:
+        return self.index.source_size
+
+    @property
+    def pending_changes(self) -> int:
+        """Number of delta rows and tombstones not yet compacted"""
+        return (self.delta.count if self.delta else 0) + len(self.deleted_ids)
+
+    @contextmanager
+    def fetch(self):
+        """Stage the compacted snapshot if it is still current, otherwise the
+        base index from its data source"""
+        snapshot = self._current_snapshot()
+        if snapshot is not None:
+            yield snapshot
+        else:
+            with self.index.fetch() as staged:
+                yield staged
+
+    def load(self, staged: Any = None):
         self.index.enable_id_to_vector = self.enable_id_to_vector
-        self.index.load()
+        self.index.enable_metadata_index = self.enable_metadata_index
+        if self.wal_directory is None:
+            self.index.load(staged)
+            return
+
+        if self.wal is None:
+            self.wal = WriteAheadLog(self.wal_directory, self.wal_fsync)
+        self.wal.open(self.index.source_version)
+        self.index.load(staged or self.wal.snapshot_filename)
+
+        with self._lock:
+            self._reset_changes()
+            for record in self.wal.replay():
+                self._apply(record)
+        if self.pending_changes:
+            logger.info(f"Replayed {self.pending_changes} changes to shard {self.name}")
+
+    def _current_snapshot(self) -> Optional[str]:
+        if self.wal_directory is None:
+            return None
+        wal = self.wal or WriteAheadLog(self.wal_directory, self.wal_fsync)
+        if wal.version is not None and wal.version == self.index.source_version:
+            return wal.snapshot_filename
+        return None
 
     def update_available(self) -> bool:
         return self.index.update_available()
 
+    def revalidate(self) -> bool:
+        return self.index.revalidate()
+
     def set_vectors(self, X: np.ndarray, metadatas: List[indices_pb2.Metadata]):
         return self.index.set_vectors(X, metadatas)
 
     def add_vectors(self, X: np.ndarray, metadatas: List[indices_pb2.Metadata]):
         return self.index.add_vectors(X, metadatas)
 
-    def query(self, X: np.ndarray, k: int) -> List[indices_pb2.SearchResultItem]:
-        return self.index.query(X, k)[0]
+    def upsert(self, X: np.ndarray, metadatas: List[indices_pb2.Metadata]) -> int:
+        """Insert or replace vectors by metadata id. Returns the number of vectors.
+
+        Args:
+            X: Matrix of vectors
+            metadatas: Metadata for each vector
+        """
+        X = np.asarray(X).reshape(len(metadatas), -1)
+        if X.shape[1] != self.index.dimension:
+            raise ValueError(
+                f"Shard {self.name} expected vectors with dimension {self.index.dimension}, got {X.shape[1]}"
+            )
+        record = indices_pb2.WalRecord(
+            vectors=serializers.ndarray_to_proto(X), metadatas=metadatas
+        )
+        self._log_and_apply(record)
+        return len(metadatas)
+
+    def delete(self, ids: List[str]) -> int:
+        """Delete vectors by metadata id. Returns the number of vectors deleted.
+
+        Args:
+            ids: IDs within metadata
+        """
+        with self._lock:
+            self._check_updates_enabled()
+            delta_count = self.delta.count
+            tombstone_count = len(self.deleted_ids)
+            self._log_and_apply(indices_pb2.WalRecord(delete_ids=ids))
+            return (
+                delta_count - self.delta.count + len(self.deleted_ids) - tombstone_count
+            )
+
+    def compact(self):
+        """Build a new base index with the pending changes, snapshot it next to
+        the write-ahead log, and swap it in. Changes made while the new index
+        is built are replayed onto it."""
+        with self._lock:
+            self._check_updates_enabled()
+            if not self.pending_changes:
+                return
+            index, delta, sequence = self.index, self.delta.copy(), self.wal.sequence
+            tombstones = None if self.tombstones is None else self.tombstones.copy()
+
+        compacted = index.compact(tombstones, delta.vectors, delta.metadatas)
+        self.wal.write_snapshot(compacted.serialize().SerializeToString(), sequence)
+
+        with self._lock:
+            self.index = compacted
+            self._reset_changes()
+            for record in self.wal.replay(after=sequence):
+                self._apply(record)
+        logger.info(f"Compacted shard {self.name} to {compacted.count} vectors")
+
+    def _check_updates_enabled(self):
+        if self.wal is None or self.delta is None:
+            raise UnsupportedIndexOperationException(
+                f"Shard {self.name} is not loaded with a write-ahead log"
+            )
+        if not self.enable_id_to_vector:
+            raise UnsupportedIndexOperationException(
+                "Updates require enable_id_to_vector"
+            )
+
+    def _log_and_apply(self, record: indices_pb2.WalRecord):
+        with self._lock:
+            self._check_updates_enabled()
+            self.wal.append(record)
+            self._apply(record)
+
+    def _reset_changes(self):
+        self.delta = DeltaIndex(self.index.dimension, self.index.inner_product)
+        self.tombstones = None
+        self.deleted_ids = set()
+
+    def _apply(self, record: indices_pb2.WalRecord):
+        """Apply a record to the delta index and tombstones"""
+        if record.delete_ids:
+            ids = list(record.delete_ids)
+            self.delta.remove_vectors(ids)
+        else:
+            ids = [metadata.id for metadata in record.metadatas]
+            X = serializers.proto_to_ndarray(record.vectors)
+            self.delta.add_vectors(X, record.metadatas)
+
+        ids = [id for id in ids if id not in self.deleted_ids]
+        found = [
+            (id, i) for id, i in zip(ids, self.index.find_rows(ids)) if i is not None
+        ]
+        if found:
+            if self.tombstones is None:
+                self.tombstones = np.zeros(self.index.count, dtype=bool)
+            self.tombstones[[i for _, i in found]] = True
+            self.deleted_ids.update(id for id, _ in found)
+
+    def query(
+        self,
+        X: np.ndarray,
+        k: int,
+        metadata_filter: Optional[indices_pb2.MetadataFilter] = None,
+        params: Optional[indices_pb2.SearchParams] = None,
+        bound: Optional[float] = None,
+        projection: Optional[indices_pb2.MetadataProjection] = None,
+        encoded: bool = False,
+        columnar: bool = False,
+    ) -> List[SearchResult]:
+        return self.query_batch(
+            X, k, metadata_filter, params, bound, projection, encoded, columnar
+        )[0]
+
+    def query_batch(
+        self,
+        X: np.ndarray,
+        k: int,
+        metadata_filter: Optional[indices_pb2.MetadataFilter] = None,
+        params: Optional[indices_pb2.SearchParams] = None,
+        bound: Optional[float] = None,
+        projection: Optional[indices_pb2.MetadataProjection] = None,
+        encoded: bool = False,
+        columnar: bool = False,
+    ) -> List[List[SearchResult]]:
+        """Results for each row of X, like query returns for the first"""
+        with self._lock:
+            index, tombstones = self.index, self.tombstones
+            if tombstones is not None and len(tombstones) != index.count:
+                tombstones = None
+            delta_batches = None
+            if self.delta is not None and self.delta.count:
+                delta_batches = self.delta.query(
+                    X,
+                    k,
+                    metadata_filter,
+                    bound=bound,
+                    projection=projection,
+                    encoded=encoded,
+                    columnar=columnar,
+                )
+
+        batches = index.query(
+            X,
+            k,
+            metadata_filter,
+            tombstones,
+            params,
+            bound,
+            projection,
+            encoded,
+            columnar,
+        )
+        if delta_batches is None:
+            return batches
+
+        sign = -1 if index.inner_product else 1
+        return [
+            list(
+                itertools.islice(
+                    heapq.merge(
+                        results, delta_results, key=lambda x: sign * result_distance(x)
+                    ),
+                    k,
+                )
+            )
+            for results, delta_results in zip(batches, delta_batches)
+        ]
 
     def retrieve(self, id: str) -> indices_pb2.RetrievalResultItem:
-        return self.index.retrieve(id)
+        with self._lock:
+            if self.delta is not None and id in self.delta.rows:
+                return self.delta.retrieve(id)
+            if id in self.deleted_ids:
+                return indices_pb2.RetrievalResultItem()
+            index = self.index
+        return index.retrieve(id)
+
+    def retrieve_batch(
+        self, ids: List[str]
+    ) -> Tuple[np.ndarray, List[indices_pb2.Metadata]]:
+        with self._lock:
+            if self.delta is None or not self.pending_changes:
+                return self.index.get_vectors_and_metadatas(ids)
+
+            X_delta, delta_metadatas = self.delta.get_vectors_and_metadatas(ids)
+            base_ids = [
+                id
+                for id in ids
+                if id not in self.delta.rows and id not in self.deleted_ids
+            ]
+            index = self.index
+
+        X_base, base_metadatas = index.get_vectors_and_metadatas(base_ids)
+        metadatas = list(delta_metadatas) + list(base_metadatas)
+        X = np.vstack([X_delta.astype(X_base.dtype), X_base])
+        rows = {metadata.id: i for i, metadata in enumerate(metadatas)}
+        order = [rows[id] for id in dict.fromkeys(ids) if id in rows]
+        return X[order], [metadatas[i] for i in order]
@@ -0,0 +1,186 @@
+import os
+import json
+import struct
+import logging
+import zlib
+import threading
+from typing import IO, Iterator, Optional
+
+from needlestack.apis import indices_pb2
+
+logger = logging.getLogger("needlestack")
+
+_HEADER = struct.Struct("<II")
+
+
+class WriteAheadLog(object):
+    """Append-only log of changes to one shard, kept in a local directory next
+    to the shard's latest compacted snapshot. Records are framed with their
+    length and a CRC32, so a torn write at the end of the log is dropped on
+    open. The log belongs to one version of the shard's source data, and is
+    reset when the source changes.
+
+    Files in the directory:
+        MANIFEST: Source version and the last sequence in the snapshot
+        snapshot.pb: Serialized index with changes up to that sequence
+        wal.log: Records appended since the log was created
+
+    Attributes:
+        directory: Directory holding the log
+        fsync: Sync the log to disk before an append returns
+        version: Version of the source data the log applies to
+        snapshot_sequence: Last sequence included in the snapshot
+        sequence: Last sequence appended
+    """
+
+    directory: str
+    fsync: bool
+    version: Optional[str]
+    snapshot_sequence: int
+    sequence: int
+
+    def __init__(self, directory: str, fsync: bool = True):
+        self.directory = directory
+        self.fsync = fsync
+        self.version = None
+        self.snapshot_sequence = 0
+        self.sequence = 0
+        self._file: Optional[IO] = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        if os.path.exists(self.manifest_filename):
+            with open(self.manifest_filename) as f:
+                manifest = json.load(f)
+            self.version = manifest["version"]
+            self.snapshot_sequence = manifest["snapshot_sequence"]
+
+    @property
+    def manifest_filename(self) -> str:
+        return os.path.join(self.directory, "MANIFEST")
+
+    @property
+    def log_filename(self) -> str:
+        return os.path.join(self.directory, "wal.log")
+
+    @property
+    def snapshot_filename(self) -> Optional[str]:
+        """Filename of the compacted snapshot, if there is one"""
+        filename = os.path.join(self.directory, "snapshot.pb")
+        if self.snapshot_sequence and os.path.exists(filename):
+            return filename
+        return None
+
+    def open(self, version: Optional[str]):
+        """Open the log for a version of the source data. Logs and snapshots
+        for any other version are discarded.
+
+        Args:
+            version: Version of the source data, None if unknown
+        """
+        self.close()
+        if version is None or version != self.version:
+            if self.version is not None:
+                logger.info(f"Discarding write-ahead log in {self.directory}")
+            self.version = version
+            self.snapshot_sequence = 0
+            self._remove(os.path.join(self.directory, "snapshot.pb"))
+            self._remove(self.log_filename)
+            self._write_manifest()
+
+        self.sequence = self.snapshot_sequence
+        end = 0
+        if os.path.exists(self.log_filename):
+            for record, end in self._read_records():
+                self.sequence = max(self.sequence, record.sequence)
+        self._file = open(self.log_filename, "ab")
+        self._file.truncate(end)
+
+    def append(self, record: indices_pb2.WalRecord) -> int:
+        """Append a record and return its sequence"""
+        with self._lock:
+            self.sequence += 1
+            record.sequence = self.sequence
+            data = record.SerializeToString()
+            self._file.write(_HEADER.pack(len(data), zlib.crc32(data)) + data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            return self.sequence
+
+    def replay(self, after: int = 0) -> Iterator[indices_pb2.WalRecord]:
+        """Records not in the snapshot, in the order they were appended
+
+        Args:
+            after: Only yield records with a greater sequence
+        """
+        after = max(after, self.snapshot_sequence)
+        if os.path.exists(self.log_filename):
+            for record, _ in self._read_records():
+                if record.sequence > after:
+                    yield record
+
+    def write_snapshot(self, snapshot: bytes, sequence: int):
+        """Replace the snapshot with one that includes records up to a sequence,
+        then drop those records from the log. Appends wait while the log is
+        rewritten, so none land in the file being replaced.
+
+        Args:
+            snapshot: Serialized index protobuf
+            sequence: Last sequence included in the snapshot
+        """
+        self._write_atomic("snapshot.pb", snapshot)
+        self.snapshot_sequence = sequence
+        self._write_manifest()
+
+        with self._lock:
+            records = list(self.replay())
+            self.close()
+            with open(self.log_filename + ".tmp", "wb") as f:
+                for record in records:
+                    data = record.SerializeToString()
+                    f.write(_HEADER.pack(len(data), zlib.crc32(data)) + data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.log_filename + ".tmp", self.log_filename)
+            self._file = open(self.log_filename, "ab")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_records(self):
+        """Yield records with the offset after each, stopping at a torn write"""
+        with open(self.log_filename, "rb") as f:
+            offset = 0
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                length, crc = _HEADER.unpack(header)
+                data = f.read(length)
+                if len(data) < length or zlib.crc32(data) != crc:
+                    logger.warning(f"Dropping torn record in {self.log_filename}")
+                    break
+                offset += _HEADER.size + length
+                yield indices_pb2.WalRecord.FromString(data), offset
+
+    def _write_manifest(self):
+        manifest = {
+            "version": self.version,
+            "snapshot_sequence": self.snapshot_sequence,
+        }
+        self._write_atomic("MANIFEST", json.dumps(manifest).encode("utf-8"))
+
+    def _write_atomic(self, name: str, data: bytes):
+        filename = os.path.join(self.directory, name)
+        with open(filename + ".tmp", "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(filename + ".tmp", filename)
+
+    def _remove(self, filename: str):
+        if os.path.exists(filename):
+            os.remove(filename)
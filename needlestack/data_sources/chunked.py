@@ -0,0 +1,138 @@
+import io
+import os
+import logging
+import tempfile
+import threading
+from concurrent import futures
+from typing import Callable, List, Optional, IO
+
+logger = logging.getLogger("needlestack")
+
+
+class ChunkedReader(io.RawIOBase):
+    """A readable file-like object over a remote object that supports byte range
+    requests. Chunks are downloaded concurrently into a preallocated file, and
+    reads only block until the bytes being read have arrived. This lets a parser
+    consume the start of an object while the rest is still downloading.
+
+    Attributes:
+        size: Total number of bytes in the object
+        chunk_size: Number of bytes to request per range request
+        max_workers: Number of concurrent range requests
+    """
+
+    size: int
+    chunk_size: int
+    max_workers: int
+
+    def __init__(
+        self,
+        fetch_range: Callable[[int, int], bytes],
+        size: int,
+        chunk_size: int,
+        max_workers: int,
+        fileobj: Optional[IO] = None,
+    ):
+        """
+        Args:
+            fetch_range: Function that returns the bytes between an inclusive
+                start and end offset
+            size: Total number of bytes in the object
+            chunk_size: Number of bytes to request per range request
+            max_workers: Number of concurrent range requests
+            fileobj: Optional file to download into, otherwise a temporary
+                file is used and removed on close
+        """
+        super().__init__()
+        self.size = size
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self._fetch_range = fetch_range
+        self._owns_file = fileobj is None
+        self._file = fileobj if fileobj is not None else tempfile.TemporaryFile()
+        self._file.truncate(size)
+        self._position = 0
+        self._error: Optional[BaseException] = None
+        self._condition = threading.Condition()
+
+        num_chunks = (size + chunk_size - 1) // chunk_size
+        self._done = [False] * num_chunks
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._futures: List[futures.Future] = [
+            self._executor.submit(self._download_chunk, i) for i in range(num_chunks)
+        ]
+
+    def _download_chunk(self, i: int):
+        start = i * self.chunk_size
+        end = min(start + self.chunk_size, self.size) - 1
+        try:
+            data = self._fetch_range(start, end)
+            if len(data) != end - start + 1:
+                raise IOError(
+                    f"Expected {end - start + 1} bytes for range {start}-{end}, got {len(data)}"
+                )
+            os.pwrite(self._file.fileno(), data, start)
+        except BaseException as e:
+            with self._condition:
+                self._error = self._error or e
+                self._condition.notify_all()
+            raise
+        with self._condition:
+            self._done[i] = True
+            self._condition.notify_all()
+
+    def _wait_for_chunk(self, i: int):
+        with self._condition:
+            while not self._done[i] and self._error is None:
+                self._condition.wait()
+            if self._error is not None:
+                raise IOError("Chunked download failed") from self._error
+
+    def wait(self):
+        """Block until every chunk has been downloaded"""
+        for i in range(len(self._done)):
+            self._wait_for_chunk(i)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        return self._position
+
+    def readinto(self, b) -> int:
+        if self._position >= self.size:
+            return 0
+
+        i = self._position // self.chunk_size
+        chunk_end = min((i + 1) * self.chunk_size, self.size)
+        n = min(len(b), chunk_end - self._position)
+        self._wait_for_chunk(i)
+
+        data = os.pread(self._file.fileno(), n, self._position)
+        b[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        if self._owns_file:
+            self._file.close()
+        super().close()
@@ -1,3 +1,4 @@
+import io
 import tempfile
 from contextlib import contextmanager
 from typing import Optional
@@ -6,10 +7,12 @@ from functools import lru_cache
 from google.cloud import storage
 
 from needlestack.data_sources import DataSource
+from needlestack.data_sources.chunked import ChunkedReader
 
 
 class GcsDataSource(DataSource):
-    """Data source that lives locally on disk as a file.
+    """Data source that lives in a Google Cloud Storage bucket. Blobs are
+    downloaded with concurrent byte range requests.
 
     Attributes:
         bucket_name: Google Cloud Storage bucket name
@@ -17,12 +20,16 @@ class GcsDataSource(DataSource):
         project_name: Google Cloud Platform project name
         credentials_file: JSON credentials file for GCP. If not provided,
             the google.cloud package will try to get the credentials implicitly
+        chunk_size: Number of bytes per range request
+        max_workers: Number of concurrent range requests per blob
     """
 
     bucket_name: str
     blob_name: str
     project_name: str
     credentials_file: str
+    chunk_size: int = 64 * 1024 ** 2
+    max_workers: int = 8
 
     @property
     def blob(self) -> storage.Blob:
@@ -38,6 +45,17 @@ class GcsDataSource(DataSource):
         else:
             return None
 
+    @property
+    def fingerprint(self):
+        """Checksum of the blob's content, which unlike the generation does
+        not change when identical content is uploaded again"""
+        blob = self.blob
+        return blob.crc32c or blob.md5_hash or str(blob.generation)
+
+    @property
+    def size(self):
+        return self.blob.size
+
     def populate_from_proto(self, proto):
         self.bucket_name = proto.bucket_name
         self.blob_name = proto.blob_name
@@ -47,12 +65,33 @@ class GcsDataSource(DataSource):
     @contextmanager
     def local_filename(self):
         with tempfile.NamedTemporaryFile() as f:
-            self.blob.download_to_file(f)
+            with self._chunked_reader(f) as reader:
+                reader.wait()
             yield f.name
 
     @contextmanager
     def get_content(self, mode: str = "rb"):
-        yield self.blob.download_as_string()
+        """Yield a buffered stream over the blob that can be read while
+        the rest of the blob is still downloading"""
+        with self._chunked_reader() as reader:
+            yield io.BufferedReader(reader)
+
+    @contextmanager
+    def stage(self):
+        """Stage a stream that keeps downloading in the background, so loads
+        parse the blob while it downloads"""
+        with self.get_content() as content:
+            yield content
+
+    def _chunked_reader(self, fileobj=None) -> ChunkedReader:
+        blob = self.blob
+
+        def fetch_range(start, end):
+            return blob.download_as_string(start=start, end=end)
+
+        return ChunkedReader(
+            fetch_range, blob.size, self.chunk_size, self.max_workers, fileobj
+        )
 
 
 @lru_cache(maxsize=None)
@@ -0,0 +1,170 @@
+import io
+import time
+import shutil
+import tempfile
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from needlestack.data_sources import DataSource
+from needlestack.data_sources.chunked import ChunkedReader
+
+
+class HttpDataSource(DataSource):
+    """Data source that is a file served over HTTP(S). Changes are detected
+    with a conditional HEAD request when the file is first used and on each
+    call to revalidate, and properties return the validators last seen.
+    Servers that accept byte ranges are read with concurrent range requests.
+
+    Attributes:
+        url: URL of the file
+        headers: Headers sent with every request
+        chunk_size: Number of bytes per range request
+        max_workers: Number of concurrent range requests
+        timeout: Seconds to wait on each request
+        etag: Last ETag seen for the file
+    """
+
+    url: str
+    headers: Dict[str, str]
+    chunk_size: int = 64 * 1024 ** 2
+    max_workers: int = 8
+    timeout: Optional[float] = 60.0
+    etag: Optional[str] = None
+
+    _validated: bool = False
+    _last_modified: Optional[float] = None
+    _size: Optional[int] = None
+    _accept_ranges: bool = False
+
+    def __init__(self, url: str = "", headers: Optional[Dict[str, str]] = None):
+        self.url = url
+        self.headers = dict(headers or {})
+
+    @property
+    def last_modified(self):
+        """Last time the file was modified. Uses the Last-Modified header if
+        the server sends one, otherwise the time a new ETag was first seen."""
+        self._validate()
+        return self._last_modified
+
+    @property
+    def fingerprint(self):
+        """The ETag for the file"""
+        self._validate()
+        return self.etag
+
+    @property
+    def size(self):
+        self._validate()
+        return self._size
+
+    def populate_from_proto(self, proto):
+        self.url = proto.url
+        self.headers = dict(proto.headers)
+
+    def revalidate(self) -> bool:
+        """Send a HEAD request that is conditional on the last ETag seen.
+        Returns whether the file changed."""
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+
+        try:
+            with self._urlopen("HEAD", headers) as response:
+                changed = self._set_validators(response.headers)
+        except HTTPError as e:
+            if e.code != 304:
+                raise
+            changed = False
+        self._validated = True
+        return changed
+
+    @contextmanager
+    def local_filename(self):
+        with tempfile.NamedTemporaryFile() as f:
+            if self._use_ranges():
+                with self._chunked_reader(f) as reader:
+                    reader.wait()
+            else:
+                with self._urlopen("GET") as response:
+                    self._set_validators(response.headers)
+                    shutil.copyfileobj(response, f)
+                f.flush()
+            yield f.name
+
+    @contextmanager
+    def get_content(self, mode: str = "rb"):
+        if self._use_ranges():
+            with self._chunked_reader() as reader:
+                yield io.BufferedReader(reader)
+        else:
+            with self._urlopen("GET") as response:
+                self._set_validators(response.headers)
+                yield response
+
+    @contextmanager
+    def stage(self):
+        """Stage a stream that keeps downloading in the background, so loads
+        parse the file while it downloads"""
+        with self.get_content() as content:
+            yield content
+
+    def _validate(self):
+        """Revalidate only if the file has not been validated yet"""
+        if not self._validated:
+            self.revalidate()
+
+    def _use_ranges(self) -> bool:
+        self._validate()
+        return self._accept_ranges and bool(self._size)
+
+    def _chunked_reader(self, fileobj=None) -> ChunkedReader:
+        # Pin every range to the same version of the file
+        headers = {"If-Match": self.etag} if self.etag else {}
+
+        def fetch_range(start, end):
+            range_headers = dict(headers, Range=f"bytes={start}-{end}")
+            with self._urlopen("GET", range_headers) as response:
+                if response.status != 206:
+                    raise IOError(f"Expected partial content from {self.url}")
+                return response.read()
+
+        return ChunkedReader(
+            fetch_range, self._size, self.chunk_size, self.max_workers, fileobj
+        )
+
+    def _set_validators(self, headers) -> bool:
+        """Keep the validators of a response and return whether the file
+        changed. Servers that send neither an ETag nor Last-Modified are
+        only seen to change when the Content-Length does."""
+        etag = headers.get("ETag")
+        content_length = headers.get("Content-Length")
+        size = int(content_length) if content_length is not None else None
+        last_modified = headers.get("Last-Modified")
+        if last_modified is not None:
+            last_modified = parsedate_to_datetime(last_modified).timestamp()
+
+        if etag is not None:
+            changed = etag != self.etag
+        elif last_modified is not None:
+            changed = last_modified != self._last_modified
+        else:
+            changed = self._last_modified is None or size != self._size
+
+        self.etag = etag
+        self._accept_ranges = headers.get("Accept-Ranges") == "bytes"
+        self._size = size
+        if last_modified is not None:
+            self._last_modified = last_modified
+        elif changed:
+            self._last_modified = time.time()
+        return changed
+
+    def _urlopen(self, method: str, headers: Optional[Dict[str, str]] = None):
+        request = Request(
+            self.url, headers=dict(self.headers, **(headers or {})), method=method
+        )
+        return urlopen(request, timeout=self.timeout)
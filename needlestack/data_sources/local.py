@@ -1,5 +1,7 @@
 import os
+import hashlib
 from contextlib import contextmanager
+from typing import Optional, Tuple
 
 from needlestack.data_sources import DataSource
 
@@ -13,14 +15,34 @@ class LocalDataSource(DataSource):
 
     filename: str
 
+    _fingerprint: Optional[Tuple[Tuple, str]] = None
+
     @property
     def last_modified(self):
         """Last time a data source was modified"""
         return os.path.getmtime(self.filename)
 
+    @property
+    def fingerprint(self):
+        """Hash of the file's content. The hash is only recomputed when the
+        file's inode, size, or modification time change, so touching or
+        copying a file over itself costs one read instead of a reload."""
+        stat = os.stat(self.filename)
+        key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if self._fingerprint is None or self._fingerprint[0] != key:
+            self._fingerprint = (key, hash_file(self.filename))
+        return self._fingerprint[1]
+
+    @property
+    def size(self):
+        return os.path.getsize(self.filename)
+
     def populate_from_proto(self, proto):
         self.filename = proto.filename
 
+    def is_source_file(self, filename):
+        return os.path.abspath(filename) == os.path.abspath(self.filename)
+
     @contextmanager
     def local_filename(self):
         yield self.filename
@@ -29,3 +51,17 @@ class LocalDataSource(DataSource):
     def get_content(self, mode: str = "rb"):
         with open(self.filename, mode) as f:
             yield f
+
+
+def hash_file(filename: str, chunk_size: int = 1024 ** 2) -> str:
+    """Hash the content of a file
+
+    Args:
+        filename: File to hash
+        chunk_size: Number of bytes to read at a time
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
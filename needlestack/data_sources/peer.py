@@ -0,0 +1,186 @@
+import logging
+import tempfile
+from contextlib import contextmanager
+from typing import IO, List, Optional
+
+import grpc
+
+from needlestack.apis import servicers_pb2
+from needlestack.apis import servicers_pb2_grpc
+from needlestack.data_sources import DataSource
+from needlestack.utilities.rpc import create_channel
+
+logger = logging.getLogger("needlestack")
+
+
+class PeerDataSource(DataSource):
+    """Data source that copies a shard from a peer Searcher which already has
+    it loaded, and falls back to the shard's origin data source when no peer
+    can serve an up to date copy. Peers are not defined in protobufs, Searchers
+    wrap a shard's data source with the active replicas they know about.
+
+    Attributes:
+        origin: Data source the shard was originally loaded from
+        collection_name: Name of the shard's collection
+        shard_name: Name of the shard
+        hostports: Hostports of peer Searchers to try in order
+        channel_credentials: Optional SSL credentials for peer channels
+        timeout: Seconds allowed per peer transfer
+        peer_fingerprint: Fingerprint of the last copy fetched from a peer
+        peer_modified_time: Modified time of the last copy fetched from a peer
+    """
+
+    origin: DataSource
+    collection_name: str
+    shard_name: str
+    hostports: List[str]
+    channel_credentials: Optional[grpc.ChannelCredentials]
+    timeout: Optional[float]
+    peer_fingerprint: Optional[str] = None
+    peer_modified_time: Optional[float] = None
+
+    def __init__(
+        self,
+        origin: DataSource,
+        collection_name: str,
+        shard_name: str,
+        hostports: List[str],
+        channel_credentials: Optional[grpc.ChannelCredentials] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.origin = origin
+        self.collection_name = collection_name
+        self.shard_name = shard_name
+        self.hostports = hostports
+        self.channel_credentials = channel_credentials
+        self.timeout = timeout
+
+    @property
+    def last_modified(self):
+        try:
+            return self.origin.last_modified
+        except OSError:
+            return self.peer_modified_time
+
+    @property
+    def fingerprint(self):
+        try:
+            return self.origin.fingerprint
+        except OSError:
+            return self.peer_fingerprint
+
+    @property
+    def size(self):
+        try:
+            return self.origin.size
+        except OSError:
+            return None
+
+    def populate_from_proto(self, proto):
+        raise NotImplementedError()
+
+    def revalidate(self):
+        try:
+            return self.origin.revalidate()
+        except OSError:
+            return False
+
+    def is_source_file(self, filename):
+        return self.origin.is_source_file(filename)
+
+    @contextmanager
+    def local_filename(self):
+        with tempfile.NamedTemporaryFile() as f:
+            if self._fetch_from_peers(f):
+                yield f.name
+                return
+
+        with self.origin.local_filename() as filename:
+            yield filename
+
+    @contextmanager
+    def get_content(self, mode: str = "rb"):
+        with tempfile.TemporaryFile() as f:
+            if self._fetch_from_peers(f):
+                f.seek(0)
+                yield f
+                return
+
+        with self.origin.get_content(mode) as content:
+            yield content
+
+    @contextmanager
+    def stage(self):
+        with tempfile.NamedTemporaryFile() as f:
+            if self._fetch_from_peers(f):
+                yield f.name
+                return
+
+        with self.origin.stage() as staged:
+            yield staged
+
+    def _fetch_from_peers(self, f: IO) -> bool:
+        """Write the shard from the first peer that can serve the same copy
+        as the origin, or any copy when the origin cannot be read from this
+        host. Returns whether any peer succeeded."""
+        if not self.hostports:
+            return False
+
+        fingerprint, last_modified = self._origin_version()
+        request = servicers_pb2.ShardFetchRequest(
+            collection_name=self.collection_name, shard_name=self.shard_name
+        )
+        for hostport in self.hostports:
+            f.seek(0)
+            f.truncate()
+            try:
+                with create_channel(hostport, self.channel_credentials) as channel:
+                    stub = servicers_pb2_grpc.SearcherStub(channel)
+                    chunks = stub.ShardFetch(request, timeout=self.timeout)
+                    if self._write_chunks(chunks, f, fingerprint, last_modified):
+                        f.flush()
+                        logger.info(
+                            f"Fetched {self.collection_name}/{self.shard_name} from peer {hostport}"
+                        )
+                        return True
+                    logger.info(
+                        f"Peer {hostport} has a stale copy of {self.collection_name}/{self.shard_name}"
+                    )
+            except grpc.RpcError as e:
+                logger.warning(
+                    f"Peer {hostport} failed ShardFetch for {self.collection_name}/{self.shard_name}: {e}"
+                )
+        return False
+
+    def _origin_version(self):
+        try:
+            return self.origin.fingerprint, self.origin.last_modified
+        except OSError as e:
+            logger.warning(
+                f"Origin of {self.collection_name}/{self.shard_name} is unreadable: {e}"
+            )
+            return None, None
+
+    def _write_chunks(
+        self,
+        chunks,
+        f: IO,
+        fingerprint: Optional[str],
+        last_modified: Optional[float],
+    ) -> bool:
+        received = False
+        for chunk in chunks:
+            if fingerprint and chunk.fingerprint:
+                stale = chunk.fingerprint != fingerprint
+            else:
+                stale = (
+                    last_modified is not None and chunk.modified_time < last_modified
+                )
+            if stale:
+                chunks.cancel()
+                return False
+            f.write(chunk.content)
+            self.peer_fingerprint = chunk.fingerprint or None
+            self.peer_modified_time = chunk.modified_time
+            received = True
+        return received
@@ -1,4 +1,5 @@
 from contextlib import contextmanager
+from typing import Optional
 
 from needlestack.apis import data_sources_pb2
 from needlestack.exceptions import DeserializationError
@@ -28,6 +29,11 @@ class DataSource(object):
 
             data_source = GcsDataSource()
             data_source.populate_from_proto(proto.gcs_data_source)
+        elif source == "http_data_source":
+            from needlestack.data_sources.http import HttpDataSource
+
+            data_source = HttpDataSource()
+            data_source.populate_from_proto(proto.http_data_source)
         else:
             raise DeserializationError("No valid data source found from protobuf")
 
@@ -38,6 +44,17 @@ class DataSource(object):
         """Last time a data source was modified"""
         raise NotImplementedError()
 
+    @property
+    def fingerprint(self) -> Optional[str]:
+        """Identifier for the content of a data source which only changes when
+        the content changes, or None if the data source cannot provide one"""
+        return None
+
+    @property
+    def size(self) -> int:
+        """Number of bytes in the data source"""
+        raise NotImplementedError()
+
     def populate_from_proto(self, proto: data_sources_pb2.DataSource):
         """Populate DataSource from protobuf defining the data source
 
@@ -55,3 +72,21 @@ class DataSource(object):
     def get_content(self, mode: str):
         """Yield raw data from the data source"""
         raise NotImplementedError()
+
+    def revalidate(self) -> bool:
+        """Refresh what is known about the data source, for data sources that
+        cache their version and size rather than read them on each access.
+        Returns whether the data source changed, False if nothing is cached."""
+        return False
+
+    def is_source_file(self, filename: str) -> bool:
+        """Whether a staged filename is the data source's own file, which can
+        be rewritten in place, rather than a private copy"""
+        return False
+
+    @contextmanager
+    def stage(self):
+        """Start reading the data to load it, and yield either a local filename
+        or a binary stream that can be parsed while the rest still arrives"""
+        with self.local_filename() as filename:
+            yield filename
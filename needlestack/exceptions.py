@@ -20,3 +20,9 @@ class KnapsackItemException(Exception):
 
 class DimensionMismatchException(Exception):
     pass
+
+
+class AdmissionRejectedException(Exception):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
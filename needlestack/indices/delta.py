@@ -0,0 +1,124 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from needlestack.apis import indices_pb2
+from needlestack.indices import BaseIndex
+from needlestack.indices.metadata_index import MetadataIndex
+
+
+class DeltaIndex(BaseIndex):
+    """Small in-memory index of vectors upserted into a shard since its base
+    index was built. Searched by brute force next to the base index, until
+    compaction folds it into a new base index.
+
+    Attributes:
+        vectors: Matrix of upserted vectors
+        metadatas: Metadata for each row of vectors
+        rows: Map from metadata id to row
+    """
+
+    vectors: np.ndarray
+    metadatas: List[indices_pb2.Metadata]
+    rows: Dict[str, int]
+
+    def __init__(self, dimension: int, inner_product: bool = False):
+        """
+        Args:
+            dimension: Dimensionality of the vectors
+            inner_product: Rank by inner product instead of squared L2 distance,
+                to match the base index
+        """
+        self.vectors = np.empty((0, dimension), dtype="float32")
+        self.metadatas = []
+        self.rows = {}
+        self._inner_product = inner_product
+
+    @property
+    def inner_product(self):
+        return self._inner_product
+
+    @property
+    def dimension(self):
+        return self.vectors.shape[1]
+
+    @property
+    def count(self):
+        return len(self.metadatas)
+
+    def update_available(self):
+        return False
+
+    def copy(self) -> "DeltaIndex":
+        delta = DeltaIndex(self.dimension, self.inner_product)
+        delta.vectors = self.vectors.copy()
+        delta.metadatas = list(self.metadatas)
+        delta.rows = dict(self.rows)
+        return delta
+
+    def add_vectors(self, X: np.ndarray, metadatas: List[indices_pb2.Metadata]):
+        """Insert vectors, replacing rows that have the same id"""
+        X = np.asarray(X, dtype="float32").reshape(-1, self.dimension)
+        new_rows = []
+        for x, metadata in zip(X, metadatas):
+            i = self.rows.get(metadata.id)
+            if i is None:
+                self.rows[metadata.id] = len(self.metadatas) + len(new_rows)
+                new_rows.append((x, metadata))
+            else:
+                self.vectors[i] = x
+                self.metadatas[i] = metadata
+        if new_rows:
+            self.vectors = np.vstack([self.vectors] + [x for x, _ in new_rows])
+            self.metadatas.extend(metadata for _, metadata in new_rows)
+        self.metadata_index = None
+
+    def remove_vectors(self, ids: List[str]) -> int:
+        """Remove vectors by id and return the number removed"""
+        removed = {self.rows[id] for id in ids if id in self.rows}
+        if removed:
+            keep = [i for i in range(self.count) if i not in removed]
+            self.vectors = self.vectors[keep]
+            self.metadatas = [self.metadatas[i] for i in keep]
+            self.rows = {metadata.id: i for i, metadata in enumerate(self.metadatas)}
+            self.metadata_index = None
+        return len(removed)
+
+    def metadata_mask(self, metadata_filter):
+        if self.metadata_index is None:
+            self.metadata_index = MetadataIndex(self.metadatas)
+        return self.metadata_index.mask(metadata_filter)
+
+    def _get_metadata_by_index(self, i):
+        return self.metadatas[i]
+
+    def _get_vector_by_index(self, i):
+        return self.vectors[i]
+
+    def _get_vectors_by_indices(self, idxs):
+        return self.vectors[np.asarray(idxs, dtype="int64")]
+
+    def _get_index_by_id(self, id) -> Optional[int]:
+        return self.rows.get(id)
+
+    def knn_search(self, X, k, mask=None, params=None):
+        X = np.asarray(X, dtype="float32").reshape(-1, self.dimension)
+        rows = np.arange(self.count) if mask is None else np.flatnonzero(mask)
+        vectors = self.vectors[rows]
+
+        if self.inner_product:
+            dists = -(X @ vectors.T)
+        else:
+            dists = np.maximum(
+                (X**2).sum(axis=1)[:, None]
+                - 2 * X @ vectors.T
+                + (vectors**2).sum(axis=1)[None, :],
+                0,
+            )
+
+        k = min(k, len(rows))
+        order = np.argsort(dists, axis=1, kind="stable")[:, :k]
+        dists = np.take_along_axis(dists, order, axis=1).astype("float32")
+        if self.inner_product:
+            dists = -dists
+        return dists, rows[order]
@@ -1,32 +1,39 @@
+import os
+import shutil
 import tempfile
-from typing import List, Dict
+from typing import Any, Optional, Tuple
 
 import faiss
 import numpy as np
 
 from needlestack.apis import indices_pb2
-from needlestack.data_sources import DataSource
-from needlestack.indices import BaseIndex
+from needlestack.apis import serializers
+from needlestack.apis import wire
+from needlestack.indices.index import DataSourceIndex
+from needlestack.indices.id_index import IdIndex
 from needlestack.exceptions import UnsupportedIndexOperationException
 
 
-class FaissIndex(BaseIndex):
-
+class FaissIndex(DataSourceIndex):
     """Implementation of a BaseIndex using Faiss's index classes
 
     Attributes:
         index: Faiss index object
-        metadatas: List of metadata for items in index
-        data_source: Data source to load index
-        id2index: Dictionary from metadata id to index in Faiss index
+        metadata_blob: Encoded metadata of each item, the only copy kept.
+            Metadata messages are decoded from it when needed.
+        id_index: Map from metadata id to index in Faiss index
         enable_id_to_vector: Enable retrieving vector from id
+        vectors: Zero-copy view of the stored vectors for flat indexes,
+            None for index types that must reconstruct vectors
+        brute_force_fraction: Filtered searches that match at most this
+            fraction of rows search the matching vectors directly
     """
 
     index: faiss.Index
-    metadatas: List[indices_pb2.Metadata]
-    data_source: DataSource
-    id2index: Dict[str, int]
+    id_index: Optional[IdIndex] = None
     enable_id_to_vector: bool = False
+    vectors: Optional[np.ndarray] = None
+    brute_force_fraction: float = 0.05
 
     @property
     def dimension(self):
@@ -36,81 +43,325 @@ class FaissIndex(BaseIndex):
     def count(self):
         return self.index.ntotal
 
-    def populate_from_proto(self, proto: indices_pb2.FaissIndex):
-        self.data_source = DataSource.from_proto(proto.data_source)
-
     def populate(self, data):
         self.index = data.get("index")
-        self.metadatas = data.get("metadatas")
+        self.metadata_blob = data.get("metadata_blob")
+        if self.metadata_blob is None:
+            self.metadata_blob = wire.MetadataBlob.from_metadatas(data["metadatas"])
+        self.vectors = flat_vectors(self.index) if self.index is not None else None
         self.modified_time = data.get("modified_time")
+        self.fingerprint = data.get("fingerprint")
+        self.id_index = data.get("id_index")
+
+    def set_vectors(self, X, metadatas):
+        """Replace the vectors with an empty copy of the Faiss index, so trained
+        index types keep their training"""
+        faiss_index = faiss.clone_index(self.index)
+        faiss_index.reset()
+        self._populate_vectors(faiss_index, X, metadatas)
+
+    def add_vectors(self, X, metadatas):
+        faiss_index = faiss.clone_index(self.index)
+        self._populate_vectors(faiss_index, X, self.metadatas + list(metadatas))
+
+    def _populate_vectors(self, faiss_index, X, metadatas):
+        if len(X):
+            faiss_index.add(np.ascontiguousarray(X, dtype="float32"))
+        self.populate(
+            {
+                "index": faiss_index,
+                "metadatas": metadatas,
+                "modified_time": self.modified_time,
+                "fingerprint": self.fingerprint,
+            }
+        )
+        self._set_id_to_vector(self.enable_id_to_vector)
+        self._set_metadata_index(self.enable_metadata_index)
 
     def serialize(self):
         with tempfile.NamedTemporaryFile() as f:
             faiss.write_index(self.index, f.name)
             index_binary = f.read()
 
+        id_index = self.id_index or IdIndex.from_ids(
+            [metadata.id for metadata in self.metadatas]
+        )
+        id_hashes, id_rows = id_index.tobytes()
+
         return indices_pb2.FaissIndex(
-            index_binary=index_binary, metadatas=self.metadatas
+            index_binary=index_binary,
+            metadatas=self.metadatas,
+            id_hashes=id_hashes,
+            id_rows=id_rows,
         )
 
-    def _load(self):
-        with self.data_source.get_content() as content:
-            proto = indices_pb2.FaissIndex.FromString(content.read())
+    def write(self, f):
+        """Write the serialized index field by field, so that it is never
+        held in memory whole"""
+        fields = indices_pb2.FaissIndex
+        with tempfile.NamedTemporaryFile() as binary:
+            faiss.write_index(self.index, binary.name)
+            f.write(
+                wire.encode_field_header(
+                    fields.INDEX_BINARY_FIELD_NUMBER, os.path.getsize(binary.name)
+                )
+            )
+            shutil.copyfileobj(binary, f)
+
+        encode_metadata = self._metadata_encoder()
+        for i in range(self.count):
+            wire.write_field(f, fields.METADATAS_FIELD_NUMBER, encode_metadata(i))
 
+        id_index = self.id_index or IdIndex.from_ids(
+            [metadata.id for metadata in self.metadatas]
+        )
+        wire.write_field(f, fields.ID_HASHES_FIELD_NUMBER, id_index.hashes)
+        wire.write_field(f, fields.ID_ROWS_FIELD_NUMBER, id_index.rows)
+
+    @property
+    def inner_product(self):
+        return self.index.metric_type == faiss.METRIC_INNER_PRODUCT
+
+    def _load(self, staged: Any = None):
+        """Parse the serialized FaissIndex field by field as it streams in,
+        so the index binary is never held in memory next to the parsed index.
+        Id index arrays are memory-mapped when loading from a staged copy."""
+        fingerprint = self.data_source.fingerprint
+        modified_time = self.data_source.last_modified
+        filename = self._mappable_filename(staged)
+        encoded_metadatas = []
+        id_arrays = {}
         with tempfile.NamedTemporaryFile() as f:
-            f.write(proto.index_binary)
-            f.seek(0)
-            proto.ClearField("index_binary")
+            with self._open_content(staged) as content:
+                for field in serializers.iter_proto_fields(content):
+                    if field.number == indices_pb2.FaissIndex.INDEX_BINARY_FIELD_NUMBER:
+                        shutil.copyfileobj(field, f)
+                    elif field.number == indices_pb2.FaissIndex.METADATAS_FIELD_NUMBER:
+                        encoded_metadatas.append(field.read())
+                    elif field.number in ID_INDEX_FIELD_NUMBERS:
+                        id_arrays[field.number] = serializers.read_array(
+                            field, filename
+                        )
+            f.flush()
             faiss_index = faiss.read_index(f.name)
 
+        id_index = None
+        if len(id_arrays) == len(ID_INDEX_FIELD_NUMBERS):
+            id_index = IdIndex.frombuffer(
+                *(id_arrays[n] for n in ID_INDEX_FIELD_NUMBERS)
+            )
+
         self.populate(
             {
                 "index": faiss_index,
-                "metadatas": proto.metadatas,
-                "modified_time": self.data_source.last_modified,
+                "metadata_blob": wire.MetadataBlob.from_encoded(encoded_metadatas),
+                "modified_time": modified_time,
+                "fingerprint": fingerprint,
+                "id_index": id_index,
             }
         )
 
         self._set_id_to_vector(self.enable_id_to_vector)
-
-    def update_available(self):
-        if self.modified_time is None:
-            return True
-        elif self.modified_time < self.data_source.last_modified:
-            return True
-        else:
-            return False
+        self._set_metadata_index(self.enable_metadata_index)
 
     def _set_id_to_vector(self, enable: bool):
+        """Shards serialized before id indexes were stored get one built here"""
         if enable:
-            self.id2index = {
-                metadata.id: i for i, metadata in enumerate(self.metadatas)
-            }
+            if self.id_index is None or len(self.id_index) != len(self.metadata_blob):
+                self.id_index = IdIndex.from_ids(
+                    [metadata.id for metadata in self.metadatas]
+                )
             self.enable_id_to_vector = True
+            if self.vectors is None:
+                make_direct_map(self.index)
         else:
-            self.id2index = {}
+            self.id_index = None
             self.enable_id_to_vector = False
 
+    def _set_metadata_index(self, enable: bool):
+        super()._set_metadata_index(enable)
+        if enable and self.vectors is None:
+            make_direct_map(self.index)
+
+    @property
+    def metadatas(self):
+        """Metadata of every item, decoded from the metadata blob"""
+        return [self.metadata_blob.decode(i) for i in range(len(self.metadata_blob))]
+
     def _get_metadata_by_index(self, i):
-        return self.metadatas[i]
+        return self.metadata_blob.decode(i)
 
     def _get_vector_by_index(self, i):
-        start = self.index.d * i
-        end = self.index.d * (i + 1)
-        data = [self.index.xb.at(i) for i in range(start, end)]
-        return np.array(data).astype("float32")
+        return self._get_vectors_by_indices(np.array([i]))[0]
+
+    def _get_vectors_by_indices(self, idxs):
+        """Copy rows out of the flat storage view, otherwise reconstruct them.
+        Contiguous rows are reconstructed in one call."""
+        idxs = np.asarray(idxs, dtype="int64")
+        if self.vectors is not None:
+            return self.vectors[idxs]
+        elif len(idxs) == 0:
+            return np.empty((0, self.index.d), dtype="float32")
+        elif np.all(np.diff(idxs) == 1):
+            return self.index.reconstruct_n(int(idxs[0]), len(idxs))
+        elif hasattr(self.index, "reconstruct_batch"):
+            return self.index.reconstruct_batch(idxs)
+        else:
+            return np.vstack([self.index.reconstruct(int(i)) for i in idxs])
 
     def _get_index_by_id(self, id):
         if self.enable_id_to_vector:
-            return self.id2index.get(id)
+            for i in self.id_index.candidates(id):
+                if self._get_metadata_by_index(i).id == id:
+                    return int(i)
+            return None
         else:
             raise UnsupportedIndexOperationException(
                 "Index does not have enable_id_to_vector"
             )
 
-    def knn_search(self, X, k):
-        """Faiss only supports float32 at version 1.5.0"""
+    def knn_search(self, X, k, mask=None, params=None):
+        """Faiss only supports float32 at version 1.5.0. Masked searches
+        over few rows search just those rows, others pass the mask to Faiss
+        as an IDSelector when the Faiss version and index type allow it, or
+        else search for extra neighbors and drop those the mask leaves out."""
         if X.dtype != "float32":
             X = X.astype("float32")
         k = min(k, self.index.ntotal)
-        return self.index.search(X, k)
+        if mask is None:
+            return self._search(X, k, params)
+
+        rows = np.flatnonzero(mask)
+        if len(rows) == 0 or k == 0:
+            return empty_search_result(len(X), k, self.inner_product)
+        if len(rows) > self.brute_force_fraction * self.index.ntotal:
+            try:
+                bitmap = np.packbits(mask, bitorder="little")
+                selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+                return self._search(X, k, params, selector)
+            except (AttributeError, RuntimeError, TypeError):
+                result = self._post_filter_search(X, k, mask, len(rows), params)
+                if result is not None:
+                    return result
+        return self._brute_force_search(X, k, rows)
+
+    def _search(self, X, k, params=None, selector=None):
+        faiss_params = self._faiss_search_params(params, selector)
+        if faiss_params is None:
+            return self.index.search(X, k)
+        return self.index.search(X, k, params=faiss_params)
+
+    def _faiss_search_params(self, params=None, selector=None):
+        """Faiss parameters for a single search, so searches with different
+        parameters can run at once without changing the shared index. The
+        parameters are chosen by the index that id map and pre-transform
+        wrappers pass them on to."""
+        nprobe = params.nprobe if params is not None else 0
+        ef_search = params.ef_search if params is not None else 0
+        if not (nprobe or ef_search or selector):
+            return None
+
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe or ivf.nprobe)
+
+        index = unwrap_index(self.index)
+        if isinstance(index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(
+                sel=selector, efSearch=ef_search or index.hnsw.efSearch
+            )
+        elif selector is not None:
+            return faiss.SearchParameters(sel=selector)
+        else:
+            return None
+
+    def _post_filter_search(self, X, k, mask, count, params=None):
+        """Search for twice as many neighbors as k matches of the mask are
+        expected to take, and keep the first k that match. Returns None when
+        a query found fewer matches than that, since more may be missed."""
+        fetch = min(self.index.ntotal, int(np.ceil(2 * k * len(mask) / count)))
+        dists, idxs = self._search(X, fetch, params)
+        found = (idxs >= 0) & mask[np.maximum(idxs, 0)]
+        if np.any(found.sum(axis=1) < min(k, count)):
+            return None
+
+        order = np.argsort(~found, axis=1, kind="stable")[:, :k]
+        kept = np.take_along_axis(found, order, axis=1)
+        dists = np.take_along_axis(dists, order, axis=1)
+        idxs = np.take_along_axis(idxs, order, axis=1)
+        return dists, np.where(kept, idxs, -1)
+
+    def _brute_force_search(self, X, k, rows):
+        """Exact search over some rows, with ids mapped back to index rows"""
+        subindex = faiss.IndexFlat(self.index.d, self.index.metric_type)
+        subindex.add(np.ascontiguousarray(self._get_vectors_by_indices(rows)))
+        dists, idxs = subindex.search(X, k)
+        return dists, np.where(idxs >= 0, rows[np.maximum(idxs, 0)], -1)
+
+
+def empty_search_result(
+    n: int, k: int, inner_product: bool = False
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Distances and ids of n searches that found nothing, padded to k
+
+    Args:
+        n: Number of searches
+        k: Number of neighbors
+        inner_product: Pad with the worst inner product rather than distance
+    """
+    fill = -np.inf if inner_product else np.inf
+    return (
+        np.full((n, k), fill, dtype="float32"),
+        np.full((n, k), -1, dtype="int64"),
+    )
+
+
+def flat_vectors(index: faiss.Index) -> Optional[np.ndarray]:
+    """Zero-copy view of the vectors in a flat index, or None for other index types.
+    The view is only valid while the index is alive.
+
+    Args:
+        index: Faiss index
+    """
+    index = faiss.downcast_index(index)
+    if not isinstance(index, faiss.IndexFlat):
+        return None
+    elif index.ntotal == 0:
+        return np.empty((0, index.d), dtype="float32")
+
+    # Newer Faiss stores flat vectors as bytes behind get_xb, older Faiss exposes xb
+    pointer = index.get_xb() if hasattr(index, "get_xb") else index.xb.data()
+    return faiss.rev_swig_ptr(pointer, index.ntotal * index.d).reshape(
+        index.ntotal, index.d
+    )
+
+
+def unwrap_index(index: faiss.Index) -> faiss.Index:
+    """The index that IndexIDMap and IndexPreTransform wrappers search with
+
+    Args:
+        index: Faiss index
+    """
+    index = faiss.downcast_index(index)
+    while isinstance(index, (faiss.IndexIDMap, faiss.IndexPreTransform)):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+ID_INDEX_FIELD_NUMBERS = (
+    indices_pb2.FaissIndex.ID_HASHES_FIELD_NUMBER,
+    indices_pb2.FaissIndex.ID_ROWS_FIELD_NUMBER,
+)
+
+
+def make_direct_map(index: faiss.Index):
+    """Let IVF indexes reconstruct vectors by row. Other index types either
+    reconstruct without one or not at all.
+
+    Args:
+        index: Faiss index
+    """
+    try:
+        faiss.extract_index_ivf(index).make_direct_map()
+    except RuntimeError:
+        pass
@@ -0,0 +1,69 @@
+import hashlib
+from typing import Iterable, List
+
+import numpy as np
+
+HASH_DTYPE = np.dtype("<u8")
+ROW_DTYPE = np.dtype("<u4")
+
+
+class IdIndex(object):
+    """Maps metadata ids to rows with two flat arrays, 64-bit id hashes in
+    sorted order and the row of each hash, searched with ``np.searchsorted``.
+    It takes 12 bytes per id, and the arrays can be stored with a shard and
+    memory-mapped at load. Hashes can collide, so a lookup returns candidate
+    rows that callers check against the id stored at each row.
+
+    Attributes:
+        hashes: Sorted hashes of ids
+        rows: Row for each hash
+    """
+
+    hashes: np.ndarray
+    rows: np.ndarray
+
+    def __init__(self, hashes: np.ndarray, rows: np.ndarray):
+        self.hashes = hashes
+        self.rows = rows
+
+    @classmethod
+    def from_ids(cls, ids: List[str]) -> "IdIndex":
+        """Build an index from ids in row order"""
+        hashes = hash_ids(ids)
+        order = np.argsort(hashes, kind="stable")
+        return cls(hashes[order], order.astype(ROW_DTYPE))
+
+    @classmethod
+    def frombuffer(cls, hashes, rows) -> "IdIndex":
+        """Wrap serialized arrays without copying them
+
+        Args:
+            hashes: Buffer of little-endian uint64 hashes
+            rows: Buffer of little-endian uint32 rows
+        """
+        return cls(
+            np.frombuffer(hashes, dtype=HASH_DTYPE),
+            np.frombuffer(rows, dtype=ROW_DTYPE),
+        )
+
+    def tobytes(self):
+        """Returns the serialized hashes and rows"""
+        return self.hashes.tobytes(), self.rows.tobytes()
+
+    def candidates(self, id: str) -> np.ndarray:
+        """Rows whose id hashes the same as the given id"""
+        h = hash_ids([id])[0]
+        start = np.searchsorted(self.hashes, h, side="left")
+        end = np.searchsorted(self.hashes, h, side="right")
+        return self.rows[start:end]
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+def hash_ids(ids: Iterable[str]) -> np.ndarray:
+    """Hash ids to 64-bit integers"""
+    digests = b"".join(
+        hashlib.blake2b(id.encode("utf-8"), digest_size=8).digest() for id in ids
+    )
+    return np.frombuffer(digests, dtype=HASH_DTYPE)
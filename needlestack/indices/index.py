@@ -1,10 +1,24 @@
-from typing import List, Tuple, Dict, Union
+import copy
+from contextlib import contextmanager, nullcontext
+from typing import Any, BinaryIO, Callable, List, Optional, Tuple, Dict, Union
 
 import numpy as np
 
 from needlestack.apis import indices_pb2
 from needlestack.apis import serializers
-from needlestack.exceptions import DeserializationError
+from needlestack.apis import wire
+from needlestack.data_sources import DataSource
+from needlestack.exceptions import (
+    DeserializationError,
+    UnsupportedIndexOperationException,
+)
+from needlestack.indices.metadata_index import MetadataIndex
+
+SearchResult = Union[
+    indices_pb2.SearchResultItem,
+    Tuple[float, bytes],
+    Tuple[float, indices_pb2.Metadata],
+]
 
 
 class BaseIndex(object):
@@ -12,6 +26,10 @@ class BaseIndex(object):
     for populating data and performing kNN queries."""
 
     modified_time: Union[float, None] = None
+    fingerprint: Union[str, None] = None
+    enable_metadata_index: bool = False
+    metadata_index: Optional[MetadataIndex] = None
+    metadata_blob: Optional[wire.MetadataBlob] = None
 
     @staticmethod
     def from_proto(proto: indices_pb2.BaseIndex) -> "BaseIndex":
@@ -28,6 +46,11 @@ class BaseIndex(object):
 
             index = FaissIndex()
             index.populate_from_proto(proto.faiss_index)
+        elif index_type == "scalar_quantized_index":
+            from needlestack.indices.quantized_indices import ScalarQuantizedIndex
+
+            index = ScalarQuantizedIndex()
+            index.populate_from_proto(proto.scalar_quantized_index)
         else:
             raise DeserializationError("No valid index found from protobuf")
 
@@ -64,12 +87,48 @@ class BaseIndex(object):
         """Serialize the current index to a protobuf"""
         raise NotImplementedError()
 
-    def load(self):
-        """Load data into memory"""
+    def write(self, f: BinaryIO):
+        """Write the serialized index to a file, as the protobuf from
+        serialize would encode it
+
+        Args:
+            f: Binary file to write to
+        """
+        f.write(self.serialize().SerializeToString())
+
+    @property
+    def inner_product(self) -> bool:
+        """Whether results are ranked by descending inner product rather than
+        ascending distance"""
+        return False
+
+    @property
+    def source_version(self) -> Optional[str]:
+        """Identifies the version of the data the index loads from, None if unknown"""
+        return None
+
+    @property
+    def source_size(self) -> int:
+        """Approximate number of bytes read to load the index"""
+        return 0
+
+    @contextmanager
+    def fetch(self):
+        """Stage the data needed to load this index somewhere fast to read,
+        like a local copy of a remote file, and yield a handle for ``load``.
+        Splits the I/O bound part of a load from the CPU bound part."""
+        yield None
+
+    def load(self, staged: Any = None):
+        """Load data into memory
+
+        Args:
+            staged: Optional handle yielded by ``fetch``
+        """
         if self.update_available():
-            self._load()
+            self._load(staged)
 
-    def _load(self):
+    def _load(self, staged: Any = None):
         """Load data into memory"""
         raise NotImplementedError()
 
@@ -77,10 +136,50 @@ class BaseIndex(object):
         """Data source has an update available"""
         raise NotImplementedError()
 
+    def revalidate(self) -> bool:
+        """Refresh what the index knows about its data source before checking
+        for updates. Returns whether the data source changed."""
+        return False
+
     def set_vectors(self, X: np.ndarray, metadatas: List[indices_pb2.Metadata]):
         """Set the vectors for this index"""
         raise NotImplementedError()
 
+    def compact(
+        self,
+        exclude: Optional[np.ndarray],
+        X: np.ndarray,
+        metadatas: List[indices_pb2.Metadata],
+    ) -> "BaseIndex":
+        """Returns a new index of the same type without excluded rows and with
+        vectors appended. Holds a copy of every kept vector while building.
+
+        Args:
+            exclude: Optional boolean array of rows to leave out
+            X: Matrix of vectors to append
+            metadatas: Metadata for each appended vector
+        """
+        rows = np.arange(self.count)
+        if exclude is not None:
+            rows = rows[~exclude]
+        X_kept = self._get_vectors_by_indices(rows)
+        metadatas_kept = [self._get_metadata_by_index(i) for i in rows]
+
+        index = copy.copy(self)
+        index.set_vectors(
+            np.vstack([X_kept, np.asarray(X, dtype=X_kept.dtype)]),
+            metadatas_kept + list(metadatas),
+        )
+        return index
+
+    def find_rows(self, ids: List[str]) -> List[Optional[int]]:
+        """Returns the row of each id, or None for ids not in the index
+
+        Args:
+            ids: IDs within metadata
+        """
+        return [self._get_index_by_id(id) for id in ids]
+
     def add_vectors(self, X: np.ndarray, metadatas: List[indices_pb2.Metadata]):
         """Add the vectors to existing index"""
         raise NotImplementedError()
@@ -91,18 +190,52 @@ class BaseIndex(object):
     def _get_vector_by_index(self, i: int) -> np.ndarray:
         raise NotImplementedError()
 
+    def _get_vectors_by_indices(self, idxs: np.ndarray) -> np.ndarray:
+        return np.vstack([self._get_vector_by_index(i) for i in idxs])
+
     def _get_index_by_id(self, id: str) -> int:
         raise NotImplementedError()
 
-    def knn_search(self, X: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
-        """Returns an array of distances and index ids
+    def knn_search(
+        self,
+        X: np.ndarray,
+        k: int,
+        mask: Optional[np.ndarray] = None,
+        params: Optional[indices_pb2.SearchParams] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns an array of distances and index ids. Ids of -1 pad results
+        when fewer than k items can be returned.
 
         Args:
             X: Matrix of vectors to perform kNN search
             k: Number of neighbors
+            mask: Optional boolean array of which rows may be returned
+            params: Optional search parameters for this call only, fields that
+                do not apply to the index type are ignored
         """
         raise NotImplementedError()
 
+    def _set_metadata_index(self, enable: bool):
+        if enable:
+            self.metadata_index = MetadataIndex(
+                [self._get_metadata_by_index(i) for i in range(self.count)]
+            )
+        else:
+            self.metadata_index = None
+        self.enable_metadata_index = enable
+
+    def metadata_mask(self, metadata_filter: indices_pb2.MetadataFilter) -> np.ndarray:
+        """Boolean array of which rows match a metadata filter
+
+        Args:
+            metadata_filter: Conditions on metadata fields
+        """
+        if self.metadata_index is None:
+            raise UnsupportedIndexOperationException(
+                "Index does not have enable_metadata_index"
+            )
+        return self.metadata_index.mask(metadata_filter)
+
     def get_vector_and_metadata(
         self, id: str
     ) -> Tuple[np.ndarray, indices_pb2.Metadata]:
@@ -119,35 +252,208 @@ class BaseIndex(object):
         else:
             return None, None
 
+    def get_vectors_and_metadatas(
+        self, ids: List[str]
+    ) -> Tuple[np.ndarray, List[indices_pb2.Metadata]]:
+        """Returns a matrix of vectors and their metadata for the ids found
+        in this index, in the order of the given ids
+
+        Args:
+            ids: IDs within metadata
+        """
+        idxs = [i for i in self.find_rows(ids) if i is not None]
+        if idxs:
+            X = self._get_vectors_by_indices(np.array(idxs))
+        else:
+            X = np.empty((0, self.dimension), dtype="float32")
+        metadatas = [self._get_metadata_by_index(i) for i in idxs]
+        return X, metadatas
+
     def retrieve(self, id: str) -> indices_pb2.RetrievalResultItem:
         vector, metadata = self.get_vector_and_metadata(id)
         vector_proto = None if vector is None else serializers.ndarray_to_proto(vector)
         return indices_pb2.RetrievalResultItem(vector=vector_proto, metadata=metadata)
 
-    def query(self, X: np.ndarray, k: int) -> List[List[indices_pb2.SearchResultItem]]:
+    def query(
+        self,
+        X: np.ndarray,
+        k: int,
+        metadata_filter: Optional[indices_pb2.MetadataFilter] = None,
+        exclude: Optional[np.ndarray] = None,
+        params: Optional[indices_pb2.SearchParams] = None,
+        bound: Optional[float] = None,
+        projection: Optional[indices_pb2.MetadataProjection] = None,
+        encoded: bool = False,
+        columnar: bool = False,
+    ) -> List[List[SearchResult]]:
         """Returns a list of list of knn query results.
-        Each result is a tuple of (distance, metadata) pairs.
+        Each result is a SearchResultItem, or with encoded, a tuple of its
+        distance and its encoded bytes, or with columnar, a tuple of its
+        distance and its metadata.
 
         Args:
             X: Matrix of vectors to perform kNN search for
             k: Number of neighbors
+            metadata_filter: Optional filter on the metadata of results
+            exclude: Optional boolean array of rows to leave out of results
+            params: Optional search parameters for this call only
+            bound: Optional distance results must be within, or inner product
+                they must reach
+            projection: Optional parts of metadata to copy into results
+            encoded: Encode results straight from stored metadata bytes,
+                without creating messages
+            columnar: Pair distances with metadata for packing into columns,
+                without creating a search result item per result
         """
-        dists, idxs = self.knn_search(X, k)
+        mask = None
+        if metadata_filter is not None and metadata_filter.conditions:
+            mask = self.metadata_mask(metadata_filter)
+        if exclude is not None and exclude.any():
+            mask = ~exclude if mask is None else mask & ~exclude
+        dists, idxs = self.knn_search(X, k, mask, params)
+        double = not (dists.dtype == "float32" or dists.dtype == "float16")
+        project = metadata_projector(projection)
+        encode_metadata = self._metadata_encoder(projection)
         batches = []
         for dist, idx in zip(dists, idxs):
-            if dists.dtype == "float32" or dists.dtype == "float16":
+            found = idx >= 0
+            if bound is not None:
+                found &= dist >= bound if self.inner_product else dist <= bound
+            dist, idx = dist[found], idx[found]
+            if encoded:
+                results = [
+                    (d, wire.encode_search_result_item(d, encode_metadata(i), double))
+                    for d, i in zip(dist.tolist(), idx.tolist())
+                ]
+            elif columnar:
+                results = [
+                    (d, project(self._get_metadata_by_index(i)))
+                    for d, i in zip(dist, idx.tolist())
+                ]
+            elif not double:
                 results = [
                     indices_pb2.SearchResultItem(
-                        float_distance=d, metadata=self._get_metadata_by_index(i)
+                        float_distance=d,
+                        metadata=project(self._get_metadata_by_index(i)),
                     )
                     for d, i in zip(dist, idx)
                 ]
             else:
                 results = [
                     indices_pb2.SearchResultItem(
-                        double_distance=d, metadata=self._get_metadata_by_index(i)
+                        double_distance=d,
+                        metadata=project(self._get_metadata_by_index(i)),
                     )
                     for d, i in zip(dist, idx)
                 ]
             batches.append(results)
         return batches
+
+    def _metadata_encoder(
+        self, projection: Optional[indices_pb2.MetadataProjection] = None
+    ) -> Callable[[int], bytes]:
+        """Function from row to the encoded projected metadata of the row,
+        sliced from the metadata blob when the index has one"""
+        if projection is not None and projection.ids_only:
+            return lambda i: wire.encode_metadata_id(self._get_metadata_by_index(i).id)
+        elif projection is not None and projection.return_fields:
+            project = metadata_projector(projection)
+            return lambda i: project(self._get_metadata_by_index(i)).SerializeToString()
+        elif self.metadata_blob is not None:
+            return self.metadata_blob.__getitem__
+        else:
+            return lambda i: self._get_metadata_by_index(i).SerializeToString()
+
+
+def result_distance(result: SearchResult) -> float:
+    """Distance of a search result, either a SearchResultItem or an encoded pair"""
+    if isinstance(result, tuple):
+        return result[0]
+    return result.float_distance or result.double_distance
+
+
+def metadata_projector(
+    projection: Optional[indices_pb2.MetadataProjection],
+) -> Callable[[indices_pb2.Metadata], indices_pb2.Metadata]:
+    """Function that copies only the projected parts of a metadata
+
+    Args:
+        projection: Parts of metadata to keep, None to keep all of it
+    """
+    if projection is None:
+        return lambda metadata: metadata
+    elif projection.ids_only:
+        return lambda metadata: indices_pb2.Metadata(id=metadata.id)
+    elif projection.return_fields:
+        names = set(projection.return_fields)
+        return lambda metadata: indices_pb2.Metadata(
+            id=metadata.id,
+            fields=[field for field in metadata.fields if field.name in names],
+        )
+    else:
+        return lambda metadata: metadata
+
+
+class DataSourceIndex(BaseIndex):
+    """Base class for indexes loaded from a serialized protobuf in a data source,
+    whose proto has a data_source field
+
+    Attributes:
+        data_source: Data source to load index
+    """
+
+    data_source: DataSource
+
+    def populate_from_proto(self, proto):
+        self.data_source = DataSource.from_proto(proto.data_source)
+
+    @property
+    def source_version(self):
+        fingerprint = self.data_source.fingerprint
+        if fingerprint is not None:
+            return fingerprint
+        return str(self.data_source.last_modified)
+
+    @property
+    def source_size(self):
+        return self.data_source.size
+
+    @contextmanager
+    def fetch(self):
+        with self.data_source.stage() as staged:
+            yield staged
+
+    def revalidate(self):
+        return self.data_source.revalidate()
+
+    def _open_content(self, staged: Any = None):
+        """Open a staged filename or use a staged stream, or without either
+        read from the data source"""
+        if isinstance(staged, str):
+            return open(staged, "rb")
+        elif staged is not None:
+            return nullcontext(staged)
+        else:
+            return self.data_source.get_content()
+
+    def _mappable_filename(self, staged: Any = None) -> Optional[str]:
+        """Filename arrays in the staged data can be memory-mapped from. The
+        data source's own file is never mapped, since rewriting it in place
+        would fault reads of the mapping."""
+        if isinstance(staged, str) and not self.data_source.is_source_file(staged):
+            return staged
+        return None
+
+    def update_available(self):
+        """Compare content fingerprints when the data source has them,
+        so a new modified time alone does not trigger a reload"""
+        if self.modified_time is None:
+            return True
+
+        fingerprint = self.data_source.fingerprint
+        if fingerprint is not None and self.fingerprint is not None:
+            return fingerprint != self.fingerprint
+        elif self.modified_time < self.data_source.last_modified:
+            return True
+        else:
+            return False
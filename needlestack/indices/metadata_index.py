@@ -0,0 +1,126 @@
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from needlestack.apis import indices_pb2
+from needlestack.exceptions import UnsupportedIndexOperationException
+
+NUMERIC_TYPES = {"double_val", "float_val", "long_val", "int_val"}
+CATEGORICAL_TYPES = {"string_val", "bool_val"}
+
+
+class MetadataIndex(object):
+    """Inverted indexes over metadata fields, used to turn a MetadataFilter into
+    a boolean mask over the rows of an index. String and bool fields map each
+    value to the sorted rows that have it. Numeric fields keep their values in
+    sorted order next to their rows, so equality and range conditions are
+    answered with ``np.searchsorted``.
+
+    Attributes:
+        count: Number of rows indexed
+        categorical: Field name to a map of value to rows
+        numeric: Field name to sorted values and the row of each value
+    """
+
+    count: int
+    categorical: Dict[str, Dict[Any, np.ndarray]]
+    numeric: Dict[str, Tuple[np.ndarray, np.ndarray]]
+
+    def __init__(self, metadatas: List[indices_pb2.Metadata]):
+        self.count = len(metadatas)
+        categorical: Dict[str, Dict[Any, List[int]]] = {}
+        numeric: Dict[str, Tuple[List[float], List[int]]] = {}
+        for i, metadata in enumerate(metadatas):
+            for field in metadata.fields:
+                value_type = field.WhichOneof("value")
+                if value_type in CATEGORICAL_TYPES:
+                    values = categorical.setdefault(field.name, {})
+                    values.setdefault(getattr(field, value_type), []).append(i)
+                elif value_type in NUMERIC_TYPES:
+                    values, rows = numeric.setdefault(field.name, ([], []))
+                    values.append(getattr(field, value_type))
+                    rows.append(i)
+
+        self.categorical = {
+            name: {
+                value: np.array(rows, dtype="int64") for value, rows in values.items()
+            }
+            for name, values in categorical.items()
+        }
+        self.numeric = {}
+        for name, (values, rows) in numeric.items():
+            values = np.array(values)
+            order = np.argsort(values, kind="stable")
+            self.numeric[name] = (values[order], np.array(rows, dtype="int64")[order])
+
+    def mask(self, metadata_filter: indices_pb2.MetadataFilter) -> np.ndarray:
+        """Rows that match every condition in a filter
+
+        Args:
+            metadata_filter: Conditions on metadata fields
+        """
+        mask = np.ones(self.count, dtype=bool)
+        for condition in metadata_filter.conditions:
+            mask &= self._condition_mask(condition)
+        return mask
+
+    def _condition_mask(self, condition: indices_pb2.MetadataCondition) -> np.ndarray:
+        condition_type = condition.WhichOneof("condition")
+        if condition_type == "equals":
+            return self._values_mask(condition.name, [condition.equals])
+        elif condition_type == "any_of":
+            return self._values_mask(condition.name, condition.any_of.values)
+        elif condition_type == "range":
+            mask = np.zeros(self.count, dtype=bool)
+            mask[self._range_rows(condition.name, condition.range)] = True
+            return mask
+        else:
+            raise UnsupportedIndexOperationException(
+                f"No condition set on metadata field {condition.name}"
+            )
+
+    def _values_mask(
+        self, name: str, fields: List[indices_pb2.MetadataField]
+    ) -> np.ndarray:
+        mask = np.zeros(self.count, dtype=bool)
+        for field in fields:
+            value_type = field.WhichOneof("value")
+            value = getattr(field, value_type) if value_type else None
+            if value_type in CATEGORICAL_TYPES:
+                rows = self.categorical.get(name, {}).get(value)
+                if rows is not None:
+                    mask[rows] = True
+            elif value_type in NUMERIC_TYPES:
+                mask[self._numeric_rows(name, value, value)] = True
+            else:
+                raise UnsupportedIndexOperationException(
+                    f"No value set in condition on metadata field {name}"
+                )
+        return mask
+
+    def _range_rows(
+        self, name: str, metadata_range: indices_pb2.MetadataRange
+    ) -> np.ndarray:
+        bounds = []
+        for bound in (metadata_range.min, metadata_range.max):
+            value_type = bound.WhichOneof("value")
+            if value_type is None:
+                bounds.append(None)
+            elif value_type in NUMERIC_TYPES:
+                bounds.append(getattr(bound, value_type))
+            else:
+                raise UnsupportedIndexOperationException(
+                    f"Range on metadata field {name} must have numeric bounds"
+                )
+        return self._numeric_rows(name, *bounds)
+
+    def _numeric_rows(self, name: str, low, high) -> np.ndarray:
+        """Rows with a value between inclusive bounds, where None is unbounded"""
+        if name not in self.numeric:
+            return np.empty(0, dtype="int64")
+        values, rows = self.numeric[name]
+        start = 0 if low is None else np.searchsorted(values, low, side="left")
+        end = (
+            len(values) if high is None else np.searchsorted(values, high, side="right")
+        )
+        return rows[start:end]
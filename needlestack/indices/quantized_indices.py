@@ -0,0 +1,414 @@
+from typing import Any, Optional
+
+import numpy as np
+
+from needlestack.apis import indices_pb2
+from needlestack.apis import serializers
+from needlestack.apis import wire
+from needlestack.indices.index import DataSourceIndex
+from needlestack.indices.id_index import IdIndex
+from needlestack.exceptions import UnsupportedIndexOperationException
+
+CODE_TYPE_TO_ENUM = {
+    "int8": indices_pb2.ScalarQuantizer.INT8,
+    "float16": indices_pb2.ScalarQuantizer.FLOAT16,
+}
+
+ENUM_TO_CODE_TYPE = {v: k for k, v in CODE_TYPE_TO_ENUM.items()}
+
+
+class ScalarQuantizer(object):
+    """Maps each dimension of a vector to an int8 or float16 code with its own
+    scale and offset, so that ``x = code * scale + offset``. Int8 codes span the
+    range of each dimension, float16 codes are centered on the mean of each
+    dimension and scaled into [-1, 1].
+
+    Attributes:
+        code_type: Either int8 or float16
+        scale: Scale of each dimension
+        offset: Offset of each dimension
+        inner_product: Rank by inner product instead of squared L2 distance
+    """
+
+    code_type: str
+    scale: np.ndarray
+    offset: np.ndarray
+    inner_product: bool
+
+    def __init__(
+        self,
+        code_type: str,
+        scale: np.ndarray,
+        offset: np.ndarray,
+        inner_product: bool = False,
+    ):
+        if code_type not in CODE_TYPE_TO_ENUM:
+            raise UnsupportedIndexOperationException(
+                f"Code type {code_type} not supported"
+            )
+        self.code_type = code_type
+        self.scale = np.asarray(scale, dtype="float32")
+        self.offset = np.asarray(offset, dtype="float32")
+        self.inner_product = inner_product
+
+    @classmethod
+    def train(
+        cls, X: np.ndarray, code_type: str = "int8", inner_product: bool = False
+    ) -> "ScalarQuantizer":
+        """Fit the scale and offset of each dimension to a matrix of vectors
+
+        Args:
+            X: Matrix of vectors
+            code_type: Either int8 or float16
+            inner_product: Rank by inner product instead of squared L2 distance
+        """
+        X = np.asarray(X, dtype="float32")
+        if len(X) == 0:
+            scale = np.ones(X.shape[1], dtype="float32")
+            return cls(code_type, scale, np.zeros_like(scale), inner_product)
+
+        if code_type == "int8":
+            low, high = X.min(axis=0), X.max(axis=0)
+            scale = (high - low) / 255
+            scale[scale == 0] = 1
+            offset = low + 128 * scale
+        else:
+            offset = X.mean(axis=0)
+            scale = np.abs(X - offset).max(axis=0)
+            scale[scale == 0] = 1
+        return cls(code_type, scale, offset, inner_product)
+
+    @classmethod
+    def from_proto(cls, proto: indices_pb2.ScalarQuantizer) -> "ScalarQuantizer":
+        return cls(
+            ENUM_TO_CODE_TYPE[proto.code_type],
+            serializers.proto_to_ndarray(proto.scale),
+            serializers.proto_to_ndarray(proto.offset),
+            proto.inner_product,
+        )
+
+    def to_proto(self) -> indices_pb2.ScalarQuantizer:
+        return indices_pb2.ScalarQuantizer(
+            code_type=CODE_TYPE_TO_ENUM[self.code_type],
+            scale=serializers.ndarray_to_proto(self.scale),
+            offset=serializers.ndarray_to_proto(self.offset),
+            inner_product=self.inner_product,
+        )
+
+    @property
+    def dimension(self) -> int:
+        return len(self.scale)
+
+    def encode(self, X: np.ndarray) -> np.ndarray:
+        codes = (np.asarray(X, dtype="float32") - self.offset) / self.scale
+        if self.code_type == "int8":
+            return np.clip(np.rint(codes), -128, 127).astype("int8")
+        else:
+            return codes.astype("float16")
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype("float32") * self.scale + self.offset
+
+
+class ScalarQuantizedIndex(DataSourceIndex):
+    """Implementation of a BaseIndex that keeps vectors in memory as int8 or
+    float16 codes, a quarter or half the size of float32 vectors. Searches scan
+    all codes with NumPy for the closest candidates, then re-rank those
+    candidates exactly against full-precision vectors. Full-precision vectors
+    are memory-mapped from the loaded file, so only pages of candidates are read.
+
+    Attributes:
+        quantizer: Map between vectors and codes
+        codes: Matrix of codes for each vector
+        norms: Squared L2 norm of each decoded code
+        vectors: Matrix of full-precision vectors, memory-mapped after a load
+        metadata_blob: Encoded metadata of each item, the only copy kept.
+            Metadata messages are decoded from it when needed.
+        id_index: Map from metadata id to row
+        enable_id_to_vector: Enable retrieving vector from id
+        rerank_factor: Candidates re-ranked per neighbor requested,
+            0 returns distances between query vectors and codes instead
+        scan_batch_size: Rows of codes decoded at a time while scanning
+    """
+
+    quantizer: ScalarQuantizer
+    codes: np.ndarray
+    norms: np.ndarray
+    vectors: np.ndarray
+    id_index: Optional[IdIndex] = None
+    enable_id_to_vector: bool = False
+    rerank_factor: int = 4
+    scan_batch_size: int = 65536
+
+    @property
+    def dimension(self):
+        return self.quantizer.dimension
+
+    @property
+    def count(self):
+        return len(self.codes)
+
+    @property
+    def inner_product(self):
+        return self.quantizer.inner_product
+
+    def populate(self, data):
+        self.quantizer = data.get("quantizer")
+        self.codes = data.get("codes")
+        self.vectors = data.get("vectors")
+        self.metadata_blob = data.get("metadata_blob")
+        if self.metadata_blob is None:
+            self.metadata_blob = wire.MetadataBlob.from_metadatas(data["metadatas"])
+        self.modified_time = data.get("modified_time")
+        self.fingerprint = data.get("fingerprint")
+        self.id_index = data.get("id_index")
+        self.norms = self._code_norms()
+
+    def set_vectors(self, X, metadatas):
+        """Replace the vectors, fitting a new quantizer of the same code type"""
+        X = np.array(X, dtype="float32").reshape(-1, self.dimension)
+        quantizer = ScalarQuantizer.train(
+            X, self.quantizer.code_type, self.quantizer.inner_product
+        )
+        self.populate(
+            {
+                "quantizer": quantizer,
+                "codes": quantizer.encode(X),
+                "vectors": X,
+                "metadatas": list(metadatas),
+                "modified_time": self.modified_time,
+                "fingerprint": self.fingerprint,
+            }
+        )
+        self._set_id_to_vector(self.enable_id_to_vector)
+        self._set_metadata_index(self.enable_metadata_index)
+
+    def add_vectors(self, X, metadatas):
+        X = np.asarray(X, dtype="float32").reshape(-1, self.dimension)
+        self.set_vectors(np.vstack([self.vectors, X]), self.metadatas + list(metadatas))
+
+    def serialize(self):
+        id_index = self.id_index or IdIndex.from_ids(
+            [metadata.id for metadata in self.metadatas]
+        )
+        id_hashes, id_rows = id_index.tobytes()
+
+        return indices_pb2.ScalarQuantizedIndex(
+            quantizer=self.quantizer.to_proto(),
+            metadatas=self.metadatas,
+            codes=np.ascontiguousarray(self.codes).tobytes(),
+            vectors=np.ascontiguousarray(self.vectors, dtype="<f4").tobytes(),
+            id_hashes=id_hashes,
+            id_rows=id_rows,
+        )
+
+    def write(self, f):
+        """Write the serialized index field by field, with the codes and
+        vectors written straight from their arrays"""
+        fields = indices_pb2.ScalarQuantizedIndex
+        wire.write_field(
+            f,
+            fields.QUANTIZER_FIELD_NUMBER,
+            self.quantizer.to_proto().SerializeToString(),
+        )
+        encode_metadata = self._metadata_encoder()
+        for i in range(self.count):
+            wire.write_field(f, fields.METADATAS_FIELD_NUMBER, encode_metadata(i))
+        wire.write_field(f, fields.CODES_FIELD_NUMBER, np.ascontiguousarray(self.codes))
+        wire.write_field(
+            f,
+            fields.VECTORS_FIELD_NUMBER,
+            np.ascontiguousarray(self.vectors, dtype="<f4"),
+        )
+
+        id_index = self.id_index or IdIndex.from_ids(
+            [metadata.id for metadata in self.metadatas]
+        )
+        wire.write_field(f, fields.ID_HASHES_FIELD_NUMBER, id_index.hashes)
+        wire.write_field(f, fields.ID_ROWS_FIELD_NUMBER, id_index.rows)
+
+    def _load(self, staged: Any = None):
+        """Parse the serialized index field by field as it streams in. Vectors
+        are memory-mapped from a staged copy, or else from a temporary copy."""
+        fingerprint = self.data_source.fingerprint
+        modified_time = self.data_source.last_modified
+        filename = self._mappable_filename(staged)
+        fields = indices_pb2.ScalarQuantizedIndex
+        quantizer = None
+        encoded_metadatas = []
+        arrays = {}
+        with self._open_content(staged) as content:
+            for field in serializers.iter_proto_fields(content):
+                if field.number == fields.QUANTIZER_FIELD_NUMBER:
+                    quantizer = ScalarQuantizer.from_proto(
+                        indices_pb2.ScalarQuantizer.FromString(field.read())
+                    )
+                elif field.number == fields.METADATAS_FIELD_NUMBER:
+                    encoded_metadatas.append(field.read())
+                elif field.number == fields.CODES_FIELD_NUMBER:
+                    arrays[field.number] = field.read()
+                elif field.number == fields.VECTORS_FIELD_NUMBER:
+                    arrays[field.number] = serializers.read_array(
+                        field, filename, spill=True
+                    )
+                elif field.number in ID_INDEX_FIELD_NUMBERS:
+                    arrays[field.number] = serializers.read_array(field, filename)
+
+        d = quantizer.dimension
+        codes = np.frombuffer(
+            arrays.get(fields.CODES_FIELD_NUMBER, b""), dtype=quantizer.code_type
+        ).reshape(-1, d)
+        vectors = np.frombuffer(
+            arrays.get(fields.VECTORS_FIELD_NUMBER, b""), dtype="<f4"
+        ).reshape(-1, d)
+
+        id_index = None
+        if all(n in arrays for n in ID_INDEX_FIELD_NUMBERS):
+            id_index = IdIndex.frombuffer(*(arrays[n] for n in ID_INDEX_FIELD_NUMBERS))
+
+        self.populate(
+            {
+                "quantizer": quantizer,
+                "codes": codes,
+                "vectors": vectors,
+                "metadata_blob": wire.MetadataBlob.from_encoded(encoded_metadatas),
+                "modified_time": modified_time,
+                "fingerprint": fingerprint,
+                "id_index": id_index,
+            }
+        )
+
+        self._set_id_to_vector(self.enable_id_to_vector)
+        self._set_metadata_index(self.enable_metadata_index)
+
+    def _code_norms(self) -> np.ndarray:
+        norms = np.empty(self.count, dtype="float32")
+        for start in range(0, self.count, self.scan_batch_size):
+            end = start + self.scan_batch_size
+            decoded = self.quantizer.decode(self.codes[start:end])
+            norms[start:end] = (decoded**2).sum(axis=1)
+        return norms
+
+    def _set_id_to_vector(self, enable: bool):
+        if enable:
+            if self.id_index is None or len(self.id_index) != len(self.metadata_blob):
+                self.id_index = IdIndex.from_ids(
+                    [metadata.id for metadata in self.metadatas]
+                )
+            self.enable_id_to_vector = True
+        else:
+            self.id_index = None
+            self.enable_id_to_vector = False
+
+    @property
+    def metadatas(self):
+        """Metadata of every item, decoded from the metadata blob"""
+        return [self.metadata_blob.decode(i) for i in range(len(self.metadata_blob))]
+
+    def _get_metadata_by_index(self, i):
+        return self.metadata_blob.decode(i)
+
+    def _get_vector_by_index(self, i):
+        return np.array(self.vectors[i])
+
+    def _get_vectors_by_indices(self, idxs):
+        return self.vectors[np.asarray(idxs, dtype="int64")]
+
+    def _get_index_by_id(self, id):
+        if self.enable_id_to_vector:
+            for i in self.id_index.candidates(id):
+                if self._get_metadata_by_index(i).id == id:
+                    return int(i)
+            return None
+        else:
+            raise UnsupportedIndexOperationException(
+                "Index does not have enable_id_to_vector"
+            )
+
+    def knn_search(self, X, k, mask=None, params=None):
+        X = np.asarray(X, dtype="float32")
+        if X.ndim != 2 or X.shape[1] != self.dimension:
+            raise ValueError(f"Expected vectors of dimension {self.dimension}")
+
+        available = self.count if mask is None else int(np.count_nonzero(mask))
+        k = min(k, self.count)
+        rerank_factor = self.rerank_factor
+        if params is not None and params.rerank_factor:
+            rerank_factor = params.rerank_factor
+        num_candidates = min(available, max(k * rerank_factor, k))
+        dists, idxs = self._scan(X, num_candidates, mask)
+        if rerank_factor > 0:
+            dists, idxs = self._rerank(X, idxs)
+
+        dists, idxs = dists[:, :k], idxs[:, :k]
+        if idxs.shape[1] < k:
+            padding = k - idxs.shape[1]
+            fill = -np.inf if self.inner_product else np.inf
+            dists = np.pad(dists, ((0, 0), (0, padding)), constant_values=fill)
+            idxs = np.pad(idxs, ((0, 0), (0, padding)), constant_values=-1)
+        return dists, idxs
+
+    def _scan(self, X, num_candidates, mask):
+        """Closest rows by the distance between query vectors and decoded
+        codes, in batches of codes. Inner products are negated while scanning
+        so that smaller is closer for either metric."""
+        n = len(X)
+        best_dists = np.empty((n, 0), dtype="float32")
+        best_idxs = np.empty((n, 0), dtype="int64")
+        if num_candidates == 0:
+            return best_dists, best_idxs
+
+        # x . decode(c) = (scale * x) . c + x . offset
+        W = X * self.quantizer.scale
+        bias = X @ self.quantizer.offset
+        query_norms = (X**2).sum(axis=1)
+
+        for start in range(0, self.count, self.scan_batch_size):
+            end = min(start + self.scan_batch_size, self.count)
+            products = W @ self.codes[start:end].astype("float32").T + bias[:, None]
+            if self.inner_product:
+                dists = -products
+            else:
+                dists = query_norms[:, None] - 2 * products + self.norms[start:end]
+            if mask is not None:
+                dists[:, ~mask[start:end]] = np.inf
+
+            best_dists = np.hstack([best_dists, dists])
+            best_idxs = np.hstack(
+                [best_idxs, np.broadcast_to(np.arange(start, end), (n, end - start))]
+            )
+            if best_dists.shape[1] > num_candidates:
+                keep = np.argpartition(best_dists, num_candidates - 1, axis=1)
+                keep = keep[:, :num_candidates]
+                best_dists = np.take_along_axis(best_dists, keep, axis=1)
+                best_idxs = np.take_along_axis(best_idxs, keep, axis=1)
+
+        order = np.argsort(best_dists, axis=1, kind="stable")
+        best_dists = np.take_along_axis(best_dists, order, axis=1)
+        best_idxs = np.take_along_axis(best_idxs, order, axis=1)
+        if self.inner_product:
+            best_dists = -best_dists
+        else:
+            best_dists = np.maximum(best_dists, 0)
+        return best_dists.astype("float32"), best_idxs
+
+    def _rerank(self, X, idxs):
+        """Exact distances to candidate rows, in order of exact distance"""
+        n, m = idxs.shape
+        vectors = self._get_vectors_by_indices(idxs.ravel()).reshape(n, m, -1)
+        if self.inner_product:
+            dists = -np.einsum("nmd,nd->nm", vectors, X)
+        else:
+            dists = ((vectors - X[:, None, :]) ** 2).sum(axis=2)
+
+        order = np.argsort(dists, axis=1, kind="stable")
+        dists = np.take_along_axis(dists, order, axis=1).astype("float32")
+        if self.inner_product:
+            dists = -dists
+        return dists, np.take_along_axis(idxs, order, axis=1)
+
+
+ID_INDEX_FIELD_NUMBERS = (
+    indices_pb2.ScalarQuantizedIndex.ID_HASHES_FIELD_NUMBER,
+    indices_pb2.ScalarQuantizedIndex.ID_ROWS_FIELD_NUMBER,
+)
@@ -0,0 +1,206 @@
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from concurrent.futures import Future, TimeoutError
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+
+from needlestack.apis import servicers_pb2
+from needlestack.exceptions import AdmissionRejectedException
+from needlestack.servicers.settings import BaseConfig
+from needlestack.utilities.metrics import MetricsRegistry, registry
+
+# Waiters are granted slots highest class first
+_PRIORITY_RANK = {
+    servicers_pb2.SearchRequest.HIGH: 0,
+    servicers_pb2.SearchRequest.NORMAL: 1,
+    servicers_pb2.SearchRequest.LOW: 2,
+}
+
+_Waiter = Tuple[int, int, int, Future]
+
+
+class AdmissionController(object):
+    """Caps the RPCs a servicer works on at once, so an overloaded node sheds
+    requests quickly instead of queueing them without bound. RPCs beyond the
+    limit wait up to ``queue_timeout`` seconds for a slot, highest priority
+    first, and are rejected when the wait runs out or ``max_queue`` RPCs are
+    already waiting. Each priority class may only hold part of the slots, so
+    low priority traffic is shed before normal traffic and a reserve is kept
+    for high priority RPCs. Rejections carry a hint of how long to wait
+    before retrying, from the recent time RPCs hold a slot.
+
+    Attributes:
+        name: Name of the servicer, used to label metrics
+        max_concurrency: Max RPCs in flight
+        queue_timeout: Max seconds an RPC waits for a slot
+        max_queue: Max RPCs waiting for a slot
+        low_priority_share: Fraction of slots low priority RPCs may hold
+        high_priority_reserve: Fraction of slots only high priority RPCs may hold
+        in_flight: Number of RPCs holding a slot
+        metrics: Registry rejections are reported to
+    """
+
+    name: str
+    max_concurrency: int
+    queue_timeout: float
+    max_queue: int
+    low_priority_share: float
+    high_priority_reserve: float
+    in_flight: int
+    metrics: MetricsRegistry
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        queue_timeout: float = 0.05,
+        max_queue: Optional[int] = None,
+        low_priority_share: float = 0.5,
+        high_priority_reserve: float = 0.1,
+        metrics: MetricsRegistry = registry,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_concurrency if max_queue is None else max_queue
+        self.low_priority_share = low_priority_share
+        self.high_priority_reserve = high_priority_reserve
+        self.in_flight = 0
+        self.metrics = metrics
+        self._service_time = queue_timeout
+        self._waiters: List[_Waiter] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def limit(self, priority: int) -> int:
+        """Slots RPCs of a priority class may hold, at least one"""
+        if priority == servicers_pb2.SearchRequest.HIGH:
+            share = 1.0
+        elif priority == servicers_pb2.SearchRequest.LOW:
+            share = self.low_priority_share
+        else:
+            share = 1.0 - self.high_priority_reserve
+        return max(1, int(self.max_concurrency * share))
+
+    @contextmanager
+    def admit(self, priority: int = servicers_pb2.SearchRequest.NORMAL):
+        """Hold a slot for the duration of an RPC, blocking until one is free
+
+        Args:
+            priority: Admission class of the RPC
+
+        Raises:
+            AdmissionRejectedException: No slot was free within the queue timeout
+        """
+        waiter = self._enter(priority)
+        if waiter is not None:
+            try:
+                waiter[3].result(self.queue_timeout)
+            except TimeoutError:
+                self._abandon(waiter)
+            except BaseException:
+                self._abandon(waiter, rejected=False)
+                raise
+        with self._hold():
+            yield
+
+    @asynccontextmanager
+    async def admit_async(
+        self, priority: int = servicers_pb2.SearchRequest.NORMAL
+    ) -> AsyncIterator[None]:
+        """Like admit, but waits for a slot without blocking the event loop"""
+        waiter = self._enter(priority)
+        if waiter is not None:
+            granted = asyncio.wrap_future(waiter[3])
+            try:
+                await asyncio.wait_for(asyncio.shield(granted), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._abandon(waiter)
+            except BaseException:
+                self._abandon(waiter, rejected=False)
+                raise
+        with self._hold():
+            yield
+
+    def _enter(self, priority: int) -> Optional[_Waiter]:
+        """Take a slot if one is free and nobody of the same or a higher class
+        is waiting. Otherwise queue a waiter, or reject if the queue is full."""
+        rank = _PRIORITY_RANK.get(priority, 1)
+        with self._lock:
+            waiting_ahead = self._waiters and self._waiters[0][0] <= rank
+            if not waiting_ahead and self.in_flight < self.limit(priority):
+                self.in_flight += 1
+                return None
+            if len(self._waiters) >= self.max_queue:
+                raise self._reject(priority, "queue is full")
+            waiter = (rank, next(self._sequence), priority, Future())
+            heapq.heappush(self._waiters, waiter)
+            return waiter
+
+    def _abandon(self, waiter: _Waiter, rejected: bool = True):
+        """Stop waiting for a slot. If the slot was granted meanwhile, it is
+        kept when timing out and given back when the RPC was cancelled."""
+        with self._lock:
+            if waiter[3].cancel():
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                if rejected:
+                    raise self._reject(waiter[2], "timed out waiting for a slot")
+                return
+        if not rejected:
+            self._release()
+
+    @contextmanager
+    def _hold(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(time.perf_counter() - start)
+
+    def _release(self, service_time: Optional[float] = None):
+        with self._lock:
+            self.in_flight -= 1
+            if service_time is not None:
+                self._service_time += 0.1 * (service_time - self._service_time)
+            while self._waiters:
+                _, _, priority, future = self._waiters[0]
+                if self.in_flight >= self.limit(priority):
+                    break
+                heapq.heappop(self._waiters)
+                self.in_flight += 1
+                future.set_result(None)
+
+    def _reject(self, priority: int, reason: str) -> AdmissionRejectedException:
+        self.metrics.increment(
+            "admission_rejected_total",
+            servicer=self.name,
+            priority=servicers_pb2.SearchRequest.Priority.Name(priority),
+        )
+        retry_after = max(
+            self.queue_timeout,
+            self._service_time * (len(self._waiters) + 1) / self.max_concurrency,
+        )
+        return AdmissionRejectedException(
+            f"{self.name} is overloaded, {reason}", retry_after
+        )
+
+
+def create_admission_controller(
+    config: BaseConfig, name: str
+) -> Optional[AdmissionController]:
+    """Admission controller from config, None when ADMISSION_MAX_CONCURRENCY
+    is not set"""
+    if config.ADMISSION_MAX_CONCURRENCY is None:
+        return None
+    return AdmissionController(
+        name,
+        config.ADMISSION_MAX_CONCURRENCY,
+        config.ADMISSION_QUEUE_TIMEOUT,
+        config.ADMISSION_MAX_QUEUE,
+        config.ADMISSION_LOW_PRIORITY_SHARE,
+        config.ADMISSION_HIGH_PRIORITY_RESERVE,
+    )
@@ -0,0 +1,81 @@
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import numpy as np
+
+
+class SearchBatcher(object):
+    """Gathers concurrent single-vector searches that share a key into one
+    matrix, so an index searches them in a single call. The first search of
+    a batch leads it. It waits up to ``window`` seconds, or until the batch
+    has ``max_batch_size`` rows, then runs the batch on its own thread and
+    hands each waiting search its row of results. Searches never wait longer
+    than the window plus one batched search, and no threads are started.
+
+    Attributes:
+        window: Max seconds a batch waits for more searches
+        max_batch_size: Max rows in a batch
+    """
+
+    window: float
+    max_batch_size: int
+
+    def __init__(self, window: float, max_batch_size: int = 32):
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._batches: Dict[Hashable, _Batch] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        key: Hashable,
+        x: np.ndarray,
+        search: Callable[[np.ndarray], List[Any]],
+    ) -> Any:
+        """Search for one vector in a batch with others of the same key, and
+        return its row of the results
+
+        Args:
+            key: Searches batch together only if their keys are equal
+            x: Query vector, or matrix with one row
+            search: Function from a matrix to a list of results per row, called
+                once per batch with the function of the batch's leader
+        """
+        with self._lock:
+            batch = self._batches.get(key)
+            leader = batch is None
+            if leader:
+                batch = _Batch()
+                self._batches[key] = batch
+            row = len(batch.rows)
+            batch.rows.append(x.reshape(-1))
+            if len(batch.rows) >= self.max_batch_size:
+                del self._batches[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._batches.get(key) is batch:
+                    del self._batches[key]
+            try:
+                batch.results = search(np.vstack(batch.rows))
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[row]
+
+
+class _Batch(object):
+    def __init__(self):
+        self.rows: List[np.ndarray] = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results: List[Any] = []
+        self.error: Optional[Exception] = None
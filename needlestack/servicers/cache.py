@@ -0,0 +1,158 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from needlestack.utilities.metrics import MetricsRegistry, registry
+
+ShardKey = Tuple[str, str]
+
+
+class ResultCache(object):
+    """Encoded search responses of recent queries, evicted least recently
+    used first once their total size passes ``max_bytes``. Each entry
+    records the shards its results came from, so that entries are dropped
+    as soon as one of those shards changes. Searches read the generation of
+    the shards they touch before they start and pass it to put, so results
+    computed while one of those shards changed are never stored, while
+    changes to other shards and collections do not get in the way.
+
+    Attributes:
+        max_bytes: Max total bytes of cached responses
+        size: Total bytes of cached responses
+        metrics: Registry hits, misses and size are reported to
+    """
+
+    max_bytes: int
+    size: int
+    metrics: MetricsRegistry
+
+    def __init__(self, max_bytes: int, metrics: MetricsRegistry = registry):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.metrics = metrics
+        self._invalidations = 0
+        self._shard_generations: Dict[ShardKey, int] = {}
+        self._collection_generations: Dict[str, int] = {}
+        self._entries: "OrderedDict[bytes, Tuple[bytes, Tuple[ShardKey, ...]]]" = (
+            OrderedDict()
+        )
+        self._by_shard: Dict[ShardKey, Set[bytes]] = {}
+        self._hits = 0
+        self._lookups = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts: bytes) -> bytes:
+        """Digest of the parts of a query that decide its results"""
+        digest = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            digest.update(len(part).to_bytes(8, "little"))
+            digest.update(part)
+        return digest.digest()
+
+    def generation(self, shards: Iterable[ShardKey]) -> int:
+        """Generation of a set of shards, which changes whenever one of them
+        or its collection is invalidated"""
+        with self._lock:
+            return self._generation(shards)
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            self._lookups += 1
+            if entry is not None:
+                self._hits += 1
+                self._entries.move_to_end(key)
+            hits, lookups = self._hits, self._lookups
+
+        self.metrics.increment(
+            "search_cache_hits_total"
+            if entry is not None
+            else "search_cache_misses_total"
+        )
+        self.metrics.set_gauge("search_cache_hit_ratio", hits / lookups)
+        return entry[0] if entry is not None else None
+
+    def put(
+        self, key: bytes, value: bytes, shards: Iterable[ShardKey], generation: int
+    ):
+        """Cache a response, unless it is larger than the cache or a shard
+        changed since the search read their generation
+
+        Args:
+            key: Key of the query
+            value: Encoded response
+            shards: Collection and shard names the results came from
+            generation: Generation of shards before the search started
+        """
+        if len(value) > self.max_bytes:
+            return
+        shards = tuple(shards)
+        with self._lock:
+            if generation != self._generation(shards):
+                return
+            self._remove(key)
+            self._entries[key] = (value, shards)
+            for shard in shards:
+                self._by_shard.setdefault(shard, set()).add(key)
+            self.size += len(value)
+
+            evicted = 0
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                evicted += 1
+            self._publish()
+        if evicted:
+            self.metrics.increment("search_cache_evictions_total", evicted)
+
+    def invalidate(self, collection_name: str, shard_name: Optional[str] = None):
+        """Drop cached responses with results from a shard, or from any shard
+        of a collection when no shard is given"""
+        with self._lock:
+            self._invalidations += 1
+            if shard_name is None:
+                self._collection_generations[collection_name] = self._invalidations
+            else:
+                self._shard_generations[(collection_name, shard_name)] = (
+                    self._invalidations
+                )
+            shards = [
+                shard
+                for shard in self._by_shard
+                if shard[0] == collection_name
+                and (shard_name is None or shard[1] == shard_name)
+            ]
+            for shard in shards:
+                for key in list(self._by_shard.get(shard, ())):
+                    self._remove(key)
+            self._publish()
+
+    def _generation(self, shards: Iterable[ShardKey]) -> int:
+        """Latest invalidation of any of the shards or their collections"""
+        return max(
+            (
+                max(
+                    self._shard_generations.get(shard, 0),
+                    self._collection_generations.get(shard[0], 0),
+                )
+                for shard in shards
+            ),
+            default=0,
+        )
+
+    def _remove(self, key: bytes):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        value, shards = entry
+        self.size -= len(value)
+        for shard in shards:
+            keys = self._by_shard[shard]
+            keys.discard(key)
+            if not keys:
+                del self._by_shard[shard]
+
+    def _publish(self):
+        self.metrics.set_gauge("search_cache_bytes", self.size)
+        self.metrics.set_gauge("search_cache_entries", len(self._entries))
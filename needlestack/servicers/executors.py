@@ -0,0 +1,175 @@
+import time
+import logging
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from needlestack.apis import collections_pb2
+from needlestack.exceptions import AdmissionRejectedException
+from needlestack.utilities.metrics import MetricsRegistry, registry
+
+logger = logging.getLogger("needlestack")
+
+_local = threading.local()
+
+
+class CollectionExecutor(Executor):
+    """Threads that run the searches of one collection, or of a group of
+    collections, apart from searches of other collections. At most
+    ``max_concurrency`` searches run at once and ``max_queue`` more wait for
+    a thread. Searches beyond that are rejected rather than queued, so a
+    collection under heavy load cannot hold every thread of the Searcher's
+    gRPC server while it waits.
+
+    Attributes:
+        name: Name of the collection or group
+        max_concurrency: Max searches running at once
+        max_queue: Max searches waiting for a thread
+        pending: Number of searches running or waiting
+        metrics: Registry rejections are reported to
+    """
+
+    name: str
+    max_concurrency: int
+    max_queue: int
+    pending: int
+    metrics: MetricsRegistry
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        max_queue: Optional[int] = None,
+        metrics: MetricsRegistry = registry,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_concurrency if max_queue is None else max_queue
+        self.pending = 0
+        self.metrics = metrics
+        self._service_time = 0.0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix=f"search-{name}"
+        )
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Schedule a search on the executor's threads
+
+        Raises:
+            AdmissionRejectedException: Too many searches are already waiting
+        """
+        with self._lock:
+            if self.pending >= self.max_concurrency + self.max_queue:
+                self.metrics.increment(
+                    "search_executor_rejected_total", executor=self.name
+                )
+                retry_after = self._service_time * self.pending / self.max_concurrency
+                raise AdmissionRejectedException(
+                    f"Search executor {self.name} is full", retry_after
+                )
+            self.pending += 1
+        return self._executor.submit(self._run, fn, *args, **kwargs)
+
+    def run(self, fn: Callable, *args):
+        """Run a search on the executor's threads and wait for its result.
+        Searches already on one of its threads run in place."""
+        if getattr(_local, "executor", None) is self:
+            return fn(*args)
+        return self.submit(fn, *args).result()
+
+    def shutdown(self, wait: bool = True, **kwargs):
+        self._executor.shutdown(wait)
+
+    def _run(self, fn: Callable, *args, **kwargs):
+        _local.executor = self
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.executor = None
+            with self._lock:
+                self.pending -= 1
+                elapsed = time.perf_counter() - start
+                self._service_time += 0.1 * (elapsed - self._service_time)
+
+
+class CollectionExecutors(object):
+    """Search executors of the collections on a Searcher, configured by the
+    search_executor of each collection. Executors without a max_concurrency
+    split ``threads`` between them by weight. Collections without a
+    search_executor have no executor and search on the calling thread.
+
+    Attributes:
+        threads: Threads split by weight between executors
+        executors: Executor of each group
+        groups: Group of each collection with an executor
+    """
+
+    threads: int
+    executors: Dict[str, CollectionExecutor]
+    groups: Dict[str, str]
+
+    def __init__(self, threads: int):
+        self.threads = threads
+        self.executors = {}
+        self.groups = {}
+
+    def get(self, collection_name: str) -> Optional[CollectionExecutor]:
+        group = self.groups.get(collection_name)
+        return self.executors.get(group) if group is not None else None
+
+    def configure(self, protos: Iterable[collections_pb2.Collection]):
+        """Create, resize or drop executors to match collection configs
+
+        Args:
+            protos: Configs of every collection on the Searcher
+        """
+        groups: Dict[str, str] = {}
+        settings: Dict[str, collections_pb2.SearchExecutor] = {}
+        for proto in protos:
+            if not proto.HasField("search_executor"):
+                continue
+            group = proto.search_executor.group or proto.name
+            groups[proto.name] = group
+            merged = settings.setdefault(group, collections_pb2.SearchExecutor())
+            merged.max_concurrency = max(
+                merged.max_concurrency, proto.search_executor.max_concurrency
+            )
+            merged.weight = max(merged.weight, proto.search_executor.weight or 1.0)
+            merged.max_queue = max(merged.max_queue, proto.search_executor.max_queue)
+
+        executors = {}
+        for group, (max_concurrency, max_queue) in self._sizes(settings).items():
+            executor = self.executors.get(group)
+            if (
+                executor is None
+                or executor.max_concurrency != max_concurrency
+                or executor.max_queue != max_queue
+            ):
+                logger.debug(f"Search executor {group} with {max_concurrency} threads")
+                executor = CollectionExecutor(group, max_concurrency, max_queue)
+            executors[group] = executor
+
+        # Replaced executors are not shut down, since searches that looked them
+        # up may still submit to them. Their threads exit once they are idle
+        # and no longer referenced.
+        self.executors, self.groups = executors, groups
+
+    def shutdown(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=False)
+        self.executors, self.groups = {}, {}
+
+    def _sizes(
+        self, settings: Dict[str, collections_pb2.SearchExecutor]
+    ) -> Dict[str, Tuple[int, int]]:
+        """Threads and queue length of each group's executor"""
+        total_weight = sum(s.weight for s in settings.values() if not s.max_concurrency)
+        sizes = {}
+        for group, s in settings.items():
+            max_concurrency = s.max_concurrency or max(
+                1, round(self.threads * s.weight / total_weight)
+            )
+            sizes[group] = (max_concurrency, s.max_queue or max_concurrency)
+        return sizes
@@ -1,28 +1,83 @@
 import os
 import logging
+import queue
+import select
+import signal
+import struct
+import threading
 import time
 from concurrent import futures
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, Tuple
 
 import grpc
 from grpc._server import _Server
 
+from needlestack.apis import collections_pb2
 from needlestack.servicers.settings import BaseConfig
 from needlestack.servicers.logging import configure_logger
 from needlestack.cluster_managers.manager import ClusterManager
+from needlestack.utilities.rpc import (
+    AioEncodedResponseInterceptor,
+    EncodedResponseInterceptor,
+)
+
+if TYPE_CHECKING:
+    from needlestack.servicers.searcher import SearcherServicer
 
 _ONE_DAY_IN_SECONDS = 60 * 60 * 24
+_WORKER_STOP_GRACE_SECONDS = 10
+
+# Records from workers to the parent, a pid and one of the kinds below
+_RECORD_FORMAT = "<ii"
+_RELOAD_REQUESTED = 0
+_APPLIED = 1
+_APPLY_FAILED = 2
+
+# Commands from the parent to a worker, a kind and the length of its content
+_COMMAND_FORMAT = "<BI"
+_APPLY_COLLECTIONS = 1
+_RELOAD_RESULT = 2
 
 logger = logging.getLogger("needlestack")
 
 
-def create_server(config: BaseConfig) -> _Server:
+def create_server(
+    config: BaseConfig, options: Optional[List[Tuple[str, Any]]] = None
+) -> _Server:
     """Create a gRPC server app with a health servicer.
 
+    Args:
+        config: Config with settings on how to setup the server
+        options: Optional gRPC channel arguments for the server
+    """
+    configure_logger(config)
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=config.MAX_WORKERS),
+        interceptors=[EncodedResponseInterceptor()],
+        options=options,
+        maximum_concurrent_rpcs=config.max_concurrent_rpcs,
+    )
+    if config.use_server_ssl:
+        server.add_secure_port(
+            f"[::]:{config.SERVICER_PORT}", config.ssl_server_credentials
+        )
+    else:
+        server.add_insecure_port(f"[::]:{config.SERVICER_PORT}")
+    return server
+
+
+def create_aio_server(config: BaseConfig) -> grpc.aio.Server:
+    """Create a grpc.aio server app. Servicers on it handle RPCs on the event
+    loop, so concurrency is not capped by a thread pool.
+
     Args:
         config: Config with settings on how to setup the server
     """
     configure_logger(config)
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=config.MAX_WORKERS))
+    server = grpc.aio.server(
+        interceptors=[AioEncodedResponseInterceptor()],
+        maximum_concurrent_rpcs=config.max_concurrent_rpcs,
+    )
     if config.use_server_ssl:
         server.add_secure_port(
             f"[::]:{config.SERVICER_PORT}", config.ssl_server_credentials
@@ -57,3 +112,370 @@ def serve(server: _Server):
     except KeyboardInterrupt:
         logger.info(f"Stopped gRPC server on {os.getpid()}")
         server.stop(0)
+
+
+async def serve_aio(server: grpc.aio.Server):
+    await server.start()
+    logger.info(f"Started gRPC aio server on {os.getpid()}")
+    try:
+        await server.wait_for_termination()
+    finally:
+        logger.info(f"Stopped gRPC aio server on {os.getpid()}")
+        await server.stop(0)
+
+
+def serve_searcher_processes(
+    config: BaseConfig,
+    servicer: "SearcherServicer",
+    register: Callable[[_Server], None],
+    processes: Optional[int] = None,
+):
+    """Serve a Searcher from several forked worker processes, so work outside
+    of Faiss is not bound to one core by the GIL. The calling process keeps
+    the loaded collections and the cluster manager session. Workers are
+    forked from it, sharing index pages copy-on-write, and each binds the
+    servicer port with SO_REUSEPORT.
+
+    A CollectionsLoad request to any worker is forwarded to the parent, which
+    lists the local collections and sends them to every worker. Each worker
+    loads them in place, copying shards from peers when config enables
+    PEER_SHARD_TRANSFER, and the parent sets replica states once all have.
+    Shards loaded by a reload are not shared between workers.
+
+    The parent must not have started gRPC servers or used channels before
+    calling this, since gRPC state does not survive fork. The servicer must
+    therefore be created with PEER_SHARD_TRANSFER off, and the parent never
+    loads collections again. Updates are not supported, since workers cannot
+    share write-ahead logs.
+
+    Args:
+        config: Config with settings on how to setup the server
+        servicer: Searcher with collections loaded in this process
+        register: Adds servicers to a worker's server, like
+            ``lambda server: add_SearcherServicer_to_server(servicer, server)``
+        processes: Number of workers, by default one per CPU
+    """
+    if config.WAL_DIRECTORY:
+        raise ValueError("Multi-process Searchers do not support WAL_DIRECTORY")
+    if getattr(servicer, "config", config).PEER_SHARD_TRANSFER:
+        raise ValueError(
+            "Multi-process Searchers must load collections without PEER_SHARD_TRANSFER "
+            "before forking, since peer transfers use gRPC"
+        )
+
+    pool = _SearcherProcesses(
+        config, servicer, register, processes or os.cpu_count() or 1
+    )
+    signal.signal(signal.SIGTERM, pool.stop)
+    signal.signal(signal.SIGINT, pool.stop)
+    pool.run()
+
+
+class _SearcherProcesses(object):
+    """Worker processes of a multi-process Searcher, managed by the parent.
+    Workers write records of their pid and a request or status to one shared
+    pipe, and the parent writes commands to a pipe per worker."""
+
+    def __init__(
+        self,
+        config: BaseConfig,
+        servicer: "SearcherServicer",
+        register: Callable[[_Server], None],
+        processes: int,
+    ):
+        self.config = config
+        self.servicer = servicer
+        self.register = register
+        self.processes = processes
+        self.workers: Dict[int, int] = {}
+        self.requests: List[int] = []
+        self.collections: Optional[bytes] = None
+        self.collection_protos = {
+            name: proto.SerializeToString()
+            for name, proto in getattr(servicer, "collection_protos", {}).items()
+        }
+        self.stopping = False
+        self.records_r, self.records_w = os.pipe()
+
+    def run(self):
+        self.start_workers(self.processes)
+        logger.info(f"Started {self.processes} Searcher processes from {os.getpid()}")
+        while not self.stopping:
+            self.read_records(1.0)
+            if self.requests:
+                self.reload()
+            self.reap_workers()
+
+        for pid in self.workers:
+            os.kill(pid, signal.SIGTERM)
+        for pid in self.workers:
+            os.waitpid(pid, 0)
+        logger.info(f"Stopped Searcher processes from {os.getpid()}")
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def start_workers(self, count: int):
+        """Fork workers, sending them the collections of the last reload"""
+        for _ in range(count):
+            command_r, command_w = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                for fd in [command_w, self.records_r, *self.workers.values()]:
+                    os.close(fd)
+                _serve_worker(
+                    self.config,
+                    self.servicer,
+                    self.register,
+                    self.records_w,
+                    command_r,
+                )
+            os.close(command_r)
+            self.workers[pid] = command_w
+            if self.collections is not None:
+                self.send(pid, _APPLY_COLLECTIONS, self.collections)
+
+    def read_records(self, timeout: float) -> List[Tuple[int, bool]]:
+        """Queue reload requests from workers, returning the pid and success
+        of workers that finished applying collections"""
+        try:
+            ready, _, _ = select.select([self.records_r], [], [], timeout)
+        except InterruptedError:
+            ready = []
+        if not ready:
+            return []
+
+        applied = []
+        content = os.read(self.records_r, 4096)
+        for pid, kind in struct.iter_unpack(_RECORD_FORMAT, content):
+            if kind == _RELOAD_REQUESTED:
+                self.requests.append(pid)
+            else:
+                applied.append((pid, kind == _APPLIED))
+        return applied
+
+    def reload(self):
+        """Have every worker load the local collections in place, then answer
+        each worker that asked for the reload"""
+        requests, self.requests = self.requests, []
+        success = self.apply_collections()
+        for pid in requests:
+            if pid in self.workers:
+                self.send(pid, _RELOAD_RESULT, b"\x01" if success else b"\x00")
+
+    def apply_collections(self) -> bool:
+        """Send the local collections to every worker and wait until each has
+        loaded them. Collections whose definition changed are BOOTING until
+        every worker succeeds."""
+        manager = self.servicer.cluster_manager
+        try:
+            local = manager.list_local_collections(include_state=False)
+            peers = []
+            if self.config.PEER_SHARD_TRANSFER and local:
+                peers = manager.list_collections([proto.name for proto in local])
+        except Exception:
+            logger.exception("Failed to list collections")
+            return False
+
+        protos = {proto.name: proto.SerializeToString() for proto in local}
+        changed = [
+            name
+            for name, proto in protos.items()
+            if self.collection_protos.get(name) != proto
+        ]
+        for name in changed:
+            manager.set_local_state(collections_pb2.Replica.BOOTING, name)
+        self.collection_protos = protos
+        self.collections = _encode_collections(local, peers)
+
+        for pid in list(self.workers):
+            self.send(pid, _APPLY_COLLECTIONS, self.collections)
+        if not self.wait_for_workers(set(self.workers)):
+            logger.error("Failed to reload collections in every Searcher process")
+            return False
+        for name in changed:
+            manager.set_local_state(collections_pb2.Replica.ACTIVE, name)
+        return True
+
+    def wait_for_workers(self, pending: Set[int]) -> bool:
+        """Wait until the pending workers applied collections or exited,
+        returning whether all that applied them succeeded"""
+        success = True
+        while pending and not self.stopping:
+            for pid, applied in self.read_records(1.0):
+                if pid in pending:
+                    pending.discard(pid)
+                    success = success and applied
+            self.reap_workers()
+            pending &= self.workers.keys()
+        return success
+
+    def send(self, pid: int, kind: int, content: bytes):
+        try:
+            _write_all(
+                self.workers[pid],
+                struct.pack(_COMMAND_FORMAT, kind, len(content)) + content,
+            )
+        except OSError as e:
+            logger.error(f"Failed to send a command to Searcher process {pid}: {e}")
+
+    def reap_workers(self):
+        """Wait on exited workers, replacing any that were not stopped"""
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            command_w = self.workers.pop(pid, None)
+            if command_w is not None and not self.stopping:
+                logger.error(f"Searcher process {pid} exited, starting another")
+                os.close(command_w)
+                self.start_workers(1)
+
+
+class _WorkerClusterManager(ClusterManager):
+    """Cluster manager of a worker process, listing the collections the parent
+    last sent. The parent holds the cluster manager session, so it sets
+    replica states and the worker's calls to set them do nothing.
+
+    Attributes:
+        local_collections: Collections with replicas on this Searcher
+        collections: Collections with every replica and state, by name, when
+            peer transfer needs them
+    """
+
+    local_collections: List[collections_pb2.Collection]
+    collections: Dict[str, collections_pb2.Collection]
+
+    def __init__(self):
+        self.local_collections = []
+        self.collections = {}
+
+    def update(self, content: bytes):
+        (length,) = struct.unpack_from("<I", content)
+        end = 4 + length
+        local = collections_pb2.CollectionsListResponse.FromString(content[4:end])
+        peers = collections_pb2.CollectionsListResponse.FromString(content[end:])
+        self.local_collections = list(local.collections)
+        self.collections = {proto.name: proto for proto in peers.collections}
+
+    def register_searcher(self):
+        pass
+
+    def set_local_state(self, state, collection_name=None, shard_name=None):
+        return True
+
+    def list_collections(self, collection_names=None, include_state=True):
+        names = collection_names or list(self.collections)
+        return [self.collections[name] for name in names if name in self.collections]
+
+    def list_local_collections(self, include_state=True):
+        return self.local_collections
+
+
+def _serve_worker(
+    config: BaseConfig,
+    servicer: "SearcherServicer",
+    register: Callable[[_Server], None],
+    records_w: int,
+    command_r: int,
+):
+    """Run a gRPC server in a forked worker until it is sent SIGTERM"""
+    try:
+        results: "queue.Queue[bool]" = queue.Queue()
+
+        def reload_collections() -> bool:
+            os.write(
+                records_w, struct.pack(_RECORD_FORMAT, os.getpid(), _RELOAD_REQUESTED)
+            )
+            return results.get()
+
+        manager = _WorkerClusterManager()
+        servicer.config = config
+        servicer.cluster_manager = manager
+        servicer.reload_collections = reload_collections
+        threading.Thread(
+            target=_run_worker_commands,
+            args=(servicer, manager, results, records_w, command_r),
+            name="commands",
+            daemon=True,
+        ).start()
+
+        server = create_server(config, options=[("grpc.so_reuseport", 1)])
+        register(server)
+        signal.signal(
+            signal.SIGTERM,
+            lambda signum, frame: server.stop(_WORKER_STOP_GRACE_SECONDS),
+        )
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        server.start()
+        logger.info(f"Started gRPC server on {os.getpid()}")
+        server.wait_for_termination()
+    except Exception:
+        logger.exception(f"Searcher process {os.getpid()} failed")
+    finally:
+        os._exit(0)
+
+
+def _run_worker_commands(
+    servicer: "SearcherServicer",
+    manager: _WorkerClusterManager,
+    results: "queue.Queue[bool]",
+    records_w: int,
+    command_r: int,
+):
+    """Carry out the parent's commands in a worker until the parent exits"""
+    header_size = struct.calcsize(_COMMAND_FORMAT)
+    while True:
+        header = _read_exactly(command_r, header_size)
+        if header is None:
+            return
+        kind, length = struct.unpack(_COMMAND_FORMAT, header)
+        content = _read_exactly(command_r, length)
+        if content is None:
+            return
+
+        if kind == _RELOAD_RESULT:
+            results.put(content == b"\x01")
+            continue
+        try:
+            manager.update(content)
+            servicer.load_collections()
+            status = _APPLIED
+        except Exception:
+            logger.exception(f"Searcher process {os.getpid()} failed to reload")
+            status = _APPLY_FAILED
+        os.write(records_w, struct.pack(_RECORD_FORMAT, os.getpid(), status))
+
+
+def _encode_collections(
+    local: List[collections_pb2.Collection], peers: List[collections_pb2.Collection]
+) -> bytes:
+    local_content = collections_pb2.CollectionsListResponse(
+        collections=local
+    ).SerializeToString()
+    peers_content = collections_pb2.CollectionsListResponse(
+        collections=peers
+    ).SerializeToString()
+    return struct.pack("<I", len(local_content)) + local_content + peers_content
+
+
+def _read_exactly(fd: int, size: int) -> Optional[bytes]:
+    """Read size bytes from a pipe, or None if it closes first"""
+    chunks = []
+    while size:
+        chunk = os.read(fd, size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _write_all(fd: int, content: bytes):
+    view = memoryview(content)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
@@ -1,18 +1,35 @@
+import math
+import asyncio
 import logging
 import random
-import heapq
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional
 
 import grpc
+import numpy as np
 
 from needlestack.apis import collections_pb2
+from needlestack.apis.columns import columns_to_items, items_to_columns, merge_columns
+from needlestack.apis import indices_pb2
+from needlestack.apis import serializers
 from needlestack.apis import servicers_pb2
 from needlestack.apis import servicers_pb2_grpc
 from needlestack.balancers import calculate_add
 from needlestack.balancers.greedy import GreedyAlgorithm
 from needlestack.cluster_managers import ClusterManager
+from needlestack.servicers.admission import (
+    AdmissionController,
+    create_admission_controller,
+)
 from needlestack.servicers.settings import BaseConfig
-from needlestack.utilities.rpc import unhandled_exception_rpc
+from needlestack.utilities import metrics
+from needlestack.utilities.bloom import BloomFilter, hash_ids
+from needlestack.utilities.rpc import (
+    unhandled_exception_rpc,
+    create_aio_channel,
+    create_channel,
+    run_blocking,
+)
+from needlestack.utilities.shard_summary import ShardSummary, select_shards
 
 logger = logging.getLogger("needlestack")
 
@@ -20,68 +37,121 @@ logger = logging.getLogger("needlestack")
 class MergerServicer(servicers_pb2_grpc.MergerServicer):
     """A gRPC servicer to accept external requests, use searcher nodes, and
     merge results together.
+
+    Attributes:
+        admission: Optional limit on RPCs served at once, None to admit all
     """
 
+    admission: Optional[AdmissionController]
+
     def __init__(self, config: BaseConfig, cluster_manager: ClusterManager):
         self.config = config
         self.cluster_manager = cluster_manager
+        self.admission = create_admission_controller(config, "merger")
         self.cluster_manager.register_merger()
         self.ssl_channel_credentials = self.config.ssl_channel_credentials
+        self.id_filters: Dict[
+            Tuple[str, str], Tuple[collections_pb2.Shard, Optional[BloomFilter]]
+        ] = {}
+        self.shard_summaries: Dict[
+            Tuple[str, str], Tuple[collections_pb2.Shard, Optional[ShardSummary]]
+        ] = {}
 
     @unhandled_exception_rpc(servicers_pb2.SearchResponse)
     def Search(self, request, context):
+        hostports_shards = self.get_search_hostports(request)
 
-        hostports_shards = self.get_searcher_hostports(
-            request.collection_name, list(request.shard_names)
-        )
+        if self.use_two_phase(request, len(hostports_shards)):
+            return self.two_phase_search(request, hostports_shards)
 
-        futures = []
-        for hostport, shard_names in hostports_shards:
-            stub = self.get_searcher_stub(hostport)
-            subrequest = servicers_pb2.SearchRequest(
-                vector=request.vector,
-                count=request.count,
-                collection_name=request.collection_name,
-                shard_names=shard_names,
-            )
-            future = stub.Search.future(subrequest)
-            futures.append(future)
-
-        subsearch_results = [future.result() for future in futures]
+        subsearch_results = self.search_searchers(request, hostports_shards)
 
-        num_subsearch = len(subsearch_results)
-        if num_subsearch > 1:
-            item_batches = [result.items for result in subsearch_results]
-            merged_item_batches = heapq.merge(
-                *item_batches, key=lambda x: x.float_distance or x.double_distance
-            )
-            items = [
-                item for i, item in enumerate(merged_item_batches) if i < request.count
-            ]
-            return servicers_pb2.SearchResponse(items=items)
-        elif num_subsearch == 1:
-            return subsearch_results[0]
+        if subsearch_results:
+            return merge_search_responses(request, subsearch_results)
         else:
             context.set_code(grpc.StatusCode.UNKNOWN)
             context.set_details("Empty responses from Search")
             return servicers_pb2.SearchResponse()
 
-    @unhandled_exception_rpc(servicers_pb2.RetrieveResponse)
-    def Retrieve(self, request, context):
-        hostports_shards = self.get_searcher_hostports(
-            request.collection_name, list(request.shard_names)
-        )
+    def get_search_hostports(
+        self, request: servicers_pb2.SearchRequest
+    ) -> List[Tuple[str, List[str]]]:
+        """Shards to search on each Searcher, after pruning if enabled. Searches
+        with a filter are never pruned, since summaries count vectors the filter
+        may reject and could rule out the only shards with matches."""
+        shard_names = list(request.shard_names)
+        pruning = self.get_pruning(request)
+        if pruning.enabled and not request.filter.conditions:
+            shard_names = self.prune_shards(
+                request.collection_name,
+                shard_names,
+                serializers.proto_to_ndarray(request.vector),
+                request.count,
+                pruning.epsilon,
+            )
 
-        futures = []
-        for hostport, shard_names in hostports_shards:
-            stub = self.get_searcher_stub(hostport)
-            subrequest = servicers_pb2.RetrieveRequest(
-                id=request.id,
-                collection_name=request.collection_name,
-                shard_names=shard_names,
+        return self.get_searcher_hostports(request.collection_name, shard_names)
+
+    def search_searchers(
+        self,
+        request: servicers_pb2.SearchRequest,
+        hostports_shards: List[Tuple[str, List[str]]],
+        count: Optional[int] = None,
+        offset: int = 0,
+        bound: Optional[float] = None,
+    ) -> List[servicers_pb2.SearchResponse]:
+        """Send a search request to each Searcher for its shards
+
+        Args:
+            request: Search request from the client
+            hostports_shards: Shards to search on each Searcher
+            count: Optionally ask for a different number of items
+            offset: Number of closest items to skip
+            bound: Optional distance bound items must be within
+        """
+        futures = [
+            self.get_searcher_stub(hostport).Search.future(subrequest)
+            for hostport, subrequest in search_subrequests(
+                request, hostports_shards, count, offset, bound
             )
-            future = stub.Retrieve.future(subrequest)
-            futures.append(future)
+        ]
+        return [future.result() for future in futures]
+
+    def use_two_phase(self, request: servicers_pb2.SearchRequest, num_hosts: int):
+        min_count = self.config.MERGER_TWO_PHASE_MIN_COUNT
+        return (
+            min_count is not None
+            and request.count >= min_count
+            and num_hosts > 1
+            and self.first_phase_count(request.count, num_hosts) < request.count
+        )
+
+    def first_phase_count(self, count: int, num_hosts: int) -> int:
+        oversample = self.config.MERGER_TWO_PHASE_OVERSAMPLE
+        return min(count, max(1, math.ceil(oversample * count / num_hosts)))
+
+    def two_phase_search(
+        self,
+        request: servicers_pb2.SearchRequest,
+        hostports_shards: List[Tuple[str, List[str]]],
+    ) -> servicers_pb2.SearchResponse:
+        """Ask each Searcher for a few items, and use the merged k-th item as a
+        bound on the final results. Then ask only Searchers that could still
+        have an item within the bound for the rest of their items within it."""
+        first_count = self.first_phase_count(request.count, len(hostports_shards))
+        first = self.search_searchers(request, hostports_shards, first_count)
+        remaining, bound = second_phase(request, hostports_shards, first, first_count)
+        second = self.search_searchers(
+            request, remaining, request.count, first_count, bound
+        )
+        return merge_search_responses(request, first + second)
+
+    @unhandled_exception_rpc(servicers_pb2.RetrieveResponse)
+    def Retrieve(self, request, context):
+        futures = [
+            self.get_searcher_stub(hostport).Retrieve.future(subrequest)
+            for hostport, subrequest in self.retrieve_subrequests(request)
+        ]
 
         for future in futures:
             result = future.result()
@@ -92,7 +162,132 @@ class MergerServicer(servicers_pb2_grpc.MergerServicer):
         context.set_details("ID not found in collection")
         return servicers_pb2.RetrieveResponse()
 
-    @unhandled_exception_rpc(collections_pb2.CollectionsAddResponse)
+    @unhandled_exception_rpc(servicers_pb2.RetrieveBatchResponse)
+    def RetrieveBatch(self, request, context):
+        futures = [
+            self.get_searcher_stub(hostport).RetrieveBatch.future(subrequest)
+            for hostport, subrequest in self.retrieve_batch_subrequests(request)
+        ]
+        return merge_retrieve_batch_responses(
+            request, [future.result() for future in futures]
+        )
+
+    @unhandled_exception_rpc(servicers_pb2.UpsertResponse)
+    def Upsert(self, request, context):
+        hostports = self.get_upsert_hostports(request)
+        if not hostports:
+            context.set_code(grpc.StatusCode.UNAVAILABLE)
+            context.set_details(
+                f"No active Searcher for {request.collection_name}/{request.shard_name}"
+            )
+            return servicers_pb2.UpsertResponse()
+
+        futures = [
+            self.get_searcher_stub(hostport).Upsert.future(request)
+            for hostport in hostports
+        ]
+        results = [future.exception() or future.result() for future in futures]
+        return merge_upsert_results(request, hostports, results, context)
+
+    @unhandled_exception_rpc(servicers_pb2.DeleteResponse)
+    def Delete(self, request, context):
+        subrequests = self.delete_subrequests(request)
+        shard_futures = [
+            [
+                self.get_searcher_stub(hostport).Delete.future(subrequest)
+                for hostport in hostports
+            ]
+            for hostports, subrequest in subrequests
+        ]
+        shard_results = [
+            [future.exception() or future.result() for future in futures]
+            for futures in shard_futures
+        ]
+        return merge_delete_results(request, subrequests, shard_results, context)
+
+    def retrieve_subrequests(
+        self, request: servicers_pb2.RetrieveRequest
+    ) -> List[Tuple[str, servicers_pb2.RetrieveRequest]]:
+        """Retrieve request for each Searcher with a shard that may hold the id"""
+        shard_ids = self.get_shards_for_ids(
+            request.collection_name, list(request.shard_names), [request.id]
+        )
+        hostports_shards = (
+            self.get_searcher_hostports(request.collection_name, list(shard_ids))
+            if shard_ids
+            else []
+        )
+        return [
+            (
+                hostport,
+                servicers_pb2.RetrieveRequest(
+                    id=request.id,
+                    collection_name=request.collection_name,
+                    shard_names=shard_names,
+                ),
+            )
+            for hostport, shard_names in hostports_shards
+        ]
+
+    def retrieve_batch_subrequests(
+        self, request: servicers_pb2.RetrieveBatchRequest
+    ) -> List[Tuple[str, servicers_pb2.RetrieveBatchRequest]]:
+        """Retrieve request for each Searcher, for only the ids its shards may
+        hold"""
+        shard_ids = self.get_shards_for_ids(
+            request.collection_name, list(request.shard_names), list(request.ids)
+        )
+        hostports_shards = (
+            self.get_searcher_hostports(request.collection_name, list(shard_ids))
+            if shard_ids
+            else []
+        )
+
+        subrequests = []
+        for hostport, shard_names in hostports_shards:
+            host_ids = set().union(*(shard_ids[name] for name in shard_names))
+            subrequest = servicers_pb2.RetrieveBatchRequest(
+                ids=[id for id in request.ids if id in host_ids],
+                collection_name=request.collection_name,
+                shard_names=shard_names,
+            )
+            subrequests.append((hostport, subrequest))
+        return subrequests
+
+    def get_upsert_hostports(self, request: servicers_pb2.UpsertRequest) -> List[str]:
+        """Every Searcher with a replica of the upserted shard"""
+        shard_hostports = self.cluster_manager.get_searchers(
+            request.collection_name, [request.shard_name]
+        )
+        return [hostport for _, hostports in shard_hostports for hostport in hostports]
+
+    def delete_subrequests(
+        self, request: servicers_pb2.DeleteRequest
+    ) -> List[Tuple[List[str], servicers_pb2.DeleteRequest]]:
+        """Delete request for each shard, with the Searchers of its active
+        replicas. Shards without an active replica have no Searchers."""
+        shard_names = list(request.shard_names) or [
+            shard.name
+            for shard in self.cluster_manager.get_shards(request.collection_name)
+        ]
+        shard_hostports = dict(
+            self.cluster_manager.get_searchers(request.collection_name, shard_names)
+        )
+        return [
+            (
+                shard_hostports.get(shard_name, []),
+                servicers_pb2.DeleteRequest(
+                    ids=request.ids,
+                    collection_name=request.collection_name,
+                    shard_names=[shard_name],
+                ),
+            )
+            for shard_name in shard_names
+        ]
+
+    @unhandled_exception_rpc(
+        collections_pb2.CollectionsAddResponse, servicers_pb2.SearchRequest.HIGH
+    )
     def CollectionsAdd(self, request, context):
         new_collections = request.collections
         current_collections = self.cluster_manager.list_collections()
@@ -121,7 +316,9 @@ class MergerServicer(servicers_pb2_grpc.MergerServicer):
             collections=collections_to_add, success=success
         )
 
-    @unhandled_exception_rpc(collections_pb2.CollectionsDeleteResponse)
+    @unhandled_exception_rpc(
+        collections_pb2.CollectionsDeleteResponse, servicers_pb2.SearchRequest.HIGH
+    )
     def CollectionsDelete(self, request, context):
         collection_names = request.names
         success = True
@@ -145,17 +342,27 @@ class MergerServicer(servicers_pb2_grpc.MergerServicer):
             names=collection_names, success=success
         )
 
-    @unhandled_exception_rpc(collections_pb2.CollectionsLoadResponse)
+    @unhandled_exception_rpc(
+        collections_pb2.CollectionsLoadResponse, servicers_pb2.SearchRequest.HIGH
+    )
     def CollectionsLoad(self, request, context):
         success = self.collections_load()
         return collections_pb2.CollectionsLoadResponse(success=success)
 
-    @unhandled_exception_rpc(collections_pb2.CollectionsListResponse)
+    @unhandled_exception_rpc(
+        collections_pb2.CollectionsListResponse, servicers_pb2.SearchRequest.HIGH
+    )
     def CollectionsList(self, request, context):
         collection_names = list(request.names)
         collections = self.cluster_manager.list_collections(collection_names)
         return collections_pb2.CollectionsListResponse(collections=collections)
 
+    @unhandled_exception_rpc(
+        servicers_pb2.MetricsResponse, servicers_pb2.SearchRequest.HIGH
+    )
+    def Metrics(self, request, context):
+        return metrics.registry.to_proto()
+
     def collections_load(self) -> bool:
         success = True
         futures = []
@@ -194,10 +401,478 @@ class MergerServicer(servicers_pb2_grpc.MergerServicer):
 
         return list(host_to_shards.items())
 
+    def get_shards_for_ids(
+        self, collection_name: str, shard_names: List[str], ids: List[str]
+    ) -> Dict[str, List[str]]:
+        """Map each shard to the ids it may contain according to its id filter.
+        Shards without an id filter may contain any id, and shards that cannot
+        contain any of the ids are left out. Filters are ignored for collections
+        that accept updates, since upserts add ids the filters do not cover.
+        """
+        collection = self.cluster_manager.get_collection(collection_name)
+        use_filters = collection is None or not collection.enable_updates
+        hashes = hash_ids(ids)
+        shard_ids = {}
+        for shard in self.cluster_manager.get_shards(collection_name, shard_names):
+            id_filter = (
+                self.get_id_filter(collection_name, shard) if use_filters else None
+            )
+            if id_filter is None:
+                candidates = list(ids)
+            else:
+                found = id_filter.might_contain_hashes(hashes)
+                candidates = [id for id, f in zip(ids, found) if f]
+            if candidates:
+                shard_ids[shard.name] = candidates
+        return shard_ids
+
+    def get_id_filter(
+        self, collection_name: str, shard: collections_pb2.Shard
+    ) -> Optional[BloomFilter]:
+        """Get the parsed id filter for a shard. Filters are cached until the
+        cluster manager returns a new definition for the shard."""
+        if not shard.HasField("id_filter"):
+            return None
+
+        key = (collection_name, shard.name)
+        cached = self.id_filters.get(key)
+        if cached is None or cached[0] is not shard:
+            try:
+                id_filter = BloomFilter.from_proto(shard.id_filter)
+            except Exception:
+                logger.exception(
+                    f"Failed to read id filter for {collection_name}/{shard.name}"
+                )
+                id_filter = None
+            cached = (shard, id_filter)
+            self.id_filters[key] = cached
+        return cached[1]
+
+    def get_pruning(
+        self, request: servicers_pb2.SearchRequest
+    ) -> servicers_pb2.ShardPruning:
+        if request.HasField("pruning"):
+            return request.pruning
+        return servicers_pb2.ShardPruning(
+            enabled=self.config.MERGER_SHARD_PRUNING,
+            epsilon=self.config.MERGER_PRUNING_EPSILON,
+        )
+
+    def prune_shards(
+        self,
+        collection_name: str,
+        shard_names: List[str],
+        X: np.ndarray,
+        k: int,
+        epsilon: float = 0.0,
+    ) -> List[str]:
+        """Names of the shards that could hold a top-k result according to their
+        summaries. Summaries are ignored for collections that accept updates,
+        since upserts add vectors the summaries do not cover."""
+        collection = self.cluster_manager.get_collection(collection_name)
+        if collection is not None and collection.enable_updates:
+            return shard_names
+
+        X = X.reshape(1, -1) if X.ndim == 1 else X
+        summaries = {}
+        for shard in self.cluster_manager.get_shards(collection_name, shard_names):
+            summary = self.get_shard_summary(collection_name, shard)
+            if summary is not None and summary.centroids.shape[1] != X.shape[1]:
+                return shard_names
+            summaries[shard.name] = summary
+
+        selected = select_shards(summaries, X, k, epsilon)
+        metrics.registry.increment(
+            "merger_shards_pruned_total",
+            len(summaries) - len(selected),
+            collection=collection_name,
+        )
+        return selected
+
+    def get_shard_summary(
+        self, collection_name: str, shard: collections_pb2.Shard
+    ) -> Optional[ShardSummary]:
+        """Get the parsed summary for a shard, cached like id filters"""
+        if not shard.HasField("summary"):
+            return None
+
+        key = (collection_name, shard.name)
+        cached = self.shard_summaries.get(key)
+        if cached is None or cached[0] is not shard:
+            cached = (shard, ShardSummary.from_proto(shard.summary))
+            self.shard_summaries[key] = cached
+        return cached[1]
+
     def get_searcher_stub(self, hostport: str) -> servicers_pb2_grpc.SearcherStub:
-        if self.config.use_channel_ssl:
-            channel = grpc.secure_channel(hostport, self.ssl_channel_credentials)
+        channel = create_channel(hostport, self.ssl_channel_credentials)
+        return servicers_pb2_grpc.SearcherStub(channel)
+
+
+class AioMergerServicer(MergerServicer):
+    """A MergerServicer for grpc.aio servers. Searchers are called with native
+    async stubs, so requests waiting on Searchers hold no threads. Collection
+    management RPCs block on the cluster manager and run on the event loop's
+    default executor.
+    """
+
+    def __init__(self, config: BaseConfig, cluster_manager: ClusterManager):
+        super().__init__(config, cluster_manager)
+        self.aio_channels: Dict[str, grpc.aio.Channel] = {}
+
+    @unhandled_exception_rpc(servicers_pb2.SearchResponse)
+    async def Search(self, request, context):
+        hostports_shards = self.get_search_hostports(request)
+
+        if self.use_two_phase(request, len(hostports_shards)):
+            first_count = self.first_phase_count(request.count, len(hostports_shards))
+            first = await self.search_searchers_async(
+                request, hostports_shards, first_count
+            )
+            remaining, bound = second_phase(
+                request, hostports_shards, first, first_count
+            )
+            second = await self.search_searchers_async(
+                request, remaining, request.count, first_count, bound
+            )
+            return merge_search_responses(request, first + second)
+
+        subsearch_results = await self.search_searchers_async(request, hostports_shards)
+
+        if subsearch_results:
+            return merge_search_responses(request, subsearch_results)
         else:
-            channel = grpc.insecure_channel(hostport)
+            context.set_code(grpc.StatusCode.UNKNOWN)
+            context.set_details("Empty responses from Search")
+            return servicers_pb2.SearchResponse()
+
+    async def search_searchers_async(
+        self,
+        request: servicers_pb2.SearchRequest,
+        hostports_shards: List[Tuple[str, List[str]]],
+        count: Optional[int] = None,
+        offset: int = 0,
+        bound: Optional[float] = None,
+    ) -> List[servicers_pb2.SearchResponse]:
+        """Async version of search_searchers"""
+        return await asyncio.gather(
+            *(
+                self.get_searcher_aio_stub(hostport).Search(subrequest)
+                for hostport, subrequest in search_subrequests(
+                    request, hostports_shards, count, offset, bound
+                )
+            )
+        )
 
+    @unhandled_exception_rpc(servicers_pb2.RetrieveResponse)
+    async def Retrieve(self, request, context):
+        results = await asyncio.gather(
+            *(
+                self.get_searcher_aio_stub(hostport).Retrieve(subrequest)
+                for hostport, subrequest in self.retrieve_subrequests(request)
+            )
+        )
+
+        for result in results:
+            if result.item.metadata.id:
+                return result
+
+        context.set_code(grpc.StatusCode.NOT_FOUND)
+        context.set_details("ID not found in collection")
+        return servicers_pb2.RetrieveResponse()
+
+    @unhandled_exception_rpc(servicers_pb2.RetrieveBatchResponse)
+    async def RetrieveBatch(self, request, context):
+        results = await asyncio.gather(
+            *(
+                self.get_searcher_aio_stub(hostport).RetrieveBatch(subrequest)
+                for hostport, subrequest in self.retrieve_batch_subrequests(request)
+            )
+        )
+        return merge_retrieve_batch_responses(request, results)
+
+    @unhandled_exception_rpc(servicers_pb2.UpsertResponse)
+    async def Upsert(self, request, context):
+        hostports = self.get_upsert_hostports(request)
+        if not hostports:
+            context.set_code(grpc.StatusCode.UNAVAILABLE)
+            context.set_details(
+                f"No active Searcher for {request.collection_name}/{request.shard_name}"
+            )
+            return servicers_pb2.UpsertResponse()
+
+        results = await asyncio.gather(
+            *(
+                self.get_searcher_aio_stub(hostport).Upsert(request)
+                for hostport in hostports
+            ),
+            return_exceptions=True,
+        )
+        return merge_upsert_results(request, hostports, results, context)
+
+    @unhandled_exception_rpc(servicers_pb2.DeleteResponse)
+    async def Delete(self, request, context):
+        subrequests = self.delete_subrequests(request)
+        results = await asyncio.gather(
+            *(
+                self.get_searcher_aio_stub(hostport).Delete(subrequest)
+                for hostports, subrequest in subrequests
+                for hostport in hostports
+            ),
+            return_exceptions=True,
+        )
+
+        results = iter(results)
+        shard_results = [
+            [next(results) for _ in hostports] for hostports, _ in subrequests
+        ]
+        return merge_delete_results(request, subrequests, shard_results, context)
+
+    @unhandled_exception_rpc(
+        collections_pb2.CollectionsAddResponse, servicers_pb2.SearchRequest.HIGH
+    )
+    async def CollectionsAdd(self, request, context):
+        return await self._run_blocking(super().CollectionsAdd, request, context)
+
+    @unhandled_exception_rpc(
+        collections_pb2.CollectionsDeleteResponse, servicers_pb2.SearchRequest.HIGH
+    )
+    async def CollectionsDelete(self, request, context):
+        return await self._run_blocking(super().CollectionsDelete, request, context)
+
+    @unhandled_exception_rpc(
+        collections_pb2.CollectionsLoadResponse, servicers_pb2.SearchRequest.HIGH
+    )
+    async def CollectionsLoad(self, request, context):
+        return await self._run_blocking(super().CollectionsLoad, request, context)
+
+    @unhandled_exception_rpc(
+        collections_pb2.CollectionsListResponse, servicers_pb2.SearchRequest.HIGH
+    )
+    async def CollectionsList(self, request, context):
+        return await self._run_blocking(super().CollectionsList, request, context)
+
+    @unhandled_exception_rpc(
+        servicers_pb2.MetricsResponse, servicers_pb2.SearchRequest.HIGH
+    )
+    async def Metrics(self, request, context):
+        return metrics.registry.to_proto()
+
+    def get_searcher_aio_stub(self, hostport: str) -> servicers_pb2_grpc.SearcherStub:
+        """Stub on a channel to the Searcher that is reused across requests"""
+        channel = self.aio_channels.get(hostport)
+        if channel is None:
+            channel = create_aio_channel(hostport, self.ssl_channel_credentials)
+            self.aio_channels[hostport] = channel
         return servicers_pb2_grpc.SearcherStub(channel)
+
+    async def close(self):
+        """Close channels to Searchers"""
+        channels, self.aio_channels = list(self.aio_channels.values()), {}
+        await asyncio.gather(*(channel.close() for channel in channels))
+
+    async def _run_blocking(self, method, request, context):
+        return await run_blocking(None, method, request, context)
+
+
+def search_subrequests(
+    request: servicers_pb2.SearchRequest,
+    hostports_shards: List[Tuple[str, List[str]]],
+    count: Optional[int] = None,
+    offset: int = 0,
+    bound: Optional[float] = None,
+) -> List[Tuple[str, servicers_pb2.SearchRequest]]:
+    """Search request for each Searcher. Results are always requested in
+    columns, whatever shape the client asked for."""
+    subrequests = []
+    for hostport, shard_names in hostports_shards:
+        subrequest = servicers_pb2.SearchRequest()
+        subrequest.CopyFrom(request)
+        subrequest.shard_names[:] = shard_names
+        subrequest.columnar = True
+        if count is not None:
+            subrequest.count = count
+        subrequest.offset = offset
+        if bound is not None:
+            subrequest.bound.distance = bound
+        subrequests.append((hostport, subrequest))
+    return subrequests
+
+
+def second_phase(
+    request: servicers_pb2.SearchRequest,
+    hostports_shards: List[Tuple[str, List[str]]],
+    first: List[servicers_pb2.SearchResponse],
+    first_count: int,
+) -> Tuple[List[Tuple[str, List[str]]], Optional[float]]:
+    """Searchers to ask for more items after the first phase of a two-phase
+    search, and the bound on the distance of those items
+
+    Args:
+        request: Search request from the client
+        hostports_shards: Shards searched on each Searcher
+        first: Response of each Searcher to the first phase
+        first_count: Items asked of each Searcher in the first phase
+    """
+    descending = any(result.descending for result in first)
+    first_columns = [response_columns(result) for result in first]
+    merged = merge_columns(first_columns, request.count, descending)
+
+    bound = None
+    if len(merged.ids) == request.count:
+        bound = float(serializers.proto_to_ndarray(merged.distances)[-1])
+
+    remaining = []
+    for hostport_shards, columns in zip(hostports_shards, first_columns):
+        if len(columns.ids) < first_count:
+            continue
+        last = serializers.proto_to_ndarray(columns.distances)[-1]
+        if bound is None or (last > bound if descending else last < bound):
+            remaining.append(hostport_shards)
+    return remaining, bound
+
+
+def merge_search_responses(
+    request: servicers_pb2.SearchRequest,
+    responses: List[servicers_pb2.SearchResponse],
+) -> servicers_pb2.SearchResponse:
+    """Merge the responses of Searchers into the closest items, in the shape
+    the client asked for"""
+    descending = any(response.descending for response in responses)
+    merged = merge_columns(
+        [response_columns(response) for response in responses],
+        request.count,
+        descending,
+    )
+    return search_response(request, merged, descending)
+
+
+def merge_retrieve_batch_responses(
+    request: servicers_pb2.RetrieveBatchRequest,
+    responses: List[servicers_pb2.RetrieveBatchResponse],
+) -> servicers_pb2.RetrieveBatchResponse:
+    """Merge the vectors and metadata Searchers found, in the order of the
+    requested ids"""
+    matrices, metadatas = [], []
+    for result in responses:
+        if result.metadatas:
+            matrices.append(serializers.proto_to_ndarray(result.vectors))
+            metadatas.extend(result.metadatas)
+
+    if not metadatas:
+        return servicers_pb2.RetrieveBatchResponse()
+
+    X = np.vstack(matrices)
+    rows: Dict[str, int] = {}
+    for i, metadata in enumerate(metadatas):
+        rows.setdefault(metadata.id, i)
+    order = [rows[id] for id in dict.fromkeys(request.ids) if id in rows]
+    return servicers_pb2.RetrieveBatchResponse(
+        vectors=serializers.ndarray_to_proto(X[order]),
+        metadatas=[metadatas[i] for i in order],
+    )
+
+
+def merge_upsert_results(
+    request: servicers_pb2.UpsertRequest,
+    hostports: List[str],
+    results: List,
+    context,
+) -> servicers_pb2.UpsertResponse:
+    """Count of the replicas that applied an upsert. When any replica failed,
+    the RPC fails with its status and names every failed replica, since the
+    shard's replicas differ until the upsert is retried.
+
+    Args:
+        request: Upsert sent to every replica
+        hostports: Searcher of each replica
+        results: Response or RPC error of each replica
+        context: Context of the Merger's RPC
+    """
+    responses = [r for r in results if isinstance(r, servicers_pb2.UpsertResponse)]
+    failed = replica_failures(hostports, results)
+    if failed:
+        context.set_code(failed[0][1].code())
+        context.set_details(
+            f"Upsert to {request.collection_name}/{request.shard_name} applied by "
+            f"{len(responses)} of {len(hostports)} replicas, failed on "
+            + ", ".join(f"{hostport} ({error.details()})" for hostport, error in failed)
+        )
+    return servicers_pb2.UpsertResponse(
+        count=max((r.count for r in responses), default=0), replicas=len(responses)
+    )
+
+
+def merge_delete_results(
+    request: servicers_pb2.DeleteRequest,
+    subrequests: List[Tuple[List[str], servicers_pb2.DeleteRequest]],
+    shard_results: List[List],
+    context,
+) -> servicers_pb2.DeleteResponse:
+    """Count of the items deleted from each shard by the replica that deleted
+    the most. Like upserts, when any replica failed or a shard has no active
+    replica the RPC fails and names them, since the delete must be retried.
+
+    Args:
+        request: Delete sent to the Merger
+        subrequests: Searchers of each shard and the delete sent to them
+        shard_results: Response or RPC error of each replica of each shard
+        context: Context of the Merger's RPC
+    """
+    count, unavailable, code, failures = 0, 0, None, []
+    for (hostports, subrequest), results in zip(subrequests, shard_results):
+        shard_name = subrequest.shard_names[0]
+        responses = [r for r in results if isinstance(r, servicers_pb2.DeleteResponse)]
+        count += max((r.count for r in responses), default=0)
+        unavailable += not responses
+        if not hostports:
+            code = code or grpc.StatusCode.UNAVAILABLE
+            failures.append(f"{shard_name} (no active Searcher)")
+        for hostport, error in replica_failures(hostports, results):
+            code = code or error.code()
+            failures.append(f"{shard_name} on {hostport} ({error.details()})")
+
+    if failures:
+        context.set_code(code)
+        context.set_details(
+            f"Delete from {request.collection_name} failed for " + ", ".join(failures)
+        )
+    return servicers_pb2.DeleteResponse(count=count, unavailable_shards=unavailable)
+
+
+def replica_failures(
+    hostports: List[str], results: List
+) -> List[Tuple[str, grpc.RpcError]]:
+    """Searcher and RPC error of each replica that failed. Errors other than
+    RPC errors are raised."""
+    failed = [
+        (hostport, error)
+        for hostport, error in zip(hostports, results)
+        if isinstance(error, Exception)
+    ]
+    for _, error in failed:
+        if not isinstance(error, grpc.RpcError):
+            raise error
+    return failed
+
+
+def response_columns(
+    response: servicers_pb2.SearchResponse,
+) -> indices_pb2.SearchResultColumns:
+    """Search results of a Searcher in columns, packing the items of Searchers
+    that predate columnar responses"""
+    if response.HasField("columns"):
+        return response.columns
+    return items_to_columns(response.items)
+
+
+def search_response(
+    request: servicers_pb2.SearchRequest,
+    columns: indices_pb2.SearchResultColumns,
+    descending: bool,
+) -> servicers_pb2.SearchResponse:
+    """Search response in the shape the client asked for"""
+    if request.columnar:
+        return servicers_pb2.SearchResponse(columns=columns, descending=descending)
+    return servicers_pb2.SearchResponse(
+        items=columns_to_items(columns), descending=descending
+    )
@@ -1,49 +1,121 @@
 import logging
-from typing import Dict
+import functools
+import itertools
+import threading
+import tempfile
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 import grpc
+import numpy as np
 
 from needlestack.apis import collections_pb2
+from needlestack.apis import indices_pb2
 from needlestack.apis import servicers_pb2
 from needlestack.apis import servicers_pb2_grpc
+from needlestack.apis.columns import metadatas_to_columns
 from needlestack.apis import serializers
+from needlestack.apis import wire
 from needlestack.collections.collection import Collection
+from needlestack.collections.loader import ShardLoader
 from needlestack.collections.shard import Shard
 from needlestack.cluster_managers import ClusterManager
+from needlestack.data_sources.peer import PeerDataSource
+from needlestack.indices.index import SearchResult
+from needlestack.servicers.admission import (
+    AdmissionController,
+    create_admission_controller,
+)
+from needlestack.servicers.batching import SearchBatcher
+from needlestack.servicers.cache import ResultCache
+from needlestack.servicers.executors import CollectionExecutors
 from needlestack.servicers.settings import BaseConfig
-from needlestack.utilities.rpc import unhandled_exception_rpc
+from needlestack.servicers.tuning import SearchTuner
+from needlestack.utilities import metrics
+from needlestack.utilities.rpc import run_blocking, unhandled_exception_rpc
 
 
 logger = logging.getLogger("needlestack")
 
 
 class SearcherServicer(servicers_pb2_grpc.SearcherServicer):
-    """A gRPC servicer to perform kNN queries on in-memory index structures"""
+    """A gRPC servicer to perform kNN queries on in-memory index structures
+
+    Attributes:
+        admission: Optional limit on RPCs served at once, None to admit all
+        executors: Threads searching collections that have a search_executor
+        cache: Optional cache of encoded search responses
+        shard_versions: Index and modified time of each loaded shard, to find
+            the shards whose cached results are stale
+        reload_collections: Optional function CollectionsLoad calls instead of
+            loading collections, set in processes forked to serve a Searcher
+    """
 
     collections: Dict[str, Collection]
     collection_protos: Dict[str, collections_pb2.Collection]
+    tuners: Dict[str, SearchTuner]
+    batcher: Optional[SearchBatcher]
+    admission: Optional[AdmissionController]
+    executors: CollectionExecutors
+    cache: Optional[ResultCache]
+    shard_versions: Dict[Tuple[str, str], Tuple[weakref.ref, Optional[float]]]
+    reload_collections: Optional[Callable[[], bool]] = None
 
     def __init__(self, config: BaseConfig, cluster_manager: ClusterManager):
         self.config = config
         self.cluster_manager = cluster_manager
         self.collections = {}
         self.collection_protos = {}
+        self.tuners = {}
+        self._searches_in_flight = 0
+        self._searches_lock = threading.Lock()
+        self.batcher = None
+        if config.SEARCH_BATCH_WINDOW is not None:
+            self.batcher = SearchBatcher(
+                config.SEARCH_BATCH_WINDOW, config.SEARCH_BATCH_MAX_SIZE
+            )
+        self.admission = create_admission_controller(config, "searcher")
+        self.executors = CollectionExecutors(
+            config.SEARCH_EXECUTOR_THREADS or config.MAX_WORKERS
+        )
+        self.cache = None
+        if config.SEARCH_CACHE_BYTES is not None:
+            self.cache = ResultCache(config.SEARCH_CACHE_BYTES)
+        self.shard_versions = {}
+        self.shard_loader = ShardLoader(
+            config.LOADER_IO_WORKERS,
+            config.LOADER_CPU_WORKERS,
+            config.LOADER_MEMORY_BUDGET,
+        )
         self.cluster_manager.register_searcher()
         self.load_collections()
 
+        self._stop_compaction = threading.Event()
+        if config.WAL_DIRECTORY:
+            threading.Thread(
+                target=self._compaction_loop, name="compaction", daemon=True
+            ).start()
+
     @unhandled_exception_rpc(servicers_pb2.SearchResponse)
     def Search(self, request, context):
         X = serializers.proto_to_ndarray(request.vector)
-        k = request.count
         collection = self.get_collection(request.collection_name)
 
         if len(X.shape) == 1:
             X = X.reshape(1, -1)
 
+        metadata_filter = request.filter if request.HasField("filter") else None
+        if metadata_filter is not None and not collection.enable_metadata_index:
+            context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+            context.set_details(
+                f"Collection {collection.name} does not have enable_metadata_index"
+            )
+            return servicers_pb2.SearchResponse()
+
         if collection.dimension == X.shape[1]:
-            results = collection.query(X, k, request.shard_names)
-            items = [item for i, item in enumerate(results) if i < k]
-            return servicers_pb2.SearchResponse(items=items)
+            return self._search(collection, request, X)
         else:
             context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
             context.set_details(
@@ -51,6 +123,152 @@ class SearcherServicer(servicers_pb2_grpc.SearcherServicer):
             )
             return servicers_pb2.SearchResponse()
 
+    def _search(
+        self,
+        collection: Collection,
+        request: servicers_pb2.SearchRequest,
+        X: np.ndarray,
+    ) -> Union[servicers_pb2.SearchResponse, bytes]:
+        """Search a collection for the first row of X, returning an encoded
+        response when SEARCH_ENCODED_RESPONSES allows or the cache is on.
+        Cached responses are keyed by the search parameters in effect, so a
+        response is not reused once the tuner moves to other parameters."""
+        with self._search_params(collection.name, request) as params:
+            if self.cache is None:
+                return self._search_index(collection, request, X, params)
+
+            shard_names = sorted(request.shard_names or collection.shards.keys())
+            key = _cache_key(request, shard_names, params)
+            response = self.cache.get(key)
+            if response is None:
+                shards = [(collection.name, name) for name in shard_names]
+                generation = self.cache.generation(shards)
+                response = self._search_index(collection, request, X, params)
+                if not isinstance(response, bytes):
+                    response = response.SerializeToString()
+                self.cache.put(key, response, shards, generation)
+            return response
+
+    def _search_index(
+        self,
+        collection: Collection,
+        request: servicers_pb2.SearchRequest,
+        X: np.ndarray,
+        params: Optional[indices_pb2.SearchParams],
+    ) -> Union[servicers_pb2.SearchResponse, bytes]:
+        encoded = self.config.SEARCH_ENCODED_RESPONSES and not request.columnar
+        with self._track_latency(collection.name):
+            search = functools.partial(
+                self._search_rows, collection, request, params, encoded
+            )
+            executor = self.executors.get(collection.name)
+            if executor is not None:
+                search = functools.partial(executor.run, search)
+            if self.batcher is not None and len(X) == 1:
+                key = (
+                    collection.name,
+                    _search_options(request),
+                    params.SerializeToString() if params is not None else None,
+                )
+                items = self.batcher.submit(key, X, search)
+            else:
+                items = search(X)[0]
+        if encoded:
+            return wire.encode_search_response(
+                (item for _, item in items), collection.inner_product
+            )
+        if request.columnar:
+            return servicers_pb2.SearchResponse(
+                columns=_results_to_columns(items),
+                descending=collection.inner_product,
+            )
+        return servicers_pb2.SearchResponse(
+            items=items, descending=collection.inner_product
+        )
+
+    def _search_rows(
+        self,
+        collection: Collection,
+        request: servicers_pb2.SearchRequest,
+        params: Optional[indices_pb2.SearchParams],
+        encoded: bool,
+        X: np.ndarray,
+    ) -> List[List[SearchResult]]:
+        """Search for each row of X with the options of a request"""
+        if self.batcher is not None:
+            metrics.registry.increment(
+                "search_batches_total", collection=collection.name
+            )
+            metrics.registry.increment(
+                "search_batched_queries_total", len(X), collection=collection.name
+            )
+        k = request.count
+        results = collection.query_batch(
+            X,
+            k,
+            request.shard_names,
+            request.filter if request.HasField("filter") else None,
+            params,
+            request.bound.distance if request.HasField("bound") else None,
+            request.projection if request.HasField("projection") else None,
+            encoded,
+            request.columnar,
+        )
+        return [list(itertools.islice(r, request.offset, k)) for r in results]
+
+    @contextmanager
+    def _search_params(
+        self, collection_name: str, request: servicers_pb2.SearchRequest
+    ) -> Iterator[Optional[indices_pb2.SearchParams]]:
+        """Search parameters from the request, with any it leaves unset chosen
+        by the collection's tuner when SEARCH_LATENCY_TARGET is set"""
+        params = request.params if request.HasField("params") else None
+        tuner = self._get_tuner(collection_name)
+        if tuner is None:
+            yield params
+            return
+
+        overload = self.config.SEARCH_OVERLOAD_IN_FLIGHT or max(
+            self.config.MAX_WORKERS, 2
+        )
+        with self._searches_lock:
+            self._searches_in_flight += 1
+            overloaded = self._searches_in_flight >= overload
+        try:
+            tuned = tuner.choose(overloaded)
+            if params is not None:
+                tuned.MergeFrom(params)
+            yield tuned
+        finally:
+            with self._searches_lock:
+                self._searches_in_flight -= 1
+
+    @contextmanager
+    def _track_latency(self, collection_name: str) -> Iterator[None]:
+        """Report how long a search of the index took to the collection's
+        tuner, leaving out responses served from the cache"""
+        tuner = self._get_tuner(collection_name)
+        if tuner is None:
+            yield
+            return
+        with tuner.timed():
+            yield
+
+    def _get_tuner(self, collection_name: str) -> Optional[SearchTuner]:
+        if self.config.SEARCH_LATENCY_TARGET is None:
+            return None
+        tuner = self.tuners.get(collection_name)
+        if tuner is None:
+            tuner = SearchTuner(
+                collection_name,
+                self.config.SEARCH_LATENCY_TARGET,
+                self.config.SEARCH_NPROBE_RANGE,
+                self.config.SEARCH_EF_SEARCH_RANGE,
+                self.config.SEARCH_TUNING_WINDOW,
+            )
+            self.tuners[collection_name] = tuner
+        return tuner
+
     @unhandled_exception_rpc(servicers_pb2.RetrieveResponse)
     def Retrieve(self, request, context):
         collection = self.get_collection(request.collection_name)
@@ -60,11 +278,121 @@ class SearcherServicer(servicers_pb2_grpc.SearcherServicer):
         else:
             return servicers_pb2.RetrieveResponse()
 
-    @unhandled_exception_rpc(collections_pb2.CollectionsLoadResponse)
+    @unhandled_exception_rpc(servicers_pb2.RetrieveBatchResponse)
+    def RetrieveBatch(self, request, context):
+        collection = self.get_collection(request.collection_name)
+        X, metadatas = collection.retrieve_batch(
+            list(request.ids), request.shard_names
+        )
+        if metadatas:
+            return servicers_pb2.RetrieveBatchResponse(
+                vectors=serializers.ndarray_to_proto(X), metadatas=metadatas
+            )
+        else:
+            return servicers_pb2.RetrieveBatchResponse()
+
+    @unhandled_exception_rpc(servicers_pb2.UpsertResponse)
+    def Upsert(self, request, context):
+        collection = self.get_collection(request.collection_name)
+        if not self._check_updates_enabled(collection, [request.shard_name], context):
+            return servicers_pb2.UpsertResponse()
+
+        X = serializers.proto_to_ndarray(request.vectors)
+        count = collection.upsert(request.shard_name, X, list(request.metadatas))
+        if self.cache is not None:
+            self.cache.invalidate(collection.name, request.shard_name)
+        return servicers_pb2.UpsertResponse(count=count)
+
+    @unhandled_exception_rpc(servicers_pb2.DeleteResponse)
+    def Delete(self, request, context):
+        collection = self.get_collection(request.collection_name)
+        shard_names = list(request.shard_names) or list(collection.shards.keys())
+        if not self._check_updates_enabled(collection, shard_names, context):
+            return servicers_pb2.DeleteResponse()
+
+        count = collection.delete(list(request.ids), shard_names)
+        if self.cache is not None:
+            for name in shard_names:
+                self.cache.invalidate(collection.name, name)
+        return servicers_pb2.DeleteResponse(count=count)
+
+    def _check_updates_enabled(
+        self, collection: Collection, shard_names, context
+    ) -> bool:
+        if not collection.enable_updates or not self.config.WAL_DIRECTORY:
+            context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+            context.set_details(
+                f"Collection {collection.name} does not accept updates on {self.config.hostport}"
+            )
+            return False
+        missing = [name for name in shard_names if name not in collection.shards]
+        if missing:
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            context.set_details(
+                f"Shards {missing} of {collection.name} not on {self.config.hostport}"
+            )
+            return False
+        return True
+
+    def _compaction_loop(self):
+        """Periodically fold pending changes into new base indexes"""
+        while not self._stop_compaction.wait(self.config.COMPACTION_INTERVAL):
+            for collection in list(self.collections.values()):
+                try:
+                    collection.compact(self.config.COMPACTION_MIN_CHANGES)
+                except Exception:
+                    logger.exception(f"Failed to compact collection {collection.name}")
+
+    @unhandled_exception_rpc(
+        collections_pb2.CollectionsLoadResponse, servicers_pb2.SearchRequest.HIGH
+    )
     def CollectionsLoad(self, request, context):
+        if self.reload_collections is not None:
+            success = self.reload_collections()
+            return collections_pb2.CollectionsLoadResponse(success=success)
         self.load_collections()
         return collections_pb2.CollectionsLoadResponse()
 
+    @unhandled_exception_rpc(servicers_pb2.ShardChunk, servicers_pb2.SearchRequest.LOW)
+    def ShardFetch(self, request, context):
+        """Stream a loaded shard to a peer. The loaded index is written to a
+        temporary file and read back in chunks, so neither the whole shard
+        is held in memory nor its data source read again. Shards of
+        collections with enable_updates are refused, since their WAL and
+        uncompacted changes are not transferred."""
+        collection = self.collections.get(request.collection_name)
+        shard = collection.shards.get(request.shard_name) if collection else None
+        name = f"{request.collection_name}/{request.shard_name}"
+        if shard is None or shard.index.modified_time is None:
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            context.set_details(f"Shard {name} not loaded")
+            return
+        if shard.wal_directory is not None:
+            context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+            context.set_details(f"Shard {name} has updates enabled")
+            return
+
+        index = shard.index
+        modified_time, fingerprint = index.modified_time, index.fingerprint
+        chunk_size = self.config.PEER_TRANSFER_CHUNK_SIZE
+        with tempfile.TemporaryFile() as f:
+            index.write(f)
+            if (index.modified_time, index.fingerprint) != (modified_time, fingerprint):
+                context.set_code(grpc.StatusCode.ABORTED)
+                context.set_details(f"Shard {name} reloaded during transfer")
+                return
+            f.seek(0)
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                yield servicers_pb2.ShardChunk(
+                    content=chunk, modified_time=modified_time, fingerprint=fingerprint
+                )
+
+    @unhandled_exception_rpc(
+        servicers_pb2.MetricsResponse, servicers_pb2.SearchRequest.HIGH
+    )
+    def Metrics(self, request, context):
+        return metrics.registry.to_proto()
+
     def get_collection(self, name: str) -> Collection:
         return self.collections[name]
 
@@ -91,25 +419,65 @@ class SearcherServicer(servicers_pb2_grpc.SearcherServicer):
             if name not in new_collections:
                 self._drop_collection(name)
         for collection in self.collections.values():
+            collection.revalidate()
             if collection.update_available():
                 logger.debug(f"Update collection {collection.name}")
                 self.cluster_manager.set_local_state(
                     collections_pb2.Replica.BOOTING, collection.name
                 )
-                collection.load()
+                self._load_collection(collection)
                 self.cluster_manager.set_local_state(
                     collections_pb2.Replica.ACTIVE, collection.name
                 )
         self.collection_protos = {proto.name: proto for proto in collection_protos}
+        self.executors.configure(collection_protos)
+        self._invalidate_changed_shards()
+
+    def _load_collection(self, collection: Collection):
+        """Load a collection's shards, dropping the cached results of each
+        shard as soon as it loads rather than once every collection has"""
+        collection.load(
+            self.shard_loader, functools.partial(self._shard_loaded, collection.name)
+        )
+
+    def _shard_loaded(self, collection_name: str, shard: Shard):
+        if self.cache is None:
+            return
+        self.cache.invalidate(collection_name, shard.name)
+        self.shard_versions[(collection_name, shard.name)] = _shard_version(shard)
+
+    def _invalidate_changed_shards(self):
+        """Drop cached results of shards that were added, dropped, reloaded
+        or whose index's modified time changed since the last load"""
+        if self.cache is None:
+            return
+        versions = {
+            (collection.name, shard.name): _shard_version(shard)
+            for collection in self.collections.values()
+            for shard in collection.shards.values()
+        }
+        for key in set(versions) | set(self.shard_versions):
+            old, new = self.shard_versions.get(key), versions.get(key)
+            if (
+                old is None
+                or new is None
+                or old[0]() is not new[0]()
+                or old[1] != new[1]
+            ):
+                self.cache.invalidate(*key)
+        self.shard_versions = versions
 
     def _add_collection(self, proto: collections_pb2.Collection):
         logger.debug(f"Add collection {proto.name}")
         collection = Collection.from_proto(proto)
+        collection.wal_directory = self.config.WAL_DIRECTORY
+        collection.wal_fsync = self.config.WAL_FSYNC
         self.cluster_manager.set_local_state(
             collections_pb2.Replica.BOOTING, collection.name
         )
         self.collections[collection.name] = collection
-        collection.load()
+        self._set_peer_data_sources(collection)
+        self._load_collection(collection)
         self.cluster_manager.set_local_state(
             collections_pb2.Replica.ACTIVE, collection.name
         )
@@ -117,6 +485,8 @@ class SearcherServicer(servicers_pb2_grpc.SearcherServicer):
     def _drop_collection(self, name: str):
         logger.debug(f"Drop collection {name}")
         del self.collections[name]
+        self.tuners.pop(name, None)
+        metrics.registry.remove(collection=name)
 
     def _modify_collection(self, proto: collections_pb2.Collection):
         old_proto = self.collection_protos[proto.name]
@@ -150,7 +520,145 @@ class SearcherServicer(servicers_pb2_grpc.SearcherServicer):
                     logger.debug(f"Drop collection shard {proto.name}/{name}")
                     collection.drop_shard(name)
 
-            collection.load()
+            self._set_peer_data_sources(collection)
+            self._load_collection(collection)
             self.cluster_manager.set_local_state(
                 collections_pb2.Replica.ACTIVE, collection.name, name
             )
+
+    def _set_peer_data_sources(self, collection: Collection):
+        """Wrap the data source of shards that are not loaded yet so they are
+        copied from ACTIVE replicas on other Searchers before the origin"""
+        if not self.config.PEER_SHARD_TRANSFER:
+            return
+
+        protos = self.cluster_manager.list_collections([collection.name])
+        for shard_proto in protos[0].shards if protos else []:
+            shard = collection.shards.get(shard_proto.name)
+            origin = getattr(shard.index, "data_source", None) if shard else None
+            if origin is None or shard.index.modified_time is not None:
+                continue
+
+            if isinstance(origin, PeerDataSource):
+                origin = origin.origin
+            hostports = [
+                replica.node.hostport
+                for replica in shard_proto.replicas
+                if replica.state == collections_pb2.Replica.ACTIVE
+                and replica.node.hostport != self.config.hostport
+            ]
+            shard.index.data_source = PeerDataSource(
+                origin,
+                collection.name,
+                shard.name,
+                hostports,
+                self.config.ssl_channel_credentials,
+                self.config.PEER_TRANSFER_TIMEOUT,
+            )
+
+
+class AioSearcherServicer(SearcherServicer):
+    """A SearcherServicer for grpc.aio servers. Index searches and other
+    blocking work run on a bounded executor of MAX_WORKERS threads, which
+    caps CPU-bound work while the event loop accepts any number of RPCs.
+    Searches of collections with a search_executor run on its threads instead.
+
+    Attributes:
+        executor: Threads that run blocking work for RPCs
+    """
+
+    executor: ThreadPoolExecutor
+
+    def __init__(self, config: BaseConfig, cluster_manager: ClusterManager):
+        super().__init__(config, cluster_manager)
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.MAX_WORKERS, thread_name_prefix="searcher"
+        )
+
+    @unhandled_exception_rpc(servicers_pb2.SearchResponse)
+    async def Search(self, request, context):
+        executor = self.executors.get(request.collection_name) or self.executor
+        return await run_blocking(executor, super().Search, request, context)
+
+    @unhandled_exception_rpc(servicers_pb2.RetrieveResponse)
+    async def Retrieve(self, request, context):
+        return await self._run_blocking(super().Retrieve, request, context)
+
+    @unhandled_exception_rpc(servicers_pb2.RetrieveBatchResponse)
+    async def RetrieveBatch(self, request, context):
+        return await self._run_blocking(super().RetrieveBatch, request, context)
+
+    @unhandled_exception_rpc(servicers_pb2.UpsertResponse)
+    async def Upsert(self, request, context):
+        return await self._run_blocking(super().Upsert, request, context)
+
+    @unhandled_exception_rpc(servicers_pb2.DeleteResponse)
+    async def Delete(self, request, context):
+        return await self._run_blocking(super().Delete, request, context)
+
+    @unhandled_exception_rpc(
+        collections_pb2.CollectionsLoadResponse, servicers_pb2.SearchRequest.HIGH
+    )
+    async def CollectionsLoad(self, request, context):
+        return await self._run_blocking(super().CollectionsLoad, request, context)
+
+    @unhandled_exception_rpc(servicers_pb2.ShardChunk, servicers_pb2.SearchRequest.LOW)
+    async def ShardFetch(self, request, context):
+        chunks = super().ShardFetch(request, context)
+        while True:
+            chunk = await self._run_blocking(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    @unhandled_exception_rpc(
+        servicers_pb2.MetricsResponse, servicers_pb2.SearchRequest.HIGH
+    )
+    async def Metrics(self, request, context):
+        return metrics.registry.to_proto()
+
+    async def _run_blocking(self, func, *args):
+        return await run_blocking(self.executor, func, *args)
+
+
+def _shard_version(shard: Shard) -> Tuple[weakref.ref, Optional[float]]:
+    """Index and modified time of a shard, which change when it loads"""
+    return weakref.ref(shard.index), shard.index.modified_time
+
+
+def _results_to_columns(
+    results: List[Tuple[np.floating, indices_pb2.Metadata]],
+) -> indices_pb2.SearchResultColumns:
+    """Pack columnar search results, pairs of a distance and a metadata, into
+    columns. Distances keep the dtype the index searched with."""
+    if results:
+        distances = np.array([distance for distance, _ in results])
+    else:
+        distances = np.zeros(0, dtype="float32")
+    return metadatas_to_columns(distances, [metadata for _, metadata in results])
+
+
+def _cache_key(
+    request: servicers_pb2.SearchRequest,
+    shard_names: List[str],
+    params: Optional[indices_pb2.SearchParams],
+) -> bytes:
+    """Digest of everything in a search request that decides its results,
+    with the shards it searches and the search parameters in effect spelled out"""
+    options = servicers_pb2.SearchRequest()
+    options.CopyFrom(request)
+    options.shard_names[:] = shard_names
+    options.ClearField("priority")
+    options.ClearField("params")
+    if params is not None:
+        options.params.CopyFrom(params)
+    return ResultCache.key(options.SerializeToString(deterministic=True))
+
+
+def _search_options(request: servicers_pb2.SearchRequest) -> bytes:
+    """Everything in a search request but its vector, which searches must share
+    to be batched together"""
+    options = servicers_pb2.SearchRequest()
+    options.CopyFrom(request)
+    options.ClearField("vector")
+    return options.SerializeToString(deterministic=True)
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 import grpc
 from grpc import ServerCredentials, ChannelCredentials
@@ -16,7 +16,37 @@ class BaseConfig(object):
         LOG_FILE_BACKUPS: Number of log files to keep in rotation
         LOG_FILE_LOG_FORMAT: Format string for file logger
         LOG_FILE_MAX_BYTES: Max byte size for log file
-        MAX_WORKERS: Number of worker threads per gRPC server
+        MAX_WORKERS: Number of worker threads per gRPC server, or for asyncio Searchers, threads searching indexes
+        LOADER_IO_WORKERS: Number of shards fetched from data sources at once
+        LOADER_CPU_WORKERS: Number of shards deserialized at once
+        LOADER_MEMORY_BUDGET: Max bytes of shards being loaded at once, None for no limit
+        PEER_SHARD_TRANSFER: Copy new shard replicas from ACTIVE Searchers before data sources,
+            except shards of collections with enable_updates
+        PEER_TRANSFER_CHUNK_SIZE: Max bytes per message when serving a shard to a peer
+        PEER_TRANSFER_TIMEOUT: Seconds allowed to copy a shard from one peer
+        WAL_DIRECTORY: Directory for shard write-ahead logs, None to reject updates
+        WAL_FSYNC: Sync write-ahead logs to disk before acknowledging an update
+        COMPACTION_INTERVAL: Seconds between checks for shards to compact
+        COMPACTION_MIN_CHANGES: Pending changes in a shard that trigger compaction
+        SEARCH_LATENCY_TARGET: Target p95 search seconds per collection, None to not tune
+        SEARCH_NPROBE_RANGE: Bounds on nprobe while tuning
+        SEARCH_EF_SEARCH_RANGE: Bounds on efSearch while tuning
+        SEARCH_TUNING_WINDOW: Searches between tuning adjustments
+        SEARCH_OVERLOAD_IN_FLIGHT: Concurrent searches that fall back to the cheapest settings, None for MAX_WORKERS
+        SEARCH_ENCODED_RESPONSES: Splice stored metadata bytes into search responses, needs a server from factory.create_server
+        SEARCH_BATCH_WINDOW: Max seconds to gather concurrent searches into one batch, None to not batch
+        SEARCH_BATCH_MAX_SIZE: Max searches in one batch
+        SEARCH_CACHE_BYTES: Max bytes of search responses a Searcher caches, None to not cache, needs a server from factory.create_server
+        SEARCH_EXECUTOR_THREADS: Threads split by weight between collection search executors, None for MAX_WORKERS
+        ADMISSION_MAX_CONCURRENCY: Max RPCs a servicer works on at once, None to admit every RPC
+        ADMISSION_QUEUE_TIMEOUT: Max seconds an RPC waits for a slot before it is rejected
+        ADMISSION_MAX_QUEUE: Max RPCs waiting for a slot, None for ADMISSION_MAX_CONCURRENCY
+        ADMISSION_LOW_PRIORITY_SHARE: Fraction of slots low priority RPCs may hold
+        ADMISSION_HIGH_PRIORITY_RESERVE: Fraction of slots only high priority RPCs may hold
+        MERGER_SHARD_PRUNING: Skip shards by their summaries when a request does not say
+        MERGER_PRUNING_EPSILON: Default epsilon for approximate shard pruning
+        MERGER_TWO_PHASE_MIN_COUNT: Searches for at least this many items bound results in two phases, None to disable
+        MERGER_TWO_PHASE_OVERSAMPLE: Items asked of each Searcher in the first phase, as a multiple of its share
         HOSTNAME: Hostname of node
         SERVICER_PORT: Port of gRPC server
         MUTUAL_TLS: Require server and client to authenticate each other the CA
@@ -37,6 +67,7 @@ class BaseConfig(object):
         use_mutual_tls: Should server and clients be authenticated
         use_server_ssl: Should server be authenticated
         ssl_server_credentials: gRPC SSL server credentials
+        max_concurrent_rpcs: RPCs a gRPC server accepts before rejecting them itself
     """
 
     DEBUG = False
@@ -53,6 +84,35 @@ class BaseConfig(object):
     LOG_FILE_MAX_BYTES: int
 
     MAX_WORKERS: int
+    LOADER_IO_WORKERS: int = 4
+    LOADER_CPU_WORKERS: int = 2
+    LOADER_MEMORY_BUDGET: Optional[int] = None
+    PEER_SHARD_TRANSFER: bool = False
+    PEER_TRANSFER_CHUNK_SIZE: int = 1024 ** 2
+    PEER_TRANSFER_TIMEOUT: Optional[float] = None
+    WAL_DIRECTORY: Optional[str] = None
+    WAL_FSYNC: bool = True
+    COMPACTION_INTERVAL: float = 60.0
+    COMPACTION_MIN_CHANGES: int = 10000
+    SEARCH_LATENCY_TARGET: Optional[float] = None
+    SEARCH_NPROBE_RANGE: Tuple[int, int] = (1, 128)
+    SEARCH_EF_SEARCH_RANGE: Tuple[int, int] = (16, 512)
+    SEARCH_TUNING_WINDOW: int = 100
+    SEARCH_OVERLOAD_IN_FLIGHT: Optional[int] = None
+    SEARCH_ENCODED_RESPONSES: bool = True
+    SEARCH_BATCH_WINDOW: Optional[float] = None
+    SEARCH_BATCH_MAX_SIZE: int = 32
+    SEARCH_EXECUTOR_THREADS: Optional[int] = None
+    SEARCH_CACHE_BYTES: Optional[int] = None
+    ADMISSION_MAX_CONCURRENCY: Optional[int] = None
+    ADMISSION_QUEUE_TIMEOUT: float = 0.05
+    ADMISSION_MAX_QUEUE: Optional[int] = None
+    ADMISSION_LOW_PRIORITY_SHARE: float = 0.5
+    ADMISSION_HIGH_PRIORITY_RESERVE: float = 0.1
+    MERGER_SHARD_PRUNING: bool = False
+    MERGER_PRUNING_EPSILON: float = 0.0
+    MERGER_TWO_PHASE_MIN_COUNT: Optional[int] = None
+    MERGER_TWO_PHASE_OVERSAMPLE: float = 2.0
     HOSTNAME: str
     SERVICER_PORT: int
 
@@ -77,6 +137,14 @@ class BaseConfig(object):
     def hostport(self) -> str:
         return f"{self.HOSTNAME}:{self.SERVICER_PORT}"
 
+    @property
+    def max_concurrent_rpcs(self) -> Optional[int]:
+        if self.ADMISSION_MAX_CONCURRENCY is None:
+            return None
+        if self.ADMISSION_MAX_QUEUE is None:
+            return 2 * self.ADMISSION_MAX_CONCURRENCY
+        return self.ADMISSION_MAX_CONCURRENCY + self.ADMISSION_MAX_QUEUE
+
     @property
     def use_mutual_tls(self) -> bool:
         return self.MUTUAL_TLS
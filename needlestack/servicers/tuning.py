@@ -0,0 +1,143 @@
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Iterator, Tuple
+
+import numpy as np
+
+from needlestack.apis import indices_pb2
+from needlestack.utilities.metrics import MetricsRegistry, registry
+
+logger = logging.getLogger("needlestack")
+
+
+class SearchTuner(object):
+    """Holds the search latency of one collection near a target by moving the
+    nprobe and efSearch used by approximate indexes between bounds. Settings
+    are a level from 0, the cheapest, to ``steps``, the most accurate, mapped
+    geometrically onto each range. After every window of searches, the level
+    drops two steps if the 95th percentile latency is over target and rises
+    one step if it is well under. Searches that start while the Searcher is
+    overloaded use the cheapest settings, so load spikes cost recall rather
+    than queueing in the gRPC thread pool.
+
+    Attributes:
+        collection_name: Name of the tuned collection
+        latency_target: Target 95th percentile latency in seconds
+        nprobe_range: Inclusive bounds on nprobe
+        ef_search_range: Inclusive bounds on efSearch
+        window: Searches between adjustments
+        steps: Number of levels above the cheapest
+        headroom: Fraction of the target latency must be under to raise the level
+        level: Current level
+        metrics: Registry the operating point is reported to
+    """
+
+    collection_name: str
+    latency_target: float
+    nprobe_range: Tuple[int, int]
+    ef_search_range: Tuple[int, int]
+    window: int
+    steps: int
+    headroom: float = 0.7
+    level: int
+    metrics: MetricsRegistry
+
+    def __init__(
+        self,
+        collection_name: str,
+        latency_target: float,
+        nprobe_range: Tuple[int, int] = (1, 128),
+        ef_search_range: Tuple[int, int] = (16, 512),
+        window: int = 100,
+        steps: int = 8,
+        metrics: MetricsRegistry = registry,
+    ):
+        self.collection_name = collection_name
+        self.latency_target = latency_target
+        self.nprobe_range = nprobe_range
+        self.ef_search_range = ef_search_range
+        self.window = window
+        self.steps = steps
+        self.level = steps
+        self.metrics = metrics
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._publish()
+
+    def params(self, level: int = None) -> indices_pb2.SearchParams:
+        """Search parameters at a level, by default the current one"""
+        level = self.level if level is None else level
+        return indices_pb2.SearchParams(
+            nprobe=_interpolate(self.nprobe_range, level / self.steps),
+            ef_search=_interpolate(self.ef_search_range, level / self.steps),
+        )
+
+    def choose(self, overloaded: bool = False) -> indices_pb2.SearchParams:
+        """Parameters for one search
+
+        Args:
+            overloaded: Whether the Searcher is too busy for the current level
+        """
+        if overloaded:
+            self.metrics.increment(
+                "search_overloaded_total", collection=self.collection_name
+            )
+            return self.params(0)
+        return self.params()
+
+    @contextmanager
+    def timed(self) -> Iterator[None]:
+        """Record how long the block takes as the latency of one search"""
+        start = time.perf_counter()
+        yield
+        self.record(time.perf_counter() - start)
+
+    @contextmanager
+    def track(self, overloaded: bool = False) -> Iterator[indices_pb2.SearchParams]:
+        """Yield the parameters for one search and record how long it takes
+
+        Args:
+            overloaded: Whether the Searcher is too busy for the current level
+        """
+        params = self.choose(overloaded)
+        with self.timed():
+            yield params
+
+    def record(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+            if len(self._latencies) >= self.window:
+                self._adjust(np.percentile(self._latencies, 95))
+                self._latencies.clear()
+
+    def _adjust(self, latency: float):
+        level = self.level
+        if latency > self.latency_target:
+            level = max(0, level - 2)
+        elif latency < self.headroom * self.latency_target:
+            level = min(self.steps, level + 1)
+
+        if level != self.level:
+            logger.debug(
+                f"Search level for {self.collection_name} from {self.level} to {level}"
+                f" at {latency * 1000:.1f}ms p95"
+            )
+            self.level = level
+        self._publish(latency)
+
+    def _publish(self, latency: float = None):
+        labels = {"collection": self.collection_name}
+        params = self.params()
+        self.metrics.set_gauge("search_tuning_level", self.level, **labels)
+        self.metrics.set_gauge("search_nprobe", params.nprobe, **labels)
+        self.metrics.set_gauge("search_ef_search", params.ef_search, **labels)
+        if latency is not None:
+            self.metrics.set_gauge("search_latency_p95_seconds", latency, **labels)
+
+
+def _interpolate(bounds: Tuple[int, int], fraction: float) -> int:
+    low, high = bounds
+    return int(round(low * (high / low) ** fraction))
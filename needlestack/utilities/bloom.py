@@ -0,0 +1,114 @@
+import hashlib
+import math
+from typing import Iterable, List
+
+import numpy as np
+
+from needlestack.apis import collections_pb2
+
+
+class BloomFilter(object):
+    """A Bloom filter over string ids. Bit positions come from double hashing
+    a 128-bit blake2b digest of each id, so filters built by an indexing job
+    agree with the Merger that reads them on any machine.
+
+    Attributes:
+        num_bits: Number of bits in the filter
+        num_hashes: Number of bit positions set per id
+        bits: Bits packed little-endian into bytes
+    """
+
+    num_bits: int
+    num_hashes: int
+    bits: np.ndarray
+
+    def __init__(self, num_bits: int, num_hashes: int, bits: bytes = None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        if bits is None:
+            self.bits = np.zeros((num_bits + 7) // 8, dtype="uint8")
+        else:
+            self.bits = np.frombuffer(bits, dtype="uint8")
+
+    @classmethod
+    def from_ids(
+        cls, ids: List[str], false_positive_rate: float = 0.01
+    ) -> "BloomFilter":
+        """Build a filter sized for a list of ids
+
+        Args:
+            ids: IDs to add
+            false_positive_rate: Target rate of ids falsely reported as present
+        """
+        n = max(len(ids), 1)
+        num_bits = max(
+            8, math.ceil(-n * math.log(false_positive_rate) / math.log(2) ** 2)
+        )
+        num_hashes = max(1, round(num_bits / n * math.log(2)))
+        bloom = cls(num_bits, num_hashes)
+        bloom.add(ids)
+        return bloom
+
+    @classmethod
+    def from_proto(cls, proto: collections_pb2.IdFilter) -> "BloomFilter":
+        """Read a filter with inline bits, or bits stored in a data source"""
+        if proto.HasField("data_source"):
+            from needlestack.data_sources import DataSource
+
+            with DataSource.from_proto(proto.data_source).get_content() as content:
+                bits = content.read()
+        else:
+            bits = proto.bits
+        return cls(proto.num_bits, proto.num_hashes, bits)
+
+    def to_proto(self) -> collections_pb2.IdFilter:
+        return collections_pb2.IdFilter(
+            num_bits=self.num_bits, num_hashes=self.num_hashes, bits=self.tobytes()
+        )
+
+    def tobytes(self) -> bytes:
+        return self.bits.tobytes()
+
+    def add(self, ids: Iterable[str]):
+        positions = self._positions(hash_ids(ids)).ravel()
+        bits = self.bits.copy()
+        np.bitwise_or.at(
+            bits,
+            positions >> np.uint64(3),
+            np.left_shift(1, positions & np.uint64(7)).astype("uint8"),
+        )
+        self.bits = bits
+
+    def might_contain(self, id: str) -> bool:
+        """Whether an id might have been added. False means it was not."""
+        return bool(self.might_contain_hashes(hash_ids([id]))[0])
+
+    def might_contain_hashes(self, hashes: np.ndarray) -> np.ndarray:
+        """Check many ids at once by their hashes from ``hash_ids``. Hashes do not
+        depend on the filter's size, so they can be reused across filters.
+
+        Returns:
+            Boolean array of whether each id might have been added
+        """
+        positions = self._positions(hashes)
+        bytes_ = self.bits[positions >> np.uint64(3)]
+        masks = np.left_shift(1, positions & np.uint64(7)).astype("uint8")
+        return np.all(bytes_ & masks, axis=1)
+
+    def _positions(self, hashes: np.ndarray) -> np.ndarray:
+        i = np.arange(self.num_hashes, dtype="uint64")
+        return (hashes[:, :1] + i * hashes[:, 1:]) % np.uint64(self.num_bits)
+
+    def __contains__(self, id: str) -> bool:
+        return self.might_contain(id)
+
+
+def hash_ids(ids: Iterable[str]) -> np.ndarray:
+    """Hash ids into pairs of 64-bit integers for double hashing"""
+    digests = b"".join(
+        hashlib.blake2b(id.encode("utf-8"), digest_size=16).digest() for id in ids
+    )
+    hashes = np.frombuffer(digests, dtype="<u8").astype("uint64").reshape(-1, 2)
+    # An odd second hash visits distinct positions when num_bits is even
+    hashes[:, 1] |= np.uint64(1)
+    return hashes
@@ -0,0 +1,65 @@
+import threading
+from typing import Dict, Tuple
+
+from needlestack.apis import servicers_pb2
+
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class MetricsRegistry(object):
+    """Thread-safe gauges and counters, keyed by name and labels, that
+    servicers report through their Metrics RPC
+
+    Attributes:
+        gauges: Last value set for each gauge
+        counters: Running total of each counter
+    """
+
+    gauges: Dict[MetricKey, float]
+    counters: Dict[MetricKey, float]
+
+    def __init__(self):
+        self.gauges = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def set_gauge(self, name: str, value: float, **labels: str):
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def increment(self, name: str, value: float = 1, **labels: str):
+        with self._lock:
+            key = _key(name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def get(self, name: str, **labels: str) -> float:
+        """Current value of a gauge or counter, 0 if never set"""
+        key = _key(name, labels)
+        with self._lock:
+            return self.gauges.get(key, self.counters.get(key, 0))
+
+    def remove(self, **labels: str):
+        """Drop every metric with all of the given labels, like those of a
+        collection that was deleted"""
+        with self._lock:
+            for metrics in (self.gauges, self.counters):
+                for key in list(metrics):
+                    if set(labels.items()) <= set(key[1]):
+                        del metrics[key]
+
+    def to_proto(self) -> servicers_pb2.MetricsResponse:
+        with self._lock:
+            items = list(self.gauges.items()) + list(self.counters.items())
+        return servicers_pb2.MetricsResponse(
+            metrics=[
+                servicers_pb2.Metric(name=name, labels=dict(labels), value=value)
+                for (name, labels), value in sorted(items)
+            ]
+        )
+
+
+def _key(name: str, labels: Dict[str, str]) -> MetricKey:
+    return name, tuple(sorted(labels.items()))
+
+
+registry = MetricsRegistry()
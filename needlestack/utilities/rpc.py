@@ -1,27 +1,291 @@
+import math
+import asyncio
+import inspect
 import logging
 import functools
-from typing import Callable
+import contextlib
+import contextvars
+from concurrent.futures import Executor
+from typing import AsyncIterator, Callable, Iterator, Optional
 
+import grpc
 from grpc._channel import _Rendezvous
 
+from needlestack.exceptions import AdmissionRejectedException
+
 logger = logging.getLogger("needlestack")
 
+# Trailing metadata gRPC clients read as how long to wait before retrying
+RETRY_PUSHBACK_KEY = "grpc-retry-pushback-ms"
+
+# Set while a servicer method holds an admission slot, so servicer methods it
+# calls, or runs on an executor with run_blocking, are not admitted again
+_admitted: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "admitted", default=False
+)
+_END_OF_STREAM = object()
+
+
+def unhandled_exception_rpc(response_type: type, priority: Optional[int] = None):
+    """Log unhandled exceptions of a servicer method and pass on the status of
+    failed RPCs it made, including those raised while a streaming method
+    yields its responses. Methods of servicers with an ``admission``
+    controller are admitted through it first, and streaming methods hold
+    their slot until they finish streaming. RPCs it rejects end with
+    RESOURCE_EXHAUSTED and a retry pushback hint.
+
+    Args:
+        response_type: Message type of the method's responses
+        priority: Admission class of every call, by default the priority of
+            requests that have one and NORMAL for others
+    """
 
-def unhandled_exception_rpc(response_type: type):
     def wrapper(func: Callable) -> Callable:
-        @functools.wraps(func)
-        def wrapped(self, request, context):
-            try:
+        if inspect.iscoroutinefunction(func):
+            return _unhandled_exception_rpc_async(response_type, priority, func)
+        if inspect.isasyncgenfunction(func):
+            return _unhandled_exception_rpc_async_stream(priority, func)
+        if inspect.isgeneratorfunction(func):
+            return _unhandled_exception_rpc_stream(priority, func)
+        return _unhandled_exception_rpc_unary(response_type, priority, func)
+
+    return wrapper
+
+
+def _unhandled_exception_rpc_unary(
+    response_type: type, priority: Optional[int], func: Callable
+) -> Callable:
+    @functools.wraps(func)
+    def wrapped(self, request, context):
+        try:
+            with _admit(self, request, priority):
                 return func(self, request, context)
-            except _Rendezvous as e:
-                logger.error(e)
-                context.set_code(e.code())
-                context.set_details(e.details())
-                return response_type()
-            except Exception as e:
-                logger.error(e)
-                raise e
+        except AdmissionRejectedException as e:
+            _reject(context, e)
+            return response_type()
+        except _Rendezvous as e:
+            logger.error(e)
+            context.set_code(e.code())
+            context.set_details(e.details())
+            return response_type()
+        except Exception as e:
+            logger.error(e)
+            raise e
 
-        return wrapped
+    return wrapped
 
-    return wrapper
+
+def _unhandled_exception_rpc_async(
+    response_type: type, priority: Optional[int], func: Callable
+) -> Callable:
+    @functools.wraps(func)
+    async def wrapped(self, request, context):
+        try:
+            async with _admit_async(self, request, priority):
+                return await func(self, request, context)
+        except AdmissionRejectedException as e:
+            _reject(context, e)
+            return response_type()
+        except grpc.aio.AioRpcError as e:
+            logger.error(e)
+            context.set_code(e.code())
+            context.set_details(e.details())
+            return response_type()
+        except Exception as e:
+            logger.error(e)
+            raise e
+
+    return wrapped
+
+
+def _unhandled_exception_rpc_stream(
+    priority: Optional[int], func: Callable
+) -> Callable:
+    @functools.wraps(func)
+    def wrapped(self, request, context):
+        try:
+            with _admit_stream(self, request, priority) as admitted:
+                yield from admitted(func(self, request, context))
+        except AdmissionRejectedException as e:
+            _reject(context, e)
+        except _Rendezvous as e:
+            logger.error(e)
+            context.set_code(e.code())
+            context.set_details(e.details())
+        except Exception as e:
+            logger.error(e)
+            raise e
+
+    return wrapped
+
+
+def _unhandled_exception_rpc_async_stream(
+    priority: Optional[int], func: Callable
+) -> Callable:
+    @functools.wraps(func)
+    async def wrapped(self, request, context):
+        try:
+            async with _admit_async(self, request, priority):
+                async for response in func(self, request, context):
+                    yield response
+        except AdmissionRejectedException as e:
+            _reject(context, e)
+        except grpc.aio.AioRpcError as e:
+            logger.error(e)
+            context.set_code(e.code())
+            context.set_details(e.details())
+        except Exception as e:
+            logger.error(e)
+            raise e
+
+    return wrapped
+
+
+async def run_blocking(executor: Optional[Executor], func: Callable, *args):
+    """Run a blocking function on an executor from an async servicer method,
+    in the method's context so an RPC it already admitted is not admitted
+    again
+
+    Args:
+        executor: Executor to run on, None for the event loop's default
+        func: Blocking function
+        args: Arguments to the function
+    """
+    loop = asyncio.get_event_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        executor, functools.partial(context.run, func, *args)
+    )
+
+
+@contextlib.contextmanager
+def _admit(self, request, priority: Optional[int]) -> Iterator[None]:
+    admission = getattr(self, "admission", None)
+    if admission is None or _admitted.get():
+        yield
+        return
+    with admission.admit(_priority(request, priority)):
+        token = _admitted.set(True)
+        try:
+            yield
+        finally:
+            _admitted.reset(token)
+
+
+@contextlib.contextmanager
+def _admit_stream(
+    self, request, priority: Optional[int]
+) -> Iterator[Callable[[Iterator], Iterator]]:
+    """Hold an admission slot for the whole of a stream. Yields a function
+    that runs each step of the stream as admitted, since the thread serving
+    a stream must not be left admitted while the stream is suspended."""
+    admission = getattr(self, "admission", None)
+    if admission is None or _admitted.get():
+        yield lambda responses: responses
+        return
+    with admission.admit(_priority(request, priority)):
+        yield _run_admitted
+
+
+def _run_admitted(responses: Iterator) -> Iterator:
+    try:
+        while True:
+            token = _admitted.set(True)
+            try:
+                response = next(responses, _END_OF_STREAM)
+            finally:
+                _admitted.reset(token)
+            if response is _END_OF_STREAM:
+                return
+            yield response
+    finally:
+        responses.close()
+
+
+@contextlib.asynccontextmanager
+async def _admit_async(self, request, priority: Optional[int]) -> AsyncIterator[None]:
+    admission = getattr(self, "admission", None)
+    if admission is None or _admitted.get():
+        yield
+        return
+    async with admission.admit_async(_priority(request, priority)):
+        token = _admitted.set(True)
+        try:
+            yield
+        finally:
+            _admitted.reset(token)
+
+
+def _priority(request, priority: Optional[int]) -> int:
+    if priority is not None:
+        return priority
+    return getattr(request, "priority", 0)
+
+
+def _reject(context, e: AdmissionRejectedException):
+    retry_after_ms = int(math.ceil(e.retry_after * 1000))
+    context.set_trailing_metadata(((RETRY_PUSHBACK_KEY, str(retry_after_ms)),))
+    context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+    context.set_details(f"{e}, retry after {retry_after_ms}ms")
+
+
+class EncodedResponseInterceptor(grpc.ServerInterceptor):
+    """Lets servicer methods return responses they already encoded as bytes,
+    which are sent as they are rather than serialized again"""
+
+    def intercept_service(self, continuation, handler_call_details):
+        return _with_encoded_responses(continuation(handler_call_details))
+
+
+class AioEncodedResponseInterceptor(grpc.aio.ServerInterceptor):
+    """EncodedResponseInterceptor for grpc.aio servers"""
+
+    async def intercept_service(self, continuation, handler_call_details):
+        return _with_encoded_responses(await continuation(handler_call_details))
+
+
+def _with_encoded_responses(handler):
+    if handler is None or handler.response_serializer is None:
+        return handler
+    return handler._replace(
+        response_serializer=_pass_encoded(handler.response_serializer)
+    )
+
+
+def _pass_encoded(serializer: Callable) -> Callable:
+    def serialize(response):
+        if isinstance(response, bytes):
+            return response
+        return serializer(response)
+
+    return serialize
+
+
+def create_channel(
+    hostport: str, credentials: Optional[grpc.ChannelCredentials] = None
+) -> grpc.Channel:
+    """Create a gRPC channel to another node, secured if given credentials
+
+    Args:
+        hostport: Hostport of the node
+        credentials: Optional SSL channel credentials
+    """
+    if credentials is not None:
+        return grpc.secure_channel(hostport, credentials)
+    else:
+        return grpc.insecure_channel(hostport)
+
+
+def create_aio_channel(
+    hostport: str, credentials: Optional[grpc.ChannelCredentials] = None
+) -> grpc.aio.Channel:
+    """Create a grpc.aio channel to another node, secured if given credentials
+
+    Args:
+        hostport: Hostport of the node
+        credentials: Optional SSL channel credentials
+    """
+    if credentials is not None:
+        return grpc.aio.secure_channel(hostport, credentials)
+    else:
+        return grpc.aio.insecure_channel(hostport)
@@ -0,0 +1,169 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from needlestack.apis import collections_pb2
+from needlestack.apis import serializers
+
+
+class ShardSummary(object):
+    """Balls that cover every vector in a shard, each with a centroid, a radius
+    and a count of the vectors in it. From them a Merger bounds the distance
+    between a query and anything in the shard, without asking the shard.
+
+    Attributes:
+        centroids: Matrix of ball centers
+        radii: L2 radius of each ball
+        counts: Number of vectors in each ball
+        inner_product: Whether the shard ranks by inner product
+    """
+
+    centroids: np.ndarray
+    radii: np.ndarray
+    counts: np.ndarray
+    inner_product: bool
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        radii: np.ndarray,
+        counts: np.ndarray,
+        inner_product: bool = False,
+    ):
+        self.centroids = np.asarray(centroids, dtype="float32")
+        self.radii = np.asarray(radii, dtype="float32")
+        self.counts = np.asarray(counts, dtype="int64")
+        self.inner_product = inner_product
+
+    @classmethod
+    def from_vectors(
+        cls,
+        X: np.ndarray,
+        num_centroids: int = 16,
+        inner_product: bool = False,
+        iterations: int = 10,
+        seed: int = 0,
+    ) -> "ShardSummary":
+        """Cluster a shard's vectors with k-means and cover each cluster with a ball
+
+        Args:
+            X: Matrix of every vector in the shard
+            num_centroids: Max number of balls
+            inner_product: Whether the shard ranks by inner product
+            iterations: Rounds of k-means
+            seed: Seed for picking initial centroids
+        """
+        X = np.asarray(X, dtype="float32")
+        rng = np.random.RandomState(seed)
+        num_centroids = min(num_centroids, len(X))
+        centroids = X[rng.choice(len(X), num_centroids, replace=False)]
+        for _ in range(iterations):
+            assignments = _nearest(X, centroids)
+            for i in range(num_centroids):
+                members = X[assignments == i]
+                if len(members):
+                    centroids[i] = members.mean(axis=0)
+
+        assignments = _nearest(X, centroids)
+        counts = np.bincount(assignments, minlength=num_centroids)
+        radii = np.zeros(num_centroids, dtype="float32")
+        np.maximum.at(
+            radii, assignments, np.linalg.norm(X - centroids[assignments], axis=1)
+        )
+        keep = counts > 0
+        return cls(centroids[keep], radii[keep], counts[keep], inner_product)
+
+    @classmethod
+    def from_proto(cls, proto: collections_pb2.ShardSummary) -> "ShardSummary":
+        return cls(
+            serializers.proto_to_ndarray(proto.centroids),
+            proto.radii,
+            proto.counts,
+            proto.inner_product,
+        )
+
+    def to_proto(self) -> collections_pb2.ShardSummary:
+        return collections_pb2.ShardSummary(
+            centroids=serializers.ndarray_to_proto(self.centroids),
+            radii=self.radii.tolist(),
+            counts=self.counts.tolist(),
+            inner_product=self.inner_product,
+        )
+
+    def bounds(self, X: np.ndarray):
+        """Lowest and highest distance from each query vector to anything in
+        each ball, as matrices shaped (queries, balls). Inner products are
+        negated into distances so that lower is closer for either metric.
+
+        Args:
+            X: Matrix of query vectors
+        """
+        X = np.asarray(X, dtype="float64")
+        centroids = self.centroids.astype("float64")
+        if self.inner_product:
+            spread = np.linalg.norm(X, axis=1)[:, None] * self.radii
+            center = -(X @ centroids.T)
+            return center - spread, center + spread
+        else:
+            center = np.sqrt(_squared_distances(X, centroids))
+            return np.maximum(center - self.radii, 0), center + self.radii
+
+
+def select_shards(
+    summaries: Dict[str, Optional[ShardSummary]],
+    X: np.ndarray,
+    k: int,
+    epsilon: float = 0.0,
+) -> List[str]:
+    """Names of the shards that could hold one of the k nearest neighbors of
+    any query vector. Each query gets a threshold, the distance within which
+    summaries guarantee at least k vectors. Shards whose closest possible
+    vector is beyond the threshold are skipped. Shards without a summary are
+    always kept.
+
+    Args:
+        summaries: Summary of each shard, None for shards without one
+        X: Matrix of query vectors
+        k: Number of neighbors
+        epsilon: Also skip shards whose closest possible vector is within
+            epsilon * |threshold| of the threshold, trading recall for fewer
+            shards. 0 keeps results exact.
+    """
+    summarized = [name for name, summary in summaries.items() if summary is not None]
+    selected = [name for name, summary in summaries.items() if summary is None]
+    if not summarized:
+        return selected
+
+    X = np.asarray(X, dtype="float32").reshape(len(X), -1)
+    lowers, uppers, counts, owners = [], [], [], []
+    for i, name in enumerate(summarized):
+        lower, upper = summaries[name].bounds(X)
+        lowers.append(lower)
+        uppers.append(upper)
+        counts.append(summaries[name].counts)
+        owners.append(np.full(len(summaries[name].counts), i))
+    lowers, uppers = np.hstack(lowers), np.hstack(uppers)
+    counts, owners = np.concatenate(counts), np.concatenate(owners)
+
+    keep = np.zeros(len(summarized), dtype=bool)
+    for lower, upper in zip(lowers, uppers):
+        order = np.argsort(upper)
+        reached = np.searchsorted(np.cumsum(counts[order]), k)
+        if reached >= len(order):
+            return list(summaries)
+        threshold = upper[order[reached]]
+
+        candidates = lower <= threshold - epsilon * abs(threshold)
+        candidates[np.argmin(lower)] = True
+        keep[owners[candidates]] = True
+
+    return selected + [name for name, kept in zip(summarized, keep) if kept]
+
+
+def _squared_distances(X: np.ndarray, Y: np.ndarray) -> np.ndarray:
+    dists = (X**2).sum(axis=1)[:, None] - 2 * X @ Y.T + (Y**2).sum(axis=1)
+    return np.maximum(dists, 0)
+
+
+def _nearest(X: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    return np.argmin(_squared_distances(X, centroids), axis=1)
@@ -0,0 +1,68 @@
+import numpy as np
+
+from needlestack.apis import indices_pb2
+from needlestack.apis import serializers
+from needlestack.apis.columns import columns_to_items, items_to_columns, merge_columns
+
+
+def make_item(distance, id, **fields):
+    metadata = indices_pb2.Metadata(id=id)
+    for name, value in fields.items():
+        value_type = {str: "string_val", bool: "bool_val", int: "long_val"}.get(
+            type(value), "double_val"
+        )
+        metadata.fields.add(name=name, **{value_type: value})
+    return indices_pb2.SearchResultItem(float_distance=distance, metadata=metadata)
+
+
+def test_items_round_trip():
+    items = [
+        make_item(0.5, "a", title="first", count=3, score=0.25, hidden=True),
+        make_item(1.5, "b", title="second"),
+        make_item(2.5, "c", count=7),
+    ]
+
+    columns = items_to_columns(items)
+
+    assert serializers.proto_to_ndarray(columns.distances).dtype == "float32"
+    assert list(columns.ids) == ["a", "b", "c"]
+    title = columns.fields[0]
+    assert (title.name, title.value_type) == ("title", "string_val")
+    assert list(serializers.proto_to_ndarray(title.rows)) == [0, 1]
+    assert columns_to_items(columns) == items
+
+
+def test_items_round_trip_empty():
+    columns = items_to_columns([])
+    assert columns_to_items(columns) == []
+
+
+def test_full_column_omits_rows():
+    items = [make_item(float(i), str(i), rank=i) for i in range(3)]
+    columns = items_to_columns(items)
+    assert not columns.fields[0].HasField("rows")
+    assert list(serializers.proto_to_ndarray(columns.fields[0].values)) == [0, 1, 2]
+
+
+def test_merge_columns():
+    batch_a = [make_item(0.0, "a0", tag="x"), make_item(2.0, "a2", rank=2)]
+    batch_b = [make_item(1.0, "b1", tag="y"), make_item(2.0, "b2", tag="z")]
+
+    merged = merge_columns(
+        [items_to_columns(batch_a), items_to_columns(batch_b)], count=3
+    )
+
+    assert list(merged.ids) == ["a0", "b1", "a2"]
+    assert columns_to_items(merged) == [batch_a[0], batch_b[0], batch_a[1]]
+
+
+def test_merge_columns_descending():
+    batch_a = [make_item(3.0, "a3"), make_item(1.0, "a1")]
+    batch_b = [make_item(2.0, "b2")]
+
+    merged = merge_columns(
+        [items_to_columns(batch_a), items_to_columns(batch_b)], 2, descending=True
+    )
+
+    assert list(merged.ids) == ["a3", "b2"]
+    assert np.array_equal(serializers.proto_to_ndarray(merged.distances), [3.0, 2.0])
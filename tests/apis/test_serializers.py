@@ -1,8 +1,11 @@
+import io
+
 import pytest
 import numpy as np
 
 from needlestack.apis import serializers
 from needlestack.apis import tensors_pb2
+from needlestack.apis import indices_pb2
 
 
 def test_ndarray_to_proto_numpy():
@@ -163,3 +166,33 @@ def test_metadata_field_to_proto_not_serializable(field, fieldtype, fieldname):
     with pytest.raises(ValueError) as excinfo:
         serializers.metadata_field_to_proto(field, fieldtype, fieldname)
         assert "not serializable" in str(excinfo.value)
+
+
+def test_iter_proto_fields():
+    metadatas = [indices_pb2.Metadata(id=str(i)) for i in range(3)]
+    proto = indices_pb2.FaissIndex(index_binary=b"binary", metadatas=metadatas)
+    stream = io.BytesIO(proto.SerializeToString())
+
+    fields = []
+    for field in serializers.iter_proto_fields(stream):
+        if field.number == indices_pb2.FaissIndex.INDEX_BINARY_FIELD_NUMBER:
+            fields.append(field.read(2))
+        else:
+            fields.append(indices_pb2.Metadata.FromString(field.read()))
+
+    assert fields == [b"bi"] + metadatas
+
+
+def test_iter_proto_fields_truncated():
+    proto = indices_pb2.FaissIndex(index_binary=b"binary")
+    stream = io.BytesIO(proto.SerializeToString()[:-1])
+    with pytest.raises(ValueError):
+        for field in serializers.iter_proto_fields(stream):
+            field.read()
+
+
+def test_iter_proto_fields_offset():
+    data = indices_pb2.FaissIndex(index_binary=b"binary").SerializeToString()
+    field = next(serializers.iter_proto_fields(io.BytesIO(data)))
+    start, end = field.offset, field.offset + field.length
+    assert data[start:end] == b"binary"
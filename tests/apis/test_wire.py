@@ -0,0 +1,42 @@
+import pytest
+
+from needlestack.apis import indices_pb2
+from needlestack.apis import servicers_pb2
+from needlestack.apis import wire
+
+
+@pytest.mark.parametrize("value", [0, 1, 127, 128, 300, 2**31])
+def test_encode_varint(value):
+    encoded = wire.encode_varint(value)
+    parsed = servicers_pb2.SearchRequest.FromString(b"\x10" + encoded)
+    assert parsed.count == value
+
+
+@pytest.mark.parametrize("double", [False, True])
+def test_encode_search_response(double):
+    metadata = indices_pb2.Metadata(id="item-1")
+    metadata.fields.add(name="title", string_val="a" * 200)
+    distance_field = "double_distance" if double else "float_distance"
+    item = indices_pb2.SearchResultItem(metadata=metadata, **{distance_field: 0.1})
+
+    encoded = wire.encode_search_result_item(
+        getattr(item, distance_field), metadata.SerializeToString(), double
+    )
+    response = wire.encode_search_response([encoded, encoded], descending=True)
+
+    assert encoded == item.SerializeToString()
+    expected = servicers_pb2.SearchResponse(items=[item, item], descending=True)
+    assert servicers_pb2.SearchResponse.FromString(response) == expected
+
+
+def test_encode_metadata_id():
+    encoded = wire.encode_metadata_id("id-é")
+    assert encoded == indices_pb2.Metadata(id="id-é").SerializeToString()
+
+
+def test_metadata_blob():
+    metadatas = [indices_pb2.Metadata(id=str(i) * i) for i in range(5)]
+    blob = wire.MetadataBlob.from_encoded([m.SerializeToString() for m in metadatas])
+
+    assert len(blob) == 5
+    assert [indices_pb2.Metadata.FromString(blob[i]) for i in range(5)] == metadatas
@@ -22,8 +22,47 @@ def test_query(collection_2shards_2d, X, k):
         assert isinstance(item.metadata, indices_pb2.Metadata)
 
 
+def test_query_bound(collection_2shards_2d):
+    collection_2shards_2d.load()
+    shard_names = list(collection_2shards_2d.shards)
+    X = np.array([[0.5, 0.5]])
+    items = list(collection_2shards_2d.query(X, 45, shard_names))
+    bound = items[9].float_distance
+
+    bounded = list(collection_2shards_2d.query(X, 45, shard_names, bound=bound))
+    assert [item.metadata.id for item in bounded] == [
+        item.metadata.id for item in items if item.float_distance <= bound
+    ]
+    assert not collection_2shards_2d.inner_product
+
+
+def test_query_batch(collection_2shards_2d):
+    collection_2shards_2d.load()
+    shard_names = list(collection_2shards_2d.shards)
+    X = np.array([[0.5, 0.5], [0.1, 0.9]])
+
+    batches = collection_2shards_2d.query_batch(X, 5, shard_names)
+
+    assert len(batches) == 2
+    for x, results in zip(X, batches):
+        expected = collection_2shards_2d.query(x.reshape(1, -1), 5, shard_names)
+        assert list(results) == list(expected)
+
+
 @pytest.mark.parametrize("id", ["shard_1-0", "doesnt exists"])
 def test_retrieve(collection_2shards_2d, id):
     collection_2shards_2d.load()
     item = collection_2shards_2d.retrieve(id, collection_2shards_2d.shards.keys())
     assert isinstance(item, indices_pb2.RetrievalResultItem)
+
+
+def test_retrieve_batch(collection_2shards_2d):
+    collection_2shards_2d.load()
+    ids = ["shard_2-3", "doesnt exists", "shard_1-0", "shard_2-3"]
+    X, metadatas = collection_2shards_2d.retrieve_batch(
+        ids, collection_2shards_2d.shards.keys()
+    )
+    assert X.shape == (2, 2)
+    assert [metadata.id for metadata in metadatas] == ["shard_2-3", "shard_1-0"]
+    X_prime, _ = collection_2shards_2d.shards["shard_1"].retrieve_batch(["shard_1-0"])
+    assert np.array_equal(X[1], X_prime[0])
@@ -0,0 +1,101 @@
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+from needlestack.apis import data_sources_pb2
+from needlestack.collections.loader import MemoryBudget, ShardLoader
+from needlestack.data_sources import DataSource
+
+
+@pytest.mark.parametrize("memory_budget", [None, 1, 10**9])
+def test_load(collection_2shards_2d, memory_budget):
+    shards = list(collection_2shards_2d.shards.values())
+    loader = ShardLoader(io_workers=2, cpu_workers=2, memory_budget=memory_budget)
+    loader.load(shards)
+    for shard in shards:
+        assert shard.index.count > 0
+        assert not shard.update_available()
+
+
+def test_load_calls_on_load(collection_2shards_2d):
+    shards = list(collection_2shards_2d.shards.values())
+    loaded = []
+
+    def on_load(shard):
+        assert not shard.update_available()
+        loaded.append(shard.name)
+
+    ShardLoader().load(shards, on_load)
+    ShardLoader().load(shards, on_load)
+    assert sorted(loaded) == ["shard_1", "shard_2"]
+
+
+def test_load_streams_remote_shards(collection_2shards_2d, http_server, http_files):
+    shard = collection_2shards_2d.shards["shard_1"]
+    with open(shard.index.data_source.filename, "rb") as f:
+        http_files["/shard_1.pb"] = f.read()
+    shard.index.data_source = DataSource.from_proto(
+        data_sources_pb2.DataSource(
+            http_data_source=data_sources_pb2.HttpDataSource(
+                url=f"{http_server}/shard_1.pb"
+            )
+        )
+    )
+    shard.index.data_source.chunk_size = 64
+
+    fetch, staged = shard.fetch, []
+
+    @contextmanager
+    def record_fetch():
+        with fetch() as handle:
+            staged.append(handle)
+            yield handle
+
+    shard.fetch = record_fetch
+    ShardLoader(memory_budget=1).load([shard])
+
+    assert hasattr(staged[0], "read")
+    assert shard.index.count == 20
+    assert not shard.update_available()
+
+
+def test_load_error(collection_2shards_2d):
+    shard = collection_2shards_2d.shards["shard_1"]
+
+    @contextmanager
+    def fetch():
+        raise IOError("disk on fire")
+        yield
+
+    shard.fetch = fetch
+    with pytest.raises(IOError):
+        ShardLoader().load(list(collection_2shards_2d.shards.values()))
+    assert collection_2shards_2d.shards["shard_2"].index.count > 0
+
+
+def test_memory_budget():
+    budget = MemoryBudget(10)
+    budget.acquire(8)
+
+    acquired = threading.Event()
+
+    def acquire():
+        budget.acquire(5)
+        acquired.set()
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    assert not acquired.wait(0.05)
+    budget.release(8)
+    assert acquired.wait(1)
+    thread.join()
+    assert budget.in_use == 5
+
+
+def test_memory_budget_unknown_size():
+    budget = MemoryBudget(10)
+    budget.acquire(8)
+    budget.acquire(None)
+    budget.release(None)
+    assert budget.in_use == 8
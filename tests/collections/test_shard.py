@@ -1,7 +1,12 @@
+import threading
+
 import pytest
 import numpy as np
 
+from needlestack.apis import collections_pb2
+from needlestack.apis import data_sources_pb2
 from needlestack.apis import indices_pb2
+from needlestack.collections.shard import Shard
 
 
 @pytest.mark.parametrize(
@@ -32,3 +37,115 @@ def test_retrieve(shard_3d, id):
     item = shard_3d.retrieve(id)
     # index = shard_3d.index._get_index_by_id(id)
     assert isinstance(item, indices_pb2.RetrievalResultItem)
+
+
+@pytest.fixture
+def updatable_shard_3d(shard_3d, tmpdir):
+    shard_3d.enable_id_to_vector = True
+    shard_3d.wal_directory = str(tmpdir.join("wal"))
+    shard_3d.wal_fsync = False
+    shard_3d.load()
+    return shard_3d
+
+
+def test_upsert(updatable_shard_3d):
+    shard = updatable_shard_3d
+    shard.upsert(
+        np.array([[5, 5, 5], [6, 6, 6]]),
+        [indices_pb2.Metadata(id="id-0"), indices_pb2.Metadata(id="new")],
+    )
+
+    results = shard.query(np.array([[6, 6, 6]]), 2)
+    assert [item.metadata.id for item in results] == ["new", "id-0"]
+    assert len(shard.query(np.array([[0, 0, 0]]), 100)) == 11
+    assert shard.retrieve("id-0").vector.numpy_content
+
+    X, metadatas = shard.retrieve_batch(["new", "id-1", "id-0"])
+    assert [metadata.id for metadata in metadatas] == [
+        "new",
+        "id-1",
+        "id-0",
+    ]
+    assert X[2].tolist() == [5, 5, 5]
+
+
+def test_delete(updatable_shard_3d):
+    shard = updatable_shard_3d
+    shard.upsert(np.array([[5, 5, 5]]), [indices_pb2.Metadata(id="new")])
+
+    assert shard.delete(["new", "id-0", "missing"]) == 2
+    ids = {item.metadata.id for item in shard.query(np.array([[0, 0, 0]]), 100)}
+    assert len(ids) == 9
+    assert "id-0" not in ids
+    assert not shard.retrieve("id-0").metadata.id
+
+
+def test_replay_and_compact(updatable_shard_3d, tmpdir):
+    shard = updatable_shard_3d
+    shard.upsert(np.array([[5, 5, 5]]), [indices_pb2.Metadata(id="new")])
+    shard.delete(["id-0"])
+
+    reloaded = reload_shard(shard)
+    assert reloaded.pending_changes == 2
+
+    reloaded.compact()
+    assert reloaded.pending_changes == 0
+    assert reloaded.index.count == 10
+    assert reloaded.retrieve("new").metadata.id == "new"
+    assert not reloaded.retrieve("id-0").metadata.id
+
+    with reloaded.fetch() as staged:
+        assert staged == reloaded.wal.snapshot_filename
+
+    from_snapshot = reload_shard(shard)
+    assert from_snapshot.index.count == 10
+    assert from_snapshot.pending_changes == 0
+
+
+def test_upsert_during_compact(updatable_shard_3d):
+    shard = updatable_shard_3d
+    shard.upsert(np.array([[5, 5, 5]]), [indices_pb2.Metadata(id="new")])
+    replay = shard.wal.replay
+    threads = []
+
+    def replay_during_upsert(after=0):
+        # Upsert while write_snapshot is rewriting the log
+        shard.wal.replay = replay
+        records = list(replay(after))
+        thread = threading.Thread(
+            target=shard.upsert,
+            args=(np.array([[7, 7, 7]]), [indices_pb2.Metadata(id="late")]),
+        )
+        thread.start()
+        thread.join(0.2)
+        threads.append(thread)
+        return iter(records)
+
+    shard.wal.replay = replay_during_upsert
+    shard.compact()
+    threads[0].join()
+
+    assert shard.retrieve("late").metadata.id == "late"
+    assert reload_shard(shard).retrieve("late").metadata.id == "late"
+
+
+def reload_shard(shard):
+    """Load a new copy of a shard with the same data source and write-ahead log"""
+    data_source = data_sources_pb2.DataSource(
+        local_data_source=data_sources_pb2.LocalDataSource(
+            filename=shard.index.data_source.filename
+        )
+    )
+    reloaded = Shard.from_proto(
+        collections_pb2.Shard(
+            name=shard.name,
+            index=indices_pb2.BaseIndex(
+                faiss_index=indices_pb2.FaissIndex(data_source=data_source)
+            ),
+        )
+    )
+    reloaded.enable_id_to_vector = True
+    reloaded.wal_directory = shard.wal_directory
+    reloaded.wal_fsync = False
+    reloaded.load()
+    return reloaded
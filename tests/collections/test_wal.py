@@ -0,0 +1,56 @@
+from needlestack.apis import indices_pb2
+from needlestack.collections.wal import WriteAheadLog
+
+
+def test_append_and_replay(tmpdir):
+    wal = WriteAheadLog(str(tmpdir))
+    wal.open("v1")
+    wal.append(indices_pb2.WalRecord(delete_ids=["a"]))
+    wal.append(indices_pb2.WalRecord(delete_ids=["b"]))
+    wal.close()
+
+    wal = WriteAheadLog(str(tmpdir))
+    wal.open("v1")
+    assert [list(r.delete_ids) for r in wal.replay()] == [["a"], ["b"]]
+    assert wal.sequence == 2
+    assert [r.sequence for r in wal.replay(after=1)] == [2]
+
+
+def test_torn_write(tmpdir):
+    wal = WriteAheadLog(str(tmpdir))
+    wal.open("v1")
+    wal.append(indices_pb2.WalRecord(delete_ids=["a"]))
+    wal.close()
+    with open(wal.log_filename, "ab") as f:
+        f.write(b"\x10\x00\x00\x00partial")
+
+    wal.open("v1")
+    wal.append(indices_pb2.WalRecord(delete_ids=["b"]))
+    assert [list(r.delete_ids) for r in wal.replay()] == [["a"], ["b"]]
+
+
+def test_new_version_discards_log(tmpdir):
+    wal = WriteAheadLog(str(tmpdir))
+    wal.open("v1")
+    wal.append(indices_pb2.WalRecord(delete_ids=["a"]))
+    wal.write_snapshot(b"snapshot", wal.sequence)
+    assert wal.snapshot_filename is not None
+
+    wal.open("v2")
+    assert list(wal.replay()) == []
+    assert wal.snapshot_filename is None
+
+
+def test_write_snapshot(tmpdir):
+    wal = WriteAheadLog(str(tmpdir))
+    wal.open("v1")
+    wal.append(indices_pb2.WalRecord(delete_ids=["a"]))
+    wal.append(indices_pb2.WalRecord(delete_ids=["b"]))
+    wal.write_snapshot(b"snapshot", 1)
+    wal.append(indices_pb2.WalRecord(delete_ids=["c"]))
+
+    wal = WriteAheadLog(str(tmpdir))
+    wal.open("v1")
+    with open(wal.snapshot_filename, "rb") as f:
+        assert f.read() == b"snapshot"
+    assert [list(r.delete_ids) for r in wal.replay()] == [["b"], ["c"]]
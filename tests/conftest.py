@@ -1,6 +1,9 @@
+import hashlib
+import threading
 from pathlib import Path
 from unittest import mock
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import faiss
 import pytest
@@ -52,6 +55,20 @@ def faiss_index_4d(tmpdir):
     yield BaseIndex.from_proto(proto)
 
 
+@pytest.fixture
+def scalar_quantized_index_8d(tmpdir):
+    X, metadatas = gen_random_vectors_and_metadatas(
+        dimension=8, size=200, dtype="float32"
+    )
+    index = indexing.create_scalar_quantized_index_shard(X, metadatas)
+    proto = indices_pb2.BaseIndex(
+        scalar_quantized_index=indices_pb2.ScalarQuantizedIndex(
+            data_source=write_index_proto(tmpdir, index.serialize(), "sq_index")
+        )
+    )
+    yield BaseIndex.from_proto(proto)
+
+
 @pytest.fixture
 def shard_3d(tmpdir):
     X, metadatas = gen_random_vectors_and_metadatas(
@@ -119,15 +136,24 @@ def test_servicer_tls_config(
 
 
 @pytest.fixture
-def gcs_blob():
+def gcs_blob_content():
+    return b"winter is coming" * 10
+
+
+@pytest.fixture
+def gcs_blob(gcs_blob_content):
     def download_to_file(f):
-        f.write(b"")
+        f.write(gcs_blob_content)
 
-    def download_as_string():
-        return b""
+    def download_as_string(start=None, end=None):
+        start = start or 0
+        stop = len(gcs_blob_content) if end is None else end + 1
+        return gcs_blob_content[start:stop]
 
     blob = mock.Mock(spec=storage.Blob)
     blob.updated = datetime.now()
+    blob.size = len(gcs_blob_content)
+    blob.crc32c = hashlib.md5(gcs_blob_content).hexdigest()
     blob.download_to_file = mock.Mock(side_effect=download_to_file)
     blob.download_as_string = mock.Mock(side_effect=download_as_string)
     yield blob
@@ -156,6 +182,81 @@ def gcs_storage_client(monkeypatch, gcs_bucket):
     yield client
 
 
+@pytest.fixture
+def http_files():
+    """Mapping of URL path to file content served by http_server"""
+    return {}
+
+
+@pytest.fixture
+def http_options():
+    """Features of http_server, which sends ETags and accepts byte ranges
+    unless "etag" or "ranges" are set to False"""
+    return {}
+
+
+@pytest.fixture
+def http_server(http_files, http_options):
+    """Local stand-in for an HTTP file server that supports ETags,
+    conditional requests, and byte ranges"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FileRequestHandler)
+    server.files = http_files
+    server.options = http_options
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+class FileRequestHandler(BaseHTTPRequestHandler):
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def respond(self, send_body):
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+
+        options = self.server.options
+        etag = '"' + hashlib.md5(content).hexdigest() + '"'
+        if not options.get("etag", True):
+            etag = None
+        elif self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        if self.headers.get("If-Match", etag) != etag:
+            self.send_error(412)
+            return
+
+        status = 200
+        ranges = options.get("ranges", True)
+        if ranges and self.headers.get("Range"):
+            start, end = self.headers["Range"].replace("bytes=", "").split("-")
+            first, last = int(start), int(end)
+            content = content[first:][: last - first + 1]
+            status = 206
+
+        self.send_response(status)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        if ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
 def gen_random_vectors_and_metadatas(dimension, size, dtype, id_prefix="id", seed=42):
     np.random.seed(seed)
     X = np.random.rand(size, dimension).astype(dtype)
@@ -178,14 +279,18 @@ def gen_faiss_index_proto(tmpdir, X, metadatas, name="test_index"):
     faiss_index = indexing.create_faiss_index_shard(index, metadatas)
     proto = faiss_index.serialize()
 
+    return indices_pb2.BaseIndex(
+        faiss_index=indices_pb2.FaissIndex(
+            data_source=write_index_proto(tmpdir, proto, name)
+        )
+    )
+
+
+def write_index_proto(tmpdir, proto, name):
     filename = str(tmpdir.join(f"{name}.pb"))
     with open(filename, "wb") as f:
         f.write(proto.SerializeToString())
 
-    return indices_pb2.BaseIndex(
-        faiss_index=indices_pb2.FaissIndex(
-            data_source=data_sources_pb2.DataSource(
-                local_data_source=data_sources_pb2.LocalDataSource(filename=filename)
-            )
-        )
+    return data_sources_pb2.DataSource(
+        local_data_source=data_sources_pb2.LocalDataSource(filename=filename)
     )
@@ -0,0 +1,30 @@
+import io
+
+import pytest
+
+from needlestack.data_sources.chunked import ChunkedReader
+
+
+@pytest.mark.parametrize("chunk_size,max_workers", [(1, 1), (3, 2), (8, 4), (100, 2)])
+def test_chunked_reader(chunk_size, max_workers):
+    value = b"the night is dark and full of terrors"
+
+    def fetch_range(start, end):
+        stop = end + 1
+        return value[start:stop]
+
+    with ChunkedReader(fetch_range, len(value), chunk_size, max_workers) as reader:
+        stream = io.BufferedReader(reader)
+        assert stream.read(4) == value[:4]
+        assert stream.read() == value[4:]
+        stream.seek(0)
+        assert stream.read() == value
+
+
+def test_chunked_reader_error():
+    def fetch_range(start, end):
+        raise ConnectionError("connection reset")
+
+    with ChunkedReader(fetch_range, 10, 5, 2) as reader:
+        with pytest.raises(IOError):
+            reader.read(5)
@@ -15,18 +15,24 @@ def test_get_client(gcs_storage_client):
     assert client_1 == client_2
 
 
-def test_gcs_data_source(gcs_storage_client):
+def test_gcs_data_source(gcs_storage_client, gcs_blob_content):
     proto = data_sources_pb2.DataSource(
         gcs_data_source=data_sources_pb2.GcsDataSource(
             bucket_name="my_bucket", blob_name="my_blob"
         )
     )
     data_source = DataSource.from_proto(proto)
+    data_source.chunk_size = 7
 
     assert isinstance(data_source.last_modified, float)
+    assert data_source.size == len(gcs_blob_content)
+    assert isinstance(data_source.fingerprint, str)
 
-    with data_source.local_filename() as f:
-        assert isinstance(f, str)
+    with data_source.local_filename() as filename:
+        assert isinstance(filename, str)
+        with open(filename, "rb") as f:
+            assert f.read() == gcs_blob_content
 
     with data_source.get_content() as content:
-        assert isinstance(content, bytes)
+        assert content.read(5) == gcs_blob_content[:5]
+        assert content.read() == gcs_blob_content[5:]
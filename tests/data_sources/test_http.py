@@ -0,0 +1,93 @@
+import pytest
+
+from needlestack.apis import data_sources_pb2
+from needlestack.data_sources import DataSource
+from needlestack.data_sources.http import HttpDataSource
+
+
+@pytest.fixture
+def http_data_source(http_server, http_files):
+    http_files["/shard.pb"] = b"you know nothing jon snow" * 10
+    proto = data_sources_pb2.DataSource(
+        http_data_source=data_sources_pb2.HttpDataSource(
+            url=f"{http_server}/shard.pb", headers={"X-Needlestack": "test"}
+        )
+    )
+    yield DataSource.from_proto(proto)
+
+
+@pytest.mark.parametrize("chunk_size", [64, 1000])
+def test_http_data_source(http_data_source, http_files, chunk_size):
+    http_data_source.chunk_size = chunk_size
+    content = http_files["/shard.pb"]
+
+    assert http_data_source.size == len(content)
+    assert http_data_source.fingerprint == http_data_source.etag
+
+    with http_data_source.get_content() as f:
+        assert f.read() == content
+
+    with http_data_source.local_filename() as filename:
+        with open(filename, "rb") as f:
+            assert f.read() == content
+
+
+def test_http_data_source_revalidate(http_data_source, http_files):
+    last_modified = http_data_source.last_modified
+    assert isinstance(last_modified, float)
+    assert http_data_source.revalidate() is False
+    assert http_data_source.last_modified == last_modified
+
+    http_files["/shard.pb"] = b"winter is here"
+    assert http_data_source.revalidate() is True
+    assert http_data_source.last_modified >= last_modified
+    with http_data_source.get_content() as f:
+        assert f.read() == b"winter is here"
+
+
+def test_http_data_source_properties_are_cached(http_data_source, http_files):
+    fingerprint = http_data_source.fingerprint
+    size = http_data_source.size
+
+    http_files["/shard.pb"] = b"winter is here"
+    assert http_data_source.fingerprint == fingerprint
+    assert http_data_source.size == size
+
+    assert http_data_source.revalidate() is True
+    assert http_data_source.fingerprint != fingerprint
+    assert http_data_source.size == len(b"winter is here")
+
+
+def test_http_data_source_default_headers():
+    data_source = HttpDataSource()
+    assert data_source.headers == {}
+    assert HttpDataSource("http://localhost/shard.pb").headers == {}
+
+
+def test_http_data_source_without_validators(
+    http_data_source, http_files, http_options
+):
+    http_options["etag"] = False
+    last_modified = http_data_source.last_modified
+
+    assert http_data_source.fingerprint is None
+    assert http_data_source.revalidate() is False
+    assert http_data_source.last_modified == last_modified
+
+    http_files["/shard.pb"] = b"winter is here"
+    assert http_data_source.revalidate() is True
+    assert http_data_source.size == len(b"winter is here")
+    assert http_data_source.revalidate() is False
+
+
+def test_http_data_source_without_ranges(http_data_source, http_files, http_options):
+    http_options["ranges"] = False
+    http_data_source.chunk_size = 64
+    content = http_files["/shard.pb"]
+
+    assert not http_data_source._use_ranges()
+    with http_data_source.get_content() as f:
+        assert f.read() == content
+    with http_data_source.local_filename() as filename:
+        with open(filename, "rb") as f:
+            assert f.read() == content
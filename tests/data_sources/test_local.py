@@ -1,3 +1,5 @@
+import os
+
 from needlestack.apis import data_sources_pb2
 from needlestack.data_sources import DataSource
 
@@ -18,3 +20,23 @@ def test_local_data_source(tmpdir):
 
     with data_source.get_content() as data:
         assert data.read() == value
+    assert data_source.size == len(value)
+
+
+def test_local_data_source_fingerprint(tmpdir):
+    filename = str(tmpdir.join("myfile.txt"))
+    with open(filename, "wb") as f:
+        f.write(b"winter is coming")
+
+    proto = data_sources_pb2.DataSource(
+        local_data_source=data_sources_pb2.LocalDataSource(filename=filename)
+    )
+    data_source = DataSource.from_proto(proto)
+    fingerprint = data_source.fingerprint
+
+    os.utime(filename, (0, 0))
+    assert data_source.fingerprint == fingerprint
+
+    with open(filename, "wb") as f:
+        f.write(b"winter is here")
+    assert data_source.fingerprint != fingerprint
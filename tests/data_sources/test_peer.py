@@ -0,0 +1,113 @@
+import os
+from unittest import mock
+
+import grpc
+import pytest
+
+from needlestack.apis import data_sources_pb2
+from needlestack.apis import servicers_pb2
+from needlestack.data_sources import DataSource
+from needlestack.data_sources import peer
+from needlestack.data_sources.peer import PeerDataSource
+
+
+class FakeChunks(list):
+    def cancel(self):
+        pass
+
+
+class FakeRpcError(grpc.RpcError):
+    pass
+
+
+@pytest.fixture
+def origin(tmpdir):
+    filename = str(tmpdir.join("origin.pb"))
+    with open(filename, "wb") as f:
+        f.write(b"from origin")
+    proto = data_sources_pb2.DataSource(
+        local_data_source=data_sources_pb2.LocalDataSource(filename=filename)
+    )
+    yield DataSource.from_proto(proto)
+
+
+@pytest.fixture
+def peer_responses(monkeypatch):
+    responses = {}
+
+    def shard_fetch(hostport):
+        def fetch(request, timeout=None):
+            response = responses[hostport]
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        return fetch
+
+    def create_stub(channel):
+        return mock.Mock(ShardFetch=shard_fetch(channel.hostport))
+
+    def create_channel(hostport, credentials=None):
+        channel = mock.MagicMock(hostport=hostport)
+        channel.__enter__.return_value = channel
+        return channel
+
+    monkeypatch.setattr(peer, "create_channel", create_channel)
+    monkeypatch.setattr(peer.servicers_pb2_grpc, "SearcherStub", create_stub)
+    yield responses
+
+
+def test_peer_data_source(origin, peer_responses):
+    peer_responses["peer1:50051"] = FakeRpcError()
+    peer_responses["peer2:50051"] = FakeChunks(
+        [
+            servicers_pb2.ShardChunk(content=b"from ", modified_time=1e12),
+            servicers_pb2.ShardChunk(content=b"peer", modified_time=1e12),
+        ]
+    )
+    data_source = PeerDataSource(
+        origin, "collection", "shard", ["peer1:50051", "peer2:50051"]
+    )
+
+    assert data_source.last_modified == origin.last_modified
+    with data_source.get_content() as content:
+        assert content.read() == b"from peer"
+    with data_source.local_filename() as filename:
+        with open(filename, "rb") as f:
+            assert f.read() == b"from peer"
+
+
+def test_peer_data_source_stale_peer(origin, peer_responses):
+    peer_responses["peer1:50051"] = FakeChunks(
+        [servicers_pb2.ShardChunk(content=b"from peer", modified_time=0.0)]
+    )
+    data_source = PeerDataSource(origin, "collection", "shard", ["peer1:50051"])
+
+    with data_source.get_content() as content:
+        assert content.read() == b"from origin"
+
+
+def test_peer_data_source_no_peers(origin):
+    data_source = PeerDataSource(origin, "collection", "shard", [])
+
+    with data_source.local_filename() as filename:
+        with open(filename, "rb") as f:
+            assert f.read() == b"from origin"
+
+
+def test_peer_data_source_missing_origin(origin, peer_responses):
+    peer_responses["peer1:50051"] = FakeChunks(
+        [
+            servicers_pb2.ShardChunk(
+                content=b"from peer", modified_time=10.0, fingerprint="abc"
+            )
+        ]
+    )
+    data_source = PeerDataSource(origin, "collection", "shard", ["peer1:50051"])
+    os.remove(origin.filename)
+
+    with data_source.get_content() as content:
+        assert content.read() == b"from peer"
+    assert data_source.fingerprint == "abc"
+    assert data_source.last_modified == 10.0
+    assert data_source.size is None
@@ -0,0 +1,40 @@
+import numpy as np
+
+from needlestack.apis import indices_pb2
+from needlestack.indices.delta import DeltaIndex
+
+
+def test_add_and_remove_vectors():
+    delta = DeltaIndex(2)
+    metadatas = [indices_pb2.Metadata(id=id) for id in ["a", "b", "c"]]
+    delta.add_vectors(np.array([[0, 0], [1, 1], [2, 2]]), metadatas)
+    delta.add_vectors(np.array([[5, 5]]), [indices_pb2.Metadata(id="b")])
+
+    assert delta.count == 3
+    assert delta.remove_vectors(["a", "missing"]) == 1
+    X, found = delta.get_vectors_and_metadatas(["c", "b"])
+    assert [metadata.id for metadata in found] == ["c", "b"]
+    assert X.tolist() == [[2, 2], [5, 5]]
+
+
+def test_knn_search():
+    delta = DeltaIndex(2)
+    metadatas = [indices_pb2.Metadata(id=id) for id in ["a", "b", "c"]]
+    delta.add_vectors(np.array([[0, 0], [1, 1], [3, 3]]), metadatas)
+
+    dists, idxs = delta.knn_search(np.array([[1, 1]]), 2)
+    assert idxs.tolist() == [[1, 0]]
+    assert dists.tolist() == [[0, 2]]
+
+    dists, idxs = delta.knn_search(np.array([[1, 1]]), 2, np.array([True, False, True]))
+    assert idxs.tolist() == [[0, 2]]
+
+
+def test_knn_search_inner_product():
+    delta = DeltaIndex(2, inner_product=True)
+    metadatas = [indices_pb2.Metadata(id=id) for id in ["a", "b"]]
+    delta.add_vectors(np.array([[1, 0], [2, 2]]), metadatas)
+
+    dists, idxs = delta.knn_search(np.array([[1, 1]]), 2)
+    assert idxs.tolist() == [[1, 0]]
+    assert dists.tolist() == [[4, 1]]
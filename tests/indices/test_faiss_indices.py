@@ -1,16 +1,37 @@
+import io
+import os
+import shutil
+
+import faiss
 import pytest
 import numpy as np
 
 from needlestack.apis import indices_pb2
+from needlestack.apis import indexing
 from needlestack.exceptions import UnsupportedIndexOperationException
 
 
 def test_load(faiss_index_4d):
     assert not hasattr(faiss_index_4d, "index")
-    assert not hasattr(faiss_index_4d, "metadatas")
+    assert faiss_index_4d.metadata_blob is None
     faiss_index_4d.load()
     assert hasattr(faiss_index_4d, "index")
-    assert hasattr(faiss_index_4d, "metadatas")
+    assert len(faiss_index_4d.metadata_blob) == 10
+    assert faiss_index_4d.metadatas[0] == faiss_index_4d.metadata_blob.decode(0)
+
+
+def test_update_available(faiss_index_4d):
+    assert faiss_index_4d.update_available()
+    faiss_index_4d.load()
+    assert not faiss_index_4d.update_available()
+
+    filename = faiss_index_4d.data_source.filename
+    os.utime(filename, (1e10, 1e10))
+    assert not faiss_index_4d.update_available()
+
+    with open(filename, "ab") as f:
+        f.write(b"\x00")
+    assert faiss_index_4d.update_available()
 
 
 @pytest.mark.parametrize(
@@ -83,6 +104,32 @@ def test_get_vector_by_index(faiss_index_4d):
     X = faiss_index_4d._get_vector_by_index(0)
     assert type(X) == np.ndarray
     assert X.shape == (4,)
+    assert np.array_equal(X, faiss_index_4d.index.reconstruct(0))
+
+
+def test_get_vectors_and_metadatas(faiss_index_4d):
+    faiss_index_4d.enable_id_to_vector = True
+    faiss_index_4d.load()
+
+    ids = [faiss_index_4d._get_metadata_by_index(i).id for i in (3, 1)]
+    X, metadatas = faiss_index_4d.get_vectors_and_metadatas(ids + ["doesnt exist"])
+    assert X.shape == (2, 4)
+    assert np.array_equal(X[0], faiss_index_4d.index.reconstruct(3))
+    assert [metadata.id for metadata in metadatas] == ids
+
+
+@pytest.mark.parametrize("idxs", [[0, 1, 2], [7, 3], []])
+def test_get_vectors_by_indices_ivf(idxs):
+    np.random.seed(42)
+    X = np.random.rand(100, 4).astype("float32")
+    index = faiss.IndexIVFFlat(faiss.IndexFlatL2(4), 4, 2)
+    index.train(X)
+    index.add(X)
+
+    faiss_index = indexing.create_faiss_index_shard(index, [])
+    faiss_index._set_id_to_vector(True)
+    assert faiss_index.vectors is None
+    assert np.array_equal(faiss_index._get_vectors_by_indices(idxs), X[idxs])
 
 
 @pytest.mark.parametrize("index", [0, 1, 2, 3])
@@ -94,9 +141,219 @@ def test_get_metadata_by_index(faiss_index_4d, index):
     faiss_index_4d._get_index_by_id(id) == index
 
 
+def test_id_index_memory_mapped(faiss_index_4d, tmpdir):
+    faiss_index_4d.enable_id_to_vector = True
+    staged = str(tmpdir.join("staged.pb"))
+    shutil.copyfile(faiss_index_4d.data_source.filename, staged)
+    faiss_index_4d.load(staged)
+
+    assert isinstance(faiss_index_4d.id_index.hashes.base, np.memmap)
+    for i, metadata in enumerate(faiss_index_4d.metadatas):
+        assert faiss_index_4d._get_index_by_id(metadata.id) == i
+    assert faiss_index_4d._get_index_by_id("missing") is None
+
+
+def test_id_index_not_mapped_from_source_file(faiss_index_4d):
+    faiss_index_4d.enable_id_to_vector = True
+    with faiss_index_4d.fetch() as filename:
+        faiss_index_4d.load(filename)
+
+    assert not isinstance(faiss_index_4d.id_index.hashes.base, np.memmap)
+    with open(faiss_index_4d.data_source.filename, "r+b") as f:
+        f.truncate(0)
+    for i, metadata in enumerate(faiss_index_4d.metadatas):
+        assert faiss_index_4d._get_index_by_id(metadata.id) == i
+
+
 def test_get_index_by_id_not_enabled(faiss_index_4d):
     faiss_index_4d.load()
 
     with pytest.raises(UnsupportedIndexOperationException) as excinfo:
         faiss_index_4d._get_index_by_id(99999999)
         assert "Index does not have enable_id_to_vector" == str(excinfo.value)
+
+
+@pytest.mark.parametrize("brute_force_fraction", [0.0, 1.0])
+def test_query_metadata_filter(faiss_index_4d, brute_force_fraction):
+    faiss_index_4d.enable_metadata_index = True
+    faiss_index_4d.brute_force_fraction = brute_force_fraction
+    faiss_index_4d.load()
+
+    metadata_filter = indices_pb2.MetadataFilter(
+        conditions=[
+            indices_pb2.MetadataCondition(
+                name="is_even", equals=indices_pb2.MetadataField(bool_val=True)
+            )
+        ]
+    )
+    X = np.array([[1, 1, 1, 1]])
+    results = faiss_index_4d.query(X, 10, metadata_filter)[0]
+
+    assert len(results) == 5
+    assert all(int(item.metadata.id.split("-")[1]) % 2 == 0 for item in results)
+    distances = [item.float_distance for item in results]
+    assert distances == sorted(distances)
+
+
+def test_query_metadata_filter_no_matches(faiss_index_4d):
+    faiss_index_4d.enable_metadata_index = True
+    faiss_index_4d.load()
+
+    metadata_filter = indices_pb2.MetadataFilter(
+        conditions=[
+            indices_pb2.MetadataCondition(
+                name="int_id", equals=indices_pb2.MetadataField(int_val=-1)
+            )
+        ]
+    )
+    assert faiss_index_4d.query(np.array([[1, 1, 1, 1]]), 3, metadata_filter) == [[]]
+
+
+def test_knn_search_post_filter(monkeypatch):
+    np.random.seed(42)
+    X = np.random.rand(200, 4).astype("float32")
+    index = faiss.IndexFlatL2(4)
+    index.add(X)
+    faiss_index = indexing.create_faiss_index_shard(index, [])
+
+    def unsupported(*args):
+        raise RuntimeError("IDSelector not supported")
+
+    monkeypatch.setattr(faiss, "IDSelectorBitmap", unsupported)
+    monkeypatch.setattr(faiss_index, "_brute_force_search", None)
+    mask = np.arange(200) % 2 == 0
+    dists, idxs = faiss_index.knn_search(X[:5], 4, mask)
+
+    exact = faiss.IndexFlatL2(4)
+    exact.add(X[mask])
+    expected_dists, expected = exact.search(X[:5], 4)
+    assert np.array_equal(idxs, np.flatnonzero(mask)[expected])
+    assert np.allclose(dists, expected_dists)
+
+
+@pytest.mark.parametrize(
+    "projection,names",
+    [
+        (None, ["int_id", "is_even"]),
+        (indices_pb2.MetadataProjection(return_fields=["is_even"]), ["is_even"]),
+        (indices_pb2.MetadataProjection(ids_only=True), []),
+    ],
+)
+def test_query_projection(faiss_index_4d, projection, names):
+    faiss_index_4d.load()
+    results = faiss_index_4d.query(np.array([[1, 1, 1, 1]]), 3, projection=projection)
+
+    for item in results[0]:
+        assert item.metadata.id
+        assert [field.name for field in item.metadata.fields] == names
+    assert len(faiss_index_4d.metadatas[0].fields) == 2
+
+
+@pytest.mark.parametrize(
+    "projection",
+    [
+        None,
+        indices_pb2.MetadataProjection(return_fields=["is_even"]),
+        indices_pb2.MetadataProjection(ids_only=True),
+    ],
+)
+def test_query_encoded(faiss_index_4d, projection):
+    faiss_index_4d.load()
+    X = np.array([[1, 1, 1, 1]])
+
+    items = faiss_index_4d.query(X, 5, projection=projection)[0]
+    encoded = faiss_index_4d.query(X, 5, projection=projection, encoded=True)[0]
+
+    assert faiss_index_4d.metadata_blob is not None
+    assert [distance for distance, _ in encoded] == [
+        item.float_distance for item in items
+    ]
+    assert [content for _, content in encoded] == [
+        item.SerializeToString() for item in items
+    ]
+
+
+def test_query_metadata_filter_not_enabled(faiss_index_4d):
+    faiss_index_4d.load()
+    metadata_filter = indices_pb2.MetadataFilter(
+        conditions=[indices_pb2.MetadataCondition(name="is_even")]
+    )
+    with pytest.raises(UnsupportedIndexOperationException):
+        faiss_index_4d.query(np.array([[1, 1, 1, 1]]), 1, metadata_filter)
+
+
+def test_knn_search_params_ivf():
+    np.random.seed(42)
+    X = np.random.rand(1000, 4).astype("float32")
+    index = faiss.IndexIVFFlat(faiss.IndexFlatL2(4), 4, 16)
+    index.train(X)
+    index.add(X)
+    faiss_index = indexing.create_faiss_index_shard(index, [])
+
+    exact = faiss.IndexFlatL2(4)
+    exact.add(X)
+    _, expected = exact.search(X[:20], 10)
+    params = indices_pb2.SearchParams(nprobe=16)
+    _, idxs = faiss_index.knn_search(X[:20], 10, params=params)
+    _, default_idxs = faiss_index.knn_search(X[:20], 10)
+
+    assert np.array_equal(idxs, expected)
+    assert not np.array_equal(default_idxs, expected)
+    assert index.nprobe == 1
+
+    mask = np.arange(1000) % 2 == 0
+    _, idxs = faiss_index.knn_search(X[:20], 10, mask, params)
+    assert np.all(idxs % 2 == 0)
+
+
+def test_knn_search_params_hnsw():
+    np.random.seed(42)
+    X = np.random.rand(200, 4).astype("float32")
+    index = faiss.IndexHNSWFlat(4, 8)
+    index.hnsw.efSearch = 16
+    index.add(X)
+    faiss_index = indexing.create_faiss_index_shard(index, [])
+
+    params = indices_pb2.SearchParams(ef_search=64)
+    dists, idxs = faiss_index.knn_search(X[:5], 3, params=params)
+    assert np.array_equal(idxs[:, 0], np.arange(5))
+    assert index.hnsw.efSearch == 16
+
+
+@pytest.mark.parametrize(
+    "wrap",
+    [
+        lambda index: faiss.IndexIDMap2(index),
+        lambda index: faiss.IndexPreTransform(faiss.RandomRotationMatrix(4, 4), index),
+    ],
+)
+def test_knn_search_params_wrapped_hnsw(wrap):
+    np.random.seed(42)
+    X = np.random.rand(200, 4).astype("float32")
+    hnsw = faiss.IndexHNSWFlat(4, 8)
+    hnsw.hnsw.efSearch = 16
+    index = wrap(hnsw)
+    if isinstance(index, faiss.IndexIDMap):
+        index.add_with_ids(X, np.arange(len(X)))
+    else:
+        index.train(X)
+        index.add(X)
+    faiss_index = indexing.create_faiss_index_shard(index, [])
+
+    params = indices_pb2.SearchParams(ef_search=64)
+    search_params = faiss_index._faiss_search_params(params)
+    assert isinstance(search_params, faiss.SearchParametersHNSW)
+    assert search_params.efSearch == 64
+
+    _, idxs = faiss_index.knn_search(X[:5], 3, params=params)
+    assert np.array_equal(idxs[:, 0], np.arange(5))
+    assert hnsw.hnsw.efSearch == 16
+
+
+def test_write_matches_serialize(faiss_index_4d):
+    faiss_index_4d.load()
+    f = io.BytesIO()
+    faiss_index_4d.write(f)
+
+    proto = indices_pb2.FaissIndex.FromString(f.getvalue())
+    assert proto == faiss_index_4d.serialize()
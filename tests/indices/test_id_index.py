@@ -0,0 +1,19 @@
+from needlestack.indices.id_index import IdIndex
+
+
+def test_candidates():
+    ids = [f"id-{i}" for i in range(100)]
+    id_index = IdIndex.from_ids(ids)
+
+    assert len(id_index) == 100
+    for i, id in enumerate(ids):
+        assert list(id_index.candidates(id)) == [i]
+    assert len(id_index.candidates("missing")) == 0
+
+
+def test_frombuffer():
+    id_index = IdIndex.from_ids(["a", "b", "c"])
+    id_index_from_bytes = IdIndex.frombuffer(*id_index.tobytes())
+
+    assert list(id_index_from_bytes.candidates("b")) == [1]
+    assert not id_index_from_bytes.hashes.flags.owndata
@@ -0,0 +1,91 @@
+import pytest
+
+from needlestack.apis import indices_pb2
+from needlestack.apis import serializers
+from needlestack.exceptions import UnsupportedIndexOperationException
+from needlestack.indices.metadata_index import MetadataIndex
+
+
+@pytest.fixture
+def metadata_index():
+    ids = [str(i) for i in range(10)]
+    fields_list = [(i, i % 2 == 0, f"color-{i % 3}") for i in range(10)]
+    metadatas = serializers.metadata_list_to_proto(
+        ids, fields_list, ("long", "bool", "string"), ("num", "is_even", "color")
+    )
+    return MetadataIndex(metadatas)
+
+
+def rows(mask):
+    return [i for i, m in enumerate(mask) if m]
+
+
+def test_equals(metadata_index):
+    metadata_filter = indices_pb2.MetadataFilter(
+        conditions=[
+            indices_pb2.MetadataCondition(
+                name="is_even", equals=indices_pb2.MetadataField(bool_val=True)
+            ),
+            indices_pb2.MetadataCondition(
+                name="color", equals=indices_pb2.MetadataField(string_val="color-0")
+            ),
+        ]
+    )
+    assert rows(metadata_index.mask(metadata_filter)) == [0, 6]
+
+
+def test_range(metadata_index):
+    metadata_filter = indices_pb2.MetadataFilter(
+        conditions=[
+            indices_pb2.MetadataCondition(
+                name="num",
+                range=indices_pb2.MetadataRange(
+                    min=indices_pb2.MetadataField(long_val=3),
+                    max=indices_pb2.MetadataField(int_val=5),
+                ),
+            )
+        ]
+    )
+    assert rows(metadata_index.mask(metadata_filter)) == [3, 4, 5]
+
+
+def test_any_of(metadata_index):
+    values = [
+        indices_pb2.MetadataField(long_val=1),
+        indices_pb2.MetadataField(long_val=8),
+        indices_pb2.MetadataField(long_val=100),
+    ]
+    metadata_filter = indices_pb2.MetadataFilter(
+        conditions=[
+            indices_pb2.MetadataCondition(
+                name="num", any_of=indices_pb2.MetadataValues(values=values)
+            )
+        ]
+    )
+    assert rows(metadata_index.mask(metadata_filter)) == [1, 8]
+
+
+def test_unknown_field(metadata_index):
+    metadata_filter = indices_pb2.MetadataFilter(
+        conditions=[
+            indices_pb2.MetadataCondition(
+                name="missing", equals=indices_pb2.MetadataField(string_val="x")
+            )
+        ]
+    )
+    assert rows(metadata_index.mask(metadata_filter)) == []
+
+
+def test_range_not_numeric(metadata_index):
+    metadata_filter = indices_pb2.MetadataFilter(
+        conditions=[
+            indices_pb2.MetadataCondition(
+                name="color",
+                range=indices_pb2.MetadataRange(
+                    min=indices_pb2.MetadataField(string_val="a")
+                ),
+            )
+        ]
+    )
+    with pytest.raises(UnsupportedIndexOperationException):
+        metadata_index.mask(metadata_filter)
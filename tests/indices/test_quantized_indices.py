@@ -0,0 +1,123 @@
+import io
+
+import pytest
+import numpy as np
+
+from needlestack.apis import indices_pb2
+from needlestack.apis import indexing
+from needlestack.indices.quantized_indices import ScalarQuantizer
+
+
+@pytest.mark.parametrize("code_type", ["int8", "float16"])
+def test_quantizer_round_trip(code_type):
+    X = np.random.RandomState(0).normal(size=(100, 6)).astype("float32")
+    quantizer = ScalarQuantizer.train(X, code_type)
+    codes = quantizer.encode(X)
+
+    assert codes.dtype == code_type
+    assert np.abs(quantizer.decode(codes) - X).max() < 0.05
+    proto = quantizer.to_proto()
+    assert np.array_equal(ScalarQuantizer.from_proto(proto).scale, quantizer.scale)
+
+
+def test_load_memory_maps_vectors(scalar_quantized_index_8d):
+    with scalar_quantized_index_8d.fetch() as filename:
+        scalar_quantized_index_8d.load(filename)
+
+    assert scalar_quantized_index_8d.count == 200
+    assert scalar_quantized_index_8d.codes.dtype == "int8"
+    assert is_memory_mapped(scalar_quantized_index_8d.vectors)
+
+
+def test_load_streaming(scalar_quantized_index_8d):
+    scalar_quantized_index_8d.load()
+    assert scalar_quantized_index_8d.count == 200
+    assert is_memory_mapped(scalar_quantized_index_8d.vectors)
+
+
+@pytest.mark.parametrize("code_type", ["int8", "float16"])
+@pytest.mark.parametrize("inner_product", [False, True])
+def test_knn_search_matches_exact(code_type, inner_product):
+    rng = np.random.RandomState(1)
+    X = rng.normal(size=(500, 16)).astype("float32")
+    metadatas = [indices_pb2.Metadata(id=str(i)) for i in range(len(X))]
+    index = indexing.create_scalar_quantized_index_shard(
+        X, metadatas, code_type, inner_product
+    )
+    Q = rng.normal(size=(5, 16)).astype("float32")
+
+    dists, idxs = index.knn_search(Q, 10)
+
+    if inner_product:
+        exact = -(Q @ X.T)
+    else:
+        exact = ((Q[:, None, :] - X[None, :, :]) ** 2).sum(axis=2)
+    expected = np.argsort(exact, axis=1)[:, :10]
+    assert np.array_equal(idxs, expected)
+    assert np.allclose(
+        dists, np.take_along_axis(np.abs(exact), expected, axis=1), rtol=1e-4
+    )
+
+
+def test_knn_search_rerank_factor_param(scalar_quantized_index_8d):
+    scalar_quantized_index_8d.load()
+    X = np.ones((1, 8), dtype="float32")
+
+    _, idxs = scalar_quantized_index_8d.knn_search(
+        X, 1, params=indices_pb2.SearchParams(rerank_factor=200)
+    )
+    exact = ((scalar_quantized_index_8d.vectors - X) ** 2).sum(axis=1)
+    assert idxs[0, 0] == np.argmin(exact)
+    assert scalar_quantized_index_8d.rerank_factor == 4
+
+
+def test_query_metadata_filter(scalar_quantized_index_8d):
+    scalar_quantized_index_8d.enable_metadata_index = True
+    scalar_quantized_index_8d.load()
+
+    metadata_filter = indices_pb2.MetadataFilter(
+        conditions=[
+            indices_pb2.MetadataCondition(
+                name="int_id",
+                range=indices_pb2.MetadataRange(
+                    max=indices_pb2.MetadataField(int_val=2)
+                ),
+            )
+        ]
+    )
+    results = scalar_quantized_index_8d.query(np.ones((1, 8)), 10, metadata_filter)
+
+    assert sorted(item.metadata.id for item in results[0]) == ["id-0", "id-1", "id-2"]
+
+
+def test_retrieve_and_compact(scalar_quantized_index_8d):
+    scalar_quantized_index_8d.enable_id_to_vector = True
+    scalar_quantized_index_8d.load()
+    vector = scalar_quantized_index_8d.retrieve("id-5").vector
+
+    exclude = np.zeros(200, dtype=bool)
+    exclude[:100] = True
+    X = np.zeros((1, 8), dtype="float32")
+    compacted = scalar_quantized_index_8d.compact(
+        exclude, X, [indices_pb2.Metadata(id="new")]
+    )
+
+    assert compacted.count == 101
+    assert compacted.retrieve("id-5").vector.ByteSize() == 0
+    assert compacted.knn_search(X, 1)[1][0, 0] == compacted._get_index_by_id("new")
+    assert scalar_quantized_index_8d.retrieve("id-5").vector == vector
+
+
+def is_memory_mapped(X):
+    while X is not None and not isinstance(X, np.memmap):
+        X = X.base
+    return X is not None
+
+
+def test_write_matches_serialize(scalar_quantized_index_8d):
+    scalar_quantized_index_8d.load()
+    f = io.BytesIO()
+    scalar_quantized_index_8d.write(f)
+
+    proto = indices_pb2.ScalarQuantizedIndex.FromString(f.getvalue())
+    assert proto == scalar_quantized_index_8d.serialize()
@@ -0,0 +1,101 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from needlestack.apis import servicers_pb2
+from needlestack.exceptions import AdmissionRejectedException
+from needlestack.servicers.admission import AdmissionController
+from needlestack.utilities.metrics import MetricsRegistry
+
+HIGH = servicers_pb2.SearchRequest.HIGH
+NORMAL = servicers_pb2.SearchRequest.NORMAL
+LOW = servicers_pb2.SearchRequest.LOW
+
+
+def test_admit_rejects_after_queue_timeout():
+    metrics = MetricsRegistry()
+    controller = AdmissionController(
+        "searcher", 1, queue_timeout=0.01, high_priority_reserve=0, metrics=metrics
+    )
+
+    with controller.admit():
+        with pytest.raises(AdmissionRejectedException) as excinfo:
+            with controller.admit():
+                pass
+
+    assert excinfo.value.retry_after >= 0.01
+    assert controller.in_flight == 0
+    assert (
+        metrics.get("admission_rejected_total", servicer="searcher", priority="NORMAL")
+        == 1
+    )
+
+
+def test_admit_rejects_when_queue_is_full():
+    controller = AdmissionController("searcher", 1, queue_timeout=1.0, max_queue=0)
+
+    with controller.admit(HIGH):
+        with pytest.raises(AdmissionRejectedException):
+            with controller.admit(HIGH):
+                pass
+
+
+def test_admit_waits_for_a_slot():
+    controller = AdmissionController("searcher", 1, queue_timeout=5.0)
+    admitted = []
+
+    def wait_for_slot():
+        with controller.admit(HIGH):
+            admitted.append(controller.in_flight)
+
+    with controller.admit(HIGH):
+        thread = threading.Thread(target=wait_for_slot)
+        thread.start()
+        while not controller._waiters:
+            time.sleep(0.001)
+        assert not admitted
+    thread.join()
+
+    assert admitted == [1]
+    assert controller.in_flight == 0
+
+
+def test_limit_by_priority():
+    controller = AdmissionController(
+        "merger", 10, low_priority_share=0.5, high_priority_reserve=0.2
+    )
+
+    assert controller.limit(HIGH) == 10
+    assert controller.limit(NORMAL) == 8
+    assert controller.limit(LOW) == 5
+
+
+def test_admit_sheds_low_priority_first():
+    controller = AdmissionController(
+        "merger", 2, queue_timeout=0.01, low_priority_share=0.5
+    )
+
+    with controller.admit(LOW):
+        with pytest.raises(AdmissionRejectedException):
+            with controller.admit(LOW):
+                pass
+        with controller.admit(HIGH):
+            assert controller.in_flight == 2
+
+
+def test_admit_async():
+    controller = AdmissionController("searcher", 1, queue_timeout=0.01)
+
+    async def run():
+        async with controller.admit_async(HIGH):
+            with pytest.raises(AdmissionRejectedException):
+                async with controller.admit_async(HIGH):
+                    pass
+
+        async with controller.admit_async(HIGH):
+            return controller.in_flight
+
+    assert asyncio.run(run()) == 1
+    assert controller.in_flight == 0
@@ -0,0 +1,53 @@
+from concurrent import futures
+
+import numpy as np
+import pytest
+
+from needlestack.servicers.batching import SearchBatcher
+
+
+def row_sums(calls):
+    def search(X):
+        calls.append(len(X))
+        return list(X.sum(axis=1))
+
+    return search
+
+
+def test_submit_batches_concurrent_searches():
+    calls = []
+    batcher = SearchBatcher(window=1.0, max_batch_size=4)
+    X = np.arange(8, dtype="float32").reshape(4, 2)
+
+    with futures.ThreadPoolExecutor(4) as executor:
+        results = list(
+            executor.map(lambda x: batcher.submit("key", x, row_sums(calls)), X)
+        )
+
+    assert calls == [4]
+    assert results == list(X.sum(axis=1))
+
+
+def test_submit_separates_keys():
+    calls = []
+    batcher = SearchBatcher(window=0.05)
+
+    with futures.ThreadPoolExecutor(2) as executor:
+        results = list(
+            executor.map(
+                lambda key: batcher.submit(key, np.ones(2), row_sums(calls)),
+                ["a", "b"],
+            )
+        )
+
+    assert calls == [1, 1]
+    assert results == [2, 2]
+
+
+def test_submit_raises_search_error():
+    def fail(X):
+        raise ValueError("failed")
+
+    batcher = SearchBatcher(window=0.0)
+    with pytest.raises(ValueError):
+        batcher.submit("key", np.ones(2), fail)
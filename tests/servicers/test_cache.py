@@ -0,0 +1,83 @@
+from needlestack.servicers.cache import ResultCache
+from needlestack.utilities.metrics import MetricsRegistry
+
+
+def test_get_and_put():
+    metrics = MetricsRegistry()
+    cache = ResultCache(100, metrics)
+    key = ResultCache.key(b"query")
+
+    assert cache.get(key) is None
+    cache.put(key, b"response", [("collection", "shard")], 0)
+
+    assert cache.get(key) == b"response"
+    assert metrics.get("search_cache_hits_total") == 1
+    assert metrics.get("search_cache_misses_total") == 1
+    assert metrics.get("search_cache_hit_ratio") == 0.5
+    assert metrics.get("search_cache_bytes") == len(b"response")
+
+
+def test_key_separates_parts():
+    assert ResultCache.key(b"ab", b"c") != ResultCache.key(b"a", b"bc")
+
+
+def test_put_evicts_least_recently_used():
+    cache = ResultCache(10)
+    shards = [("collection", "shard")]
+    cache.put(b"a", b"1234", shards, 0)
+    cache.put(b"b", b"1234", shards, 0)
+    cache.get(b"a")
+    cache.put(b"c", b"1234", shards, 0)
+    cache.put(b"d", b"12345678901", shards, 0)
+
+    assert cache.get(b"a") == b"1234"
+    assert cache.get(b"b") is None
+    assert cache.get(b"c") == b"1234"
+    assert cache.get(b"d") is None
+    assert cache.size == 8
+
+
+def test_invalidate_shard():
+    cache = ResultCache(100)
+    cache.put(b"a", b"1", [("collection", "shard1")], 0)
+    cache.put(b"b", b"2", [("collection", "shard1"), ("collection", "shard2")], 0)
+    cache.put(b"c", b"3", [("collection", "shard2")], 0)
+    cache.put(b"d", b"4", [("other", "shard1")], 0)
+
+    cache.invalidate("collection", "shard1")
+
+    assert cache.get(b"a") is None
+    assert cache.get(b"b") is None
+    assert cache.get(b"c") == b"3"
+    assert cache.get(b"d") == b"4"
+
+    cache.invalidate("collection")
+    assert cache.get(b"c") is None
+    assert cache.size == 1
+
+
+def test_put_skips_results_from_before_invalidation():
+    cache = ResultCache(100)
+    generation = cache.generation([("collection", "shard")])
+    cache.invalidate("collection", "shard")
+
+    cache.put(b"a", b"stale", [("collection", "shard")], generation)
+
+    assert cache.get(b"a") is None
+
+
+def test_put_compares_generations_of_its_shards():
+    cache = ResultCache(100)
+    shards = [("collection", "shard1")]
+    generation = cache.generation(shards)
+
+    cache.invalidate("collection", "shard2")
+    cache.invalidate("other")
+    assert cache.generation(shards) == generation
+    cache.put(b"a", b"1", shards, generation)
+    assert cache.get(b"a") == b"1"
+
+    cache.invalidate("collection")
+    assert cache.generation(shards) != generation
+    cache.put(b"b", b"2", shards, generation)
+    assert cache.get(b"b") is None
@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from needlestack.apis import collections_pb2
+from needlestack.exceptions import AdmissionRejectedException
+from needlestack.servicers.executors import CollectionExecutor, CollectionExecutors
+
+
+def collection(name, **search_executor):
+    return collections_pb2.Collection(
+        name=name, search_executor=collections_pb2.SearchExecutor(**search_executor)
+    )
+
+
+def test_configure_splits_threads_by_weight():
+    executors = CollectionExecutors(threads=12)
+    executors.configure(
+        [
+            collection("small", weight=1),
+            collection("large", weight=2),
+            collection("fixed", max_concurrency=3, max_queue=1),
+            collections_pb2.Collection(name="shared"),
+        ]
+    )
+
+    assert executors.get("small").max_concurrency == 4
+    assert executors.get("large").max_concurrency == 8
+    assert executors.get("large").max_queue == 8
+    assert executors.get("fixed").max_concurrency == 3
+    assert executors.get("fixed").max_queue == 1
+    assert executors.get("shared") is None
+    executors.shutdown()
+
+
+def test_configure_groups_and_keeps_executors():
+    executors = CollectionExecutors(threads=4)
+    executors.configure(
+        [collection("a", group="tenant"), collection("b", group="tenant")]
+    )
+    executor = executors.get("a")
+
+    assert executors.get("b") is executor
+    assert executor.name == "tenant"
+
+    executors.configure([collection("a", group="tenant")])
+    assert executors.get("a") is executor
+    assert executors.get("b") is None
+    executors.shutdown()
+
+
+def test_run_on_executor_threads():
+    executor = CollectionExecutor("collection", 1)
+
+    def search():
+        return threading.current_thread().name, executor.run(lambda: "nested")
+
+    thread_name, nested = executor.run(search)
+
+    assert thread_name.startswith("search-collection")
+    assert nested == "nested"
+    assert executor.pending == 0
+    executor.shutdown()
+
+
+def test_submit_rejects_when_full():
+    executor = CollectionExecutor("collection", 1, max_queue=0)
+    release = threading.Event()
+
+    future = executor.submit(release.wait)
+    with pytest.raises(AdmissionRejectedException):
+        executor.submit(release.wait)
+    release.set()
+
+    assert future.result()
+    executor.shutdown()
+    assert executor.pending == 0
@@ -1,7 +1,133 @@
+import socket
+import subprocess
+import sys
+import textwrap
+import time
+from unittest.mock import MagicMock
+
+import grpc
+import pytest
+
+from needlestack.apis import collections_pb2
+from needlestack.apis import servicers_pb2
+from needlestack.apis import servicers_pb2_grpc
 from needlestack.servicers import factory
 from needlestack.cluster_managers import ClusterManager
+from needlestack.servicers.settings import BaseConfig
 
 
 def test_create_zookeeper_cluster_manager(test_servicer_tls_config):
     manager = factory.create_zookeeper_cluster_manager(test_servicer_tls_config)
     assert isinstance(manager, ClusterManager)
+
+
+SEARCHER_PROCESSES_SCRIPT = """
+import os
+import sys
+
+from needlestack.apis import collections_pb2
+from needlestack.apis import servicers_pb2
+from needlestack.apis import servicers_pb2_grpc
+from needlestack.servicers import factory
+from needlestack.servicers.settings import BaseConfig
+
+
+class Config(BaseConfig):
+    LOG_FILE = None
+    MAX_WORKERS = 2
+    HOSTNAME = "localhost"
+    SERVICER_PORT = int(sys.argv[1])
+
+
+class ClusterManager(object):
+    def list_local_collections(self, include_state=True):
+        return [collections_pb2.Collection(name="collection")]
+
+    def set_local_state(self, state, collection_name=None, shard_name=None):
+        return True
+
+
+class ReloadingSearcher(servicers_pb2_grpc.SearcherServicer):
+    config = Config()
+    cluster_manager = ClusterManager()
+    reload_collections = None
+    loads = 0
+    collections = 0
+
+    def load_collections(self):
+        self.loads += 1
+        self.collections = len(self.cluster_manager.list_local_collections())
+
+    def CollectionsLoad(self, request, context):
+        success = self.reload_collections()
+        return collections_pb2.CollectionsLoadResponse(success=success)
+
+    def Metrics(self, request, context):
+        return servicers_pb2.MetricsResponse(
+            metrics=[
+                servicers_pb2.Metric(name="pid", value=os.getpid()),
+                servicers_pb2.Metric(name="loads", value=self.loads),
+                servicers_pb2.Metric(name="collections", value=self.collections),
+            ]
+        )
+
+
+servicer = ReloadingSearcher()
+factory.serve_searcher_processes(
+    Config(),
+    servicer,
+    lambda server: servicers_pb2_grpc.add_SearcherServicer_to_server(servicer, server),
+    processes=2,
+)
+"""
+
+
+def test_serve_searcher_processes():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        port = s.getsockname()[1]
+    parent = subprocess.Popen(
+        [sys.executable, "-c", textwrap.dedent(SEARCHER_PROCESSES_SCRIPT), str(port)]
+    )
+    try:
+        with grpc.insecure_channel(f"localhost:{port}") as channel:
+            stub = servicers_pb2_grpc.SearcherStub(channel)
+            grpc.channel_ready_future(channel).result(timeout=30)
+            before = worker_metrics(stub)
+            workers = child_pids(parent.pid)
+            response = stub.CollectionsLoad(collections_pb2.CollectionsLoadRequest())
+            time.sleep(0.5)
+
+        with grpc.insecure_channel(f"localhost:{port}") as channel:
+            stub = servicers_pb2_grpc.SearcherStub(channel)
+            after = worker_metrics(stub)
+            assert child_pids(parent.pid) == workers
+    finally:
+        parent.terminate()
+        parent.wait(timeout=30)
+
+    assert response.success
+    assert before["loads"] == 0
+    assert after["loads"] == 1
+    assert after["collections"] == 1
+    assert after["pid"] in workers
+    assert parent.returncode == 0
+
+
+def worker_metrics(stub):
+    response = stub.Metrics(servicers_pb2.MetricsRequest())
+    return {metric.name: metric.value for metric in response.metrics}
+
+
+def child_pids(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return {int(child) for child in f.read().split()}
+
+
+def test_serve_searcher_processes_without_peer_transfer():
+    class Config(BaseConfig):
+        PEER_SHARD_TRANSFER = True
+
+    servicer = MagicMock(config=Config())
+    with pytest.raises(ValueError):
+        factory.serve_searcher_processes(Config(), servicer, MagicMock(), processes=1)
@@ -0,0 +1,340 @@
+import asyncio
+from unittest.mock import MagicMock
+
+import grpc
+
+import numpy as np
+
+from needlestack.apis import collections_pb2
+from needlestack.apis import indices_pb2
+from needlestack.apis import serializers
+from needlestack.apis import servicers_pb2
+from needlestack.apis import servicers_pb2_grpc
+from needlestack.apis.columns import items_to_columns
+from needlestack.servicers.merger import AioMergerServicer, MergerServicer
+from needlestack.utilities.bloom import BloomFilter
+from needlestack.utilities.shard_summary import ShardSummary
+
+
+def test_get_shards_for_ids():
+    shards = [
+        collections_pb2.Shard(
+            name="shard_a", id_filter=BloomFilter.from_ids(["a1", "a2"]).to_proto()
+        ),
+        collections_pb2.Shard(
+            name="shard_b", id_filter=BloomFilter.from_ids(["b1"]).to_proto()
+        ),
+        collections_pb2.Shard(name="shard_c"),
+    ]
+    cluster_manager = MagicMock()
+    cluster_manager.get_shards.return_value = shards
+    cluster_manager.get_collection.return_value = collections_pb2.Collection(
+        name="collection"
+    )
+    merger = MergerServicer(MagicMock(), cluster_manager)
+
+    shard_ids = merger.get_shards_for_ids("collection", [], ["a2", "b1"])
+    assert shard_ids == {
+        "shard_a": ["a2"],
+        "shard_b": ["b1"],
+        "shard_c": ["a2", "b1"],
+    }
+
+    id_filter = merger.get_id_filter("collection", shards[0])
+    assert merger.get_id_filter("collection", shards[0]) is id_filter
+
+
+def test_get_shards_for_ids_with_updates():
+    shards = [
+        collections_pb2.Shard(
+            name="shard_a", id_filter=BloomFilter.from_ids(["a1"]).to_proto()
+        )
+    ]
+    cluster_manager = MagicMock()
+    cluster_manager.get_shards.return_value = shards
+    cluster_manager.get_collection.return_value = collections_pb2.Collection(
+        name="collection", enable_updates=True
+    )
+    merger = MergerServicer(MagicMock(), cluster_manager)
+
+    assert merger.get_shards_for_ids("collection", [], ["new"]) == {"shard_a": ["new"]}
+
+
+def test_prune_shards():
+    shards = [
+        collections_pb2.Shard(
+            name="shard_a",
+            summary=ShardSummary(np.array([[0, 0]]), [1.0], [10]).to_proto(),
+        ),
+        collections_pb2.Shard(
+            name="shard_b",
+            summary=ShardSummary(np.array([[10, 10]]), [1.0], [10]).to_proto(),
+        ),
+        collections_pb2.Shard(name="shard_c"),
+    ]
+    cluster_manager = MagicMock()
+    cluster_manager.get_shards.return_value = shards
+    cluster_manager.get_collection.return_value = collections_pb2.Collection(
+        name="collection"
+    )
+    merger = MergerServicer(MagicMock(), cluster_manager)
+
+    X = np.array([0.5, 0.5], dtype="float32")
+    assert merger.prune_shards("collection", [], X, 5) == ["shard_c", "shard_a"]
+
+    summary = merger.get_shard_summary("collection", shards[0])
+    assert merger.get_shard_summary("collection", shards[0]) is summary
+
+    cluster_manager.get_collection.return_value.enable_updates = True
+    assert merger.prune_shards("collection", [], X, 5) == []
+
+
+def test_search_hostports_skip_pruning_with_filter():
+    shards = [
+        collections_pb2.Shard(
+            name="near",
+            summary=ShardSummary(np.array([[0, 0]]), [1.0], [10]).to_proto(),
+        ),
+        collections_pb2.Shard(
+            name="far",
+            summary=ShardSummary(np.array([[10, 10]]), [1.0], [10]).to_proto(),
+        ),
+    ]
+    cluster_manager = MagicMock()
+    cluster_manager.get_shards.return_value = shards
+    cluster_manager.get_collection.return_value = collections_pb2.Collection(
+        name="collection"
+    )
+    config = MagicMock()
+    config.MERGER_SHARD_PRUNING = True
+    config.MERGER_PRUNING_EPSILON = 0.0
+    merger = MergerServicer(config, cluster_manager)
+    merger.get_searcher_hostports = MagicMock(side_effect=lambda name, shards: shards)
+
+    request = servicers_pb2.SearchRequest(
+        vector=serializers.ndarray_to_proto(np.array([0.5, 0.5], dtype="float32")),
+        count=5,
+        collection_name="collection",
+    )
+    assert merger.get_search_hostports(request) == ["near"]
+
+    # Only vectors in the far shard match, so every shard is searched
+    request.filter.conditions.add(
+        name="color", equals=indices_pb2.MetadataField(string_val="red")
+    )
+    assert merger.get_search_hostports(request) == []
+
+
+class FakeSearcher(object):
+    """Searcher stub that serves search requests from a sorted list of distances,
+    in columns when asked if columnar is set"""
+
+    def __init__(self, distances, columnar=False):
+        self.items = [
+            indices_pb2.SearchResultItem(
+                float_distance=d, metadata=indices_pb2.Metadata(id=str(d))
+            )
+            for d in sorted(distances)
+        ]
+        self.columnar = columnar
+        self.requests = []
+        self.Search = MagicMock()
+        self.Search.future.side_effect = self.search
+
+    def search(self, request):
+        self.requests.append(request)
+        offset, count = request.offset, request.count
+        items = self.items[offset:count]
+        if request.HasField("bound"):
+            items = [i for i in items if i.float_distance <= request.bound.distance]
+        future = MagicMock()
+        if self.columnar and request.columnar:
+            response = servicers_pb2.SearchResponse(columns=items_to_columns(items))
+        else:
+            response = servicers_pb2.SearchResponse(items=items)
+        future.result.return_value = response
+        return future
+
+
+def test_search_merges_columns():
+    searchers = {
+        "host_a": FakeSearcher([0.0, 2.0, 4.0], columnar=True),
+        "host_b": FakeSearcher([1.0, 3.0]),
+    }
+    config = MagicMock()
+    config.MERGER_SHARD_PRUNING = False
+    config.MERGER_TWO_PHASE_MIN_COUNT = None
+    merger = MergerServicer(config, MagicMock())
+    merger.get_searcher_stub = searchers.get
+    merger.get_searcher_hostports = lambda *args: [
+        (hostport, ["shard"]) for hostport in searchers
+    ]
+    request = servicers_pb2.SearchRequest(count=4)
+
+    response = merger.Search(request, MagicMock())
+
+    assert all(s.requests[0].columnar for s in searchers.values())
+    assert [item.metadata.id for item in response.items] == ["0.0", "1.0", "2.0", "3.0"]
+    assert not response.HasField("columns")
+
+    request.columnar = True
+    response = merger.Search(request, MagicMock())
+    assert list(response.columns.ids) == ["0.0", "1.0", "2.0", "3.0"]
+    assert not response.items
+
+
+def test_two_phase_search():
+    searchers = {
+        "host_a": FakeSearcher(np.arange(0, 100, 1.0)),
+        "host_b": FakeSearcher(np.arange(0.5, 100, 2.0)),
+        "host_c": FakeSearcher(np.arange(1000, 1100, 1.0)),
+    }
+    config = MagicMock()
+    config.MERGER_TWO_PHASE_MIN_COUNT = 10
+    config.MERGER_TWO_PHASE_OVERSAMPLE = 1.0
+    merger = MergerServicer(config, MagicMock())
+    merger.get_searcher_stub = searchers.get
+    hostports_shards = [(hostport, ["shard"]) for hostport in searchers]
+    request = servicers_pb2.SearchRequest(count=30)
+
+    assert merger.use_two_phase(request, len(hostports_shards))
+    response = merger.two_phase_search(request, hostports_shards)
+
+    expected = sorted(
+        item.float_distance for s in searchers.values() for item in s.items
+    )[:30]
+    assert [item.float_distance for item in response.items] == expected
+    assert len(searchers["host_c"].requests) == 1
+    second = searchers["host_a"].requests[1]
+    assert (second.offset, second.count) == (10, 30)
+    assert second.bound.distance == 1009
+
+
+class FakeRpcError(grpc.RpcError):
+    def code(self):
+        return grpc.StatusCode.UNAVAILABLE
+
+    def details(self):
+        return "searcher down"
+
+
+def test_upsert_reports_failed_replicas():
+    def searcher(result):
+        future = MagicMock()
+        if isinstance(result, Exception):
+            future.exception.return_value = result
+        else:
+            future.exception.return_value = None
+            future.result.return_value = result
+        return MagicMock(**{"Upsert.future.return_value": future})
+
+    searchers = {
+        "host_a": searcher(servicers_pb2.UpsertResponse(count=2)),
+        "host_b": searcher(FakeRpcError()),
+        "host_c": searcher(servicers_pb2.UpsertResponse(count=2)),
+    }
+    merger = MergerServicer(MagicMock(), MagicMock())
+    merger.get_searcher_stub = searchers.get
+    request = servicers_pb2.UpsertRequest(collection_name="c", shard_name="s")
+    context = MagicMock()
+
+    merger.get_upsert_hostports = lambda request: ["host_a", "host_c"]
+    response = merger.Upsert(request, context)
+    assert (response.count, response.replicas) == (2, 2)
+    context.set_code.assert_not_called()
+
+    merger.get_upsert_hostports = lambda request: list(searchers)
+    response = merger.Upsert(request, context)
+    assert (response.count, response.replicas) == (2, 2)
+    context.set_code.assert_called_once_with(grpc.StatusCode.UNAVAILABLE)
+    details = context.set_details.call_args[0][0]
+    assert "2 of 3 replicas" in details and "host_b (searcher down)" in details
+
+
+def test_delete_reports_failed_and_unavailable_shards():
+    def searcher(result):
+        future = MagicMock()
+        if isinstance(result, Exception):
+            future.exception.return_value = result
+        else:
+            future.exception.return_value = None
+            future.result.return_value = result
+        return MagicMock(**{"Delete.future.return_value": future})
+
+    searchers = {
+        "host_a": searcher(servicers_pb2.DeleteResponse(count=1)),
+        "host_b": searcher(FakeRpcError()),
+        "host_c": searcher(FakeRpcError()),
+    }
+    cluster_manager = MagicMock()
+    cluster_manager.get_searchers.return_value = [
+        ("shard_a", ["host_a", "host_b"]),
+        ("shard_b", ["host_c"]),
+    ]
+    merger = MergerServicer(MagicMock(), cluster_manager)
+    merger.get_searcher_stub = searchers.get
+    request = servicers_pb2.DeleteRequest(
+        ids=["x"], collection_name="c", shard_names=["shard_a", "shard_b", "shard_c"]
+    )
+    context = MagicMock()
+
+    response = merger.Delete(request, context)
+    assert (response.count, response.unavailable_shards) == (1, 2)
+    context.set_code.assert_called_once_with(grpc.StatusCode.UNAVAILABLE)
+    details = context.set_details.call_args[0][0]
+    assert "shard_a on host_b (searcher down)" in details
+    assert "shard_b on host_c (searcher down)" in details
+    assert "shard_c (no active Searcher)" in details
+
+
+def test_aio_search_and_delete():
+    class AioFakeSearcher(servicers_pb2_grpc.SearcherServicer):
+        async def Search(self, request, context):
+            items = FakeSearcher([float(len(name)) for name in request.shard_names])
+            return servicers_pb2.SearchResponse(
+                columns=items_to_columns(items.items[: request.count])
+            )
+
+        async def Delete(self, request, context):
+            return servicers_pb2.DeleteResponse(count=len(request.ids))
+
+    async def search_and_delete():
+        server = grpc.aio.server()
+        servicers_pb2_grpc.add_SearcherServicer_to_server(AioFakeSearcher(), server)
+        hostport = f"localhost:{server.add_insecure_port('localhost:0')}"
+        await server.start()
+        try:
+            config = MagicMock()
+            config.MERGER_SHARD_PRUNING = False
+            config.MERGER_TWO_PHASE_MIN_COUNT = None
+            manager = MagicMock()
+            manager.get_shards.return_value = [
+                collections_pb2.Shard(name="shard_a"),
+                collections_pb2.Shard(name="shard_b"),
+            ]
+            manager.get_searchers.return_value = [
+                ("shard_a", [hostport]),
+                ("shard_b", [hostport, hostport]),
+            ]
+            merger = AioMergerServicer(config, manager)
+            merger.ssl_channel_credentials = None
+            merger.get_searcher_hostports = lambda *args: [
+                (hostport, ["a", "bbb"]),
+                (hostport, ["cc"]),
+            ]
+
+            search = await merger.Search(
+                servicers_pb2.SearchRequest(count=2), MagicMock()
+            )
+            delete = await merger.Delete(
+                servicers_pb2.DeleteRequest(ids=["x", "y"]), MagicMock()
+            )
+            await merger.close()
+            return search, delete
+        finally:
+            await server.stop(0)
+
+    search, delete = asyncio.run(search_and_delete())
+
+    assert [item.float_distance for item in search.items] == [1.0, 2.0]
+    assert delete.count == 4
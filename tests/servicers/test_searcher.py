@@ -0,0 +1,98 @@
+import os
+from unittest.mock import MagicMock
+
+import faiss
+import numpy as np
+import pytest
+
+from needlestack.apis import collections_pb2
+from needlestack.apis import data_sources_pb2
+from needlestack.apis import indices_pb2
+from needlestack.apis import indexing
+from needlestack.apis import serializers
+from needlestack.apis import servicers_pb2
+from needlestack.apis.columns import items_to_columns
+from needlestack.servicers.searcher import SearcherServicer
+from needlestack.servicers.settings import TestConfig
+
+
+class SearcherConfig(TestConfig):
+    SEARCH_ENCODED_RESPONSES = False
+    PEER_TRANSFER_CHUNK_SIZE = 64
+
+
+@pytest.fixture
+def shard_filename(tmpdir):
+    X = np.random.rand(20, 2).astype("float32")
+    faiss_index = faiss.IndexFlatL2(2)
+    faiss_index.add(X)
+    metadatas = [
+        indices_pb2.Metadata(
+            id=f"id_{i}",
+            fields=[indices_pb2.MetadataField(name="i", long_val=i)]
+            + (
+                [indices_pb2.MetadataField(name="odd", bool_val=True)] if i % 2 else []
+            ),
+        )
+        for i in range(20)
+    ]
+    filename = str(tmpdir.join("shard_1.pb"))
+    with open(filename, "wb") as f:
+        proto = indexing.create_faiss_index_shard(faiss_index, metadatas).serialize()
+        f.write(proto.SerializeToString())
+    yield filename
+
+
+@pytest.fixture
+def searcher(shard_filename):
+    index = indices_pb2.BaseIndex(
+        faiss_index=indices_pb2.FaissIndex(
+            data_source=data_sources_pb2.DataSource(
+                local_data_source=data_sources_pb2.LocalDataSource(
+                    filename=shard_filename
+                )
+            )
+        )
+    )
+    cluster_manager = MagicMock()
+    cluster_manager.list_local_collections.return_value = [
+        collections_pb2.Collection(
+            name="collection",
+            shards=[collections_pb2.Shard(name="shard_1", index=index)],
+        )
+    ]
+    yield SearcherServicer(SearcherConfig(), cluster_manager)
+
+
+def test_search_columnar_matches_items(searcher):
+    request = servicers_pb2.SearchRequest(
+        vector=serializers.ndarray_to_proto(np.array([0.5, 0.5], dtype="float32")),
+        count=5,
+        collection_name="collection",
+        shard_names=["shard_1"],
+    )
+    response = searcher.Search(request, MagicMock())
+    request.columnar = True
+    columnar_response = searcher.Search(request, MagicMock())
+
+    assert len(response.items) == 5
+    assert columnar_response.columns == items_to_columns(response.items)
+
+
+def test_shard_fetch_does_not_read_origin(searcher, shard_filename):
+    os.remove(shard_filename)
+
+    request = servicers_pb2.ShardFetchRequest(
+        collection_name="collection", shard_name="shard_1"
+    )
+    chunks = list(searcher.ShardFetch(request, MagicMock()))
+    assert len(chunks) > 1
+    assert all(len(chunk.content) <= 64 for chunk in chunks)
+
+    proto = indices_pb2.FaissIndex.FromString(
+        b"".join(chunk.content for chunk in chunks)
+    )
+    assert len(proto.metadatas) == 20
+    shard = searcher.collections["collection"].shards["shard_1"]
+    assert proto == shard.index.serialize()
+    assert all(chunk.fingerprint == shard.index.fingerprint for chunk in chunks)
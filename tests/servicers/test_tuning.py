@@ -0,0 +1,50 @@
+from needlestack.servicers.tuning import SearchTuner
+from needlestack.utilities.metrics import MetricsRegistry
+
+
+def make_tuner(**kwargs):
+    return SearchTuner(
+        "test",
+        0.01,
+        (1, 64),
+        (16, 256),
+        window=10,
+        steps=6,
+        metrics=MetricsRegistry(),
+        **kwargs,
+    )
+
+
+def test_params_bounds():
+    tuner = make_tuner()
+    assert tuner.params(0).nprobe == 1
+    assert tuner.params(0).ef_search == 16
+    assert tuner.params(6).nprobe == 64
+    assert tuner.params(6).ef_search == 256
+    assert tuner.params(3).nprobe == 8
+
+
+def test_adjusts_to_latency_target():
+    tuner = make_tuner()
+    for _ in range(10):
+        tuner.record(0.02)
+    assert tuner.level == 4
+    assert tuner.metrics.get("search_nprobe", collection="test") == 16
+
+    for _ in range(30):
+        tuner.record(0.02)
+    assert tuner.level == 0
+
+    for _ in range(10):
+        tuner.record(0.001)
+    assert tuner.level == 1
+    assert tuner.metrics.get("search_tuning_level", collection="test") == 1
+
+
+def test_overloaded_uses_cheapest_params():
+    tuner = make_tuner()
+    with tuner.track(overloaded=True) as params:
+        assert params.nprobe == 1
+    with tuner.track() as params:
+        assert params.nprobe == 64
+    assert tuner.metrics.get("search_overloaded_total", collection="test") == 1
@@ -0,0 +1,46 @@
+from needlestack.apis import indexing
+from needlestack.apis import indices_pb2
+from needlestack.utilities.bloom import BloomFilter, hash_ids
+
+
+def test_bloom_filter_contains_added_ids():
+    ids = [f"id-{i}" for i in range(1000)]
+    bloom = BloomFilter.from_ids(ids, false_positive_rate=0.01)
+
+    assert all(id in bloom for id in ids)
+    false_positives = sum(f"other-{i}" in bloom for i in range(1000))
+    assert false_positives < 50
+
+
+def test_bloom_filter_might_contain_hashes():
+    bloom = BloomFilter.from_ids(["a", "b", "c"])
+    found = bloom.might_contain_hashes(hash_ids(["a", "b", "c"]))
+    assert found.tolist() == [True, True, True]
+
+
+def test_bloom_filter_proto_round_trip():
+    bloom = BloomFilter.from_ids(["a", "b"])
+    bloom_from_proto = BloomFilter.from_proto(bloom.to_proto())
+
+    assert bloom_from_proto.num_bits == bloom.num_bits
+    assert bloom_from_proto.num_hashes == bloom.num_hashes
+    assert bloom_from_proto.tobytes() == bloom.tobytes()
+
+
+def test_bloom_filter_from_data_source(tmpdir):
+    bloom = BloomFilter.from_ids(["a", "b"])
+    filename = str(tmpdir.join("bloom.bin"))
+    with open(filename, "wb") as f:
+        f.write(bloom.tobytes())
+
+    proto = bloom.to_proto()
+    proto.ClearField("bits")
+    proto.data_source.local_data_source.filename = filename
+
+    assert "a" in BloomFilter.from_proto(proto)
+
+
+def test_create_id_filter():
+    metadatas = [indices_pb2.Metadata(id="a"), indices_pb2.Metadata(id="b")]
+    bloom = BloomFilter.from_proto(indexing.create_id_filter(metadatas))
+    assert "a" in bloom and "b" in bloom
@@ -0,0 +1,28 @@
+from needlestack.utilities.metrics import MetricsRegistry
+
+
+def test_gauges_and_counters():
+    registry = MetricsRegistry()
+    registry.set_gauge("level", 3, collection="a")
+    registry.set_gauge("level", 4, collection="a")
+    registry.increment("requests", collection="a")
+    registry.increment("requests", 2, collection="a")
+
+    assert registry.get("level", collection="a") == 4
+    assert registry.get("requests", collection="a") == 3
+    assert registry.get("requests", collection="b") == 0
+
+    proto = registry.to_proto()
+    assert [(m.name, dict(m.labels), m.value) for m in proto.metrics] == [
+        ("level", {"collection": "a"}, 4),
+        ("requests", {"collection": "a"}, 3),
+    ]
+
+
+def test_remove():
+    registry = MetricsRegistry()
+    registry.set_gauge("level", 1, collection="a", shard="1")
+    registry.set_gauge("level", 1, collection="b")
+    registry.remove(collection="a")
+
+    assert [m.labels["collection"] for m in registry.to_proto().metrics] == ["b"]
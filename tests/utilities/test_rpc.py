@@ -1,8 +1,16 @@
+import asyncio
+from concurrent import futures
 from unittest.mock import MagicMock
 
+import grpc
 import pytest
 from google.protobuf.message import Message
 
+from needlestack.apis import indices_pb2
+from needlestack.apis import servicers_pb2
+from needlestack.apis import servicers_pb2_grpc
+from needlestack.apis import wire
+from needlestack.servicers.admission import AdmissionController
 from needlestack.utilities import rpc
 
 
@@ -24,3 +32,142 @@ def test_unhandled_exception_rpc_exception():
     with pytest.raises(Exception) as excinfo:
         raise_exception(MagicMock(), Message(), MagicMock())
         assert expection_text == str(excinfo.value)
+
+
+def test_unhandled_exception_rpc_async():
+    error = grpc.aio.AioRpcError(
+        grpc.StatusCode.UNAVAILABLE,
+        grpc.aio.Metadata(),
+        grpc.aio.Metadata(),
+        details="searcher down",
+    )
+
+    @rpc.unhandled_exception_rpc(Message)
+    async def call_searcher(self, request, context):
+        raise error
+
+    context = MagicMock()
+    result = asyncio.run(call_searcher(MagicMock(), Message(), context))
+
+    assert isinstance(result, Message)
+    context.set_code.assert_called_once_with(grpc.StatusCode.UNAVAILABLE)
+    context.set_details.assert_called_once_with("searcher down")
+
+
+def test_encoded_response_interceptor():
+    item = indices_pb2.SearchResultItem(
+        float_distance=0.5, metadata=indices_pb2.Metadata(id="a")
+    )
+
+    class EncodingSearcher(servicers_pb2_grpc.SearcherServicer):
+        def Search(self, request, context):
+            if request.columnar:
+                return servicers_pb2.SearchResponse(descending=True)
+            return wire.encode_search_response([item.SerializeToString()])
+
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=1),
+        interceptors=[rpc.EncodedResponseInterceptor()],
+    )
+    servicers_pb2_grpc.add_SearcherServicer_to_server(EncodingSearcher(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        with rpc.create_channel(f"localhost:{port}") as channel:
+            stub = servicers_pb2_grpc.SearcherStub(channel)
+            encoded = stub.Search(servicers_pb2.SearchRequest())
+            message = stub.Search(servicers_pb2.SearchRequest(columnar=True))
+    finally:
+        server.stop(0)
+
+    assert list(encoded.items) == [item]
+    assert message.descending
+
+
+def test_unhandled_exception_rpc_admission():
+    class Servicer(object):
+        admission = AdmissionController("searcher", 1, queue_timeout=0.01)
+
+        @rpc.unhandled_exception_rpc(servicers_pb2.SearchResponse)
+        def Search(self, request, context):
+            return self.Nested(request, context)
+
+        @rpc.unhandled_exception_rpc(servicers_pb2.SearchResponse)
+        def Nested(self, request, context):
+            return servicers_pb2.SearchResponse(descending=True)
+
+    servicer, context = Servicer(), MagicMock()
+    request = servicers_pb2.SearchRequest(priority=servicers_pb2.SearchRequest.HIGH)
+
+    with servicer.admission.admit():
+        result = servicer.Search(request, context)
+
+    assert result == servicers_pb2.SearchResponse()
+    context.set_code.assert_called_once_with(grpc.StatusCode.RESOURCE_EXHAUSTED)
+    ((key, value),) = context.set_trailing_metadata.call_args[0][0]
+    assert key == rpc.RETRY_PUSHBACK_KEY and int(value) >= 10
+
+    assert servicer.Search(request, MagicMock()).descending
+    assert servicer.admission.in_flight == 0
+
+
+def test_unhandled_exception_rpc_stream_admission():
+    class Servicer(object):
+        admission = AdmissionController("searcher", 4, queue_timeout=0.01)
+
+        @rpc.unhandled_exception_rpc(
+            servicers_pb2.ShardChunk, servicers_pb2.SearchRequest.LOW
+        )
+        def ShardFetch(self, request, context):
+            yield servicers_pb2.ShardChunk(content=b"first")
+            yield servicers_pb2.ShardChunk(content=b"second")
+
+    servicer, request = Servicer(), servicers_pb2.ShardFetchRequest()
+    chunks = servicer.ShardFetch(request, MagicMock())
+    assert next(chunks).content == b"first"
+    assert servicer.admission.in_flight == 1
+
+    # Low priority RPCs may only hold half of the slots
+    context = MagicMock()
+    with servicer.admission.admit():
+        assert list(servicer.ShardFetch(request, context)) == []
+    context.set_code.assert_called_once_with(grpc.StatusCode.RESOURCE_EXHAUSTED)
+
+    assert [chunk.content for chunk in chunks] == [b"second"]
+    assert servicer.admission.in_flight == 0
+
+
+def test_unhandled_exception_rpc_async_stream_admission():
+    class Servicer(object):
+        admission = AdmissionController("searcher", 2, queue_timeout=0.01)
+
+        @rpc.unhandled_exception_rpc(
+            servicers_pb2.ShardChunk, servicers_pb2.SearchRequest.LOW
+        )
+        async def ShardFetch(self, request, context):
+            yield servicers_pb2.ShardChunk(content=b"chunk")
+
+    async def fetch(servicer, context):
+        chunks = servicer.ShardFetch(servicers_pb2.ShardFetchRequest(), context)
+        return [chunk async for chunk in chunks]
+
+    servicer, context = Servicer(), MagicMock()
+    assert len(asyncio.run(fetch(servicer, MagicMock()))) == 1
+    with servicer.admission.admit():
+        assert asyncio.run(fetch(servicer, context)) == []
+    context.set_code.assert_called_once_with(grpc.StatusCode.RESOURCE_EXHAUSTED)
+    assert servicer.admission.in_flight == 0
+
+
+def test_unhandled_exception_rpc_stream(caplog):
+    @rpc.unhandled_exception_rpc(servicers_pb2.ShardChunk)
+    def stream_chunks(self, request, context):
+        yield servicers_pb2.ShardChunk(content=b"first")
+        raise Exception("read failed")
+
+    chunks = stream_chunks(MagicMock(), Message(), MagicMock())
+
+    assert next(chunks).content == b"first"
+    with pytest.raises(Exception, match="read failed"):
+        next(chunks)
+    assert "read failed" in caplog.text
@@ -0,0 +1,71 @@
+import pytest
+import numpy as np
+
+from needlestack.utilities.shard_summary import ShardSummary, select_shards
+
+
+def clustered_shards(num_shards=8, size=200, dimension=4, seed=0):
+    rng = np.random.RandomState(seed)
+    centers = rng.uniform(-100, 100, size=(num_shards, dimension))
+    return {
+        f"shard_{i}": (center + rng.normal(size=(size, dimension))).astype("float32")
+        for i, center in enumerate(centers)
+    }
+
+
+def test_summary_covers_vectors():
+    X = clustered_shards()["shard_0"]
+    summary = ShardSummary.from_vectors(X, num_centroids=4)
+
+    assert summary.counts.sum() == len(X)
+    lower, upper = summary.bounds(X)
+    dists = np.linalg.norm(X[:, None, :] - summary.centroids[None, :, :], axis=2)
+    assert np.all(lower.min(axis=1) <= dists.min(axis=1) + 1e-4)
+
+    proto = summary.to_proto()
+    assert np.array_equal(ShardSummary.from_proto(proto).radii, summary.radii)
+
+
+@pytest.mark.parametrize("inner_product", [False, True])
+def test_select_shards_exact(inner_product):
+    shards = clustered_shards()
+    summaries = {
+        name: ShardSummary.from_vectors(X, 4, inner_product)
+        for name, X in shards.items()
+    }
+    names = list(shards)
+    X_all = np.vstack([shards[name] for name in names])
+    owners = np.repeat(names, [len(shards[name]) for name in names])
+    queries = shards["shard_3"][:5] + 0.5
+
+    selected = select_shards(summaries, queries, 10)
+
+    if inner_product:
+        nearest = np.argsort(-(queries @ X_all.T), axis=1)[:, :10]
+    else:
+        dists = ((queries[:, None, :] - X_all[None, :, :]) ** 2).sum(axis=2)
+        nearest = np.argsort(dists, axis=1)[:, :10]
+    assert set(owners[nearest].ravel()) <= set(selected)
+    if not inner_product:
+        assert selected == ["shard_3"]
+
+
+def test_select_shards_keeps_unsummarized():
+    shards = clustered_shards(num_shards=2)
+    summaries = {"shard_0": ShardSummary.from_vectors(shards["shard_0"]), "other": None}
+    assert select_shards(summaries, shards["shard_0"][:1], 5) == ["other", "shard_0"]
+    assert select_shards(summaries, shards["shard_0"][:1], 10000) == [
+        "shard_0",
+        "other",
+    ]
+
+
+def test_select_shards_epsilon():
+    summaries = {
+        "near": ShardSummary(np.array([[0, 0]]), [1.0], [10]),
+        "far": ShardSummary(np.array([[0, 3]]), [1.0], [10]),
+    }
+    query = np.array([[0, 0.5]])
+
+    assert select_shards(summaries, query, 5) == ["near", "far"]
+    assert select_shards(summaries, query, 5, epsilon=0.9) == ["near"]